@@ -3,10 +3,11 @@ import colorama
 from os import path, makedirs, listdir, remove
 from time import strftime
 import subprocess
-from sys import executable
+from sys import executable, argv
 import shutil
 
-from lib import CoMPaseD_gui_param_functions, CoMPaseD_gui_export_functions
+from lib import CoMPaseD_gui_param_functions, CoMPaseD_gui_export_functions, CoMPaseD_peptide_lookup
+from lib.CoMPaseD_table_io import table_format_choices, resolve_table_format, table_file_name, write_table
 
 colorama.init()
 
@@ -20,6 +21,10 @@ class BlankLinesHelpFormatter (argparse.HelpFormatter):
 
 
 def main():
+    # 'map' looks up ad-hoc peptide lists and does not use a parameter file
+    if (len(argv) > 1) and (argv[1] == 'map'):
+        raise SystemExit(CoMPaseD_peptide_lookup.main(argv[2:], prog=f"{path.basename(argv[0])} map"))
+
     parser = argparse.ArgumentParser(description="CoMPaseD - Comparison of Multiple-Protease Digestions",
                                      formatter_class=BlankLinesHelpFormatter)
 
@@ -32,11 +37,26 @@ def main():
     main_args.add_argument('-d', '--digest', help='perform in-silico digest using crux toolkit', action='store_true')
     main_args.add_argument('-a', '--analysis', help='perform analysis from simulated protein abundance and in-silico digestion', action='store_true')
 
+    # table format arguments
+    table_args = parser.add_argument_group("Table Format")
+    table_args.add_argument('--table_format', help="format of protein weight file, pooled peptide tables, sampling output and result tables handed over between export, digestion and analysis, binary columnar formats ('parquet', 'feather') require the pyarrow package and load faster (default = tsv, pooled peptide tables of --use_original_proteomapper are always tab-separated)", default='tsv', choices=table_format_choices)
+    table_args.add_argument('--export_tsv', help='write tab-separated copies of all tables written in a binary format', action='store_true')
+
     # digestion arguments
     digestion_args = parser.add_argument_group("Digestion Mode Arguments (required when no mode or -d is provided)")
     digestion_args.add_argument('--use_original_proteomapper', help='use original perl scripts for mapping in-silico digested peptides, this might be slower but requires less memory (try to use when large databases permit usage of python implementation)', action='store_true')
     digestion_args.add_argument('--differentiate_I_L', help='distinguish between peptide variants containing leucine or iso-leucine (default treat as identical)', action='store_false')
-    digestion_args.add_argument('--indexing_key_len', help='length in amino acids of the indexing keys for mapping, shorter length result in longer mapping times while longer increase memory load (default = 5, min = 2, max = 6)', default=5, type=int)
+    digestion_args.add_argument('--digestion_engine', help="digest with crux toolkit ('crux') or the built-in python digestion that does not require crux ('native'), falls back to 'native' when crux is not found (default = crux)", default="crux", choices=['crux', 'native'], type=str)
+    digestion_args.add_argument('--threads', help='maximal number of parallel crux, clips, promast or peptide mapping processes (default = number of cores - 1)', default=None, type=int)
+    digestion_args.add_argument('--promast_threads', help='threads of each promast process with --use_original_proteomapper, --threads / --promast_threads digests are mapped at a time (default = 1)', default=1, type=int)
+    digestion_args.add_argument('--streaming', help='map and pool digests in chunks without writing intermediate files (not available with --use_original_proteomapper)', action='store_true')
+    digestion_args.add_argument('--digest_cache_dir', help='folder to store mapped digests and re-use them in runs with identical fasta file and digestion settings, disabled if empty (default = "", not available with --use_original_proteomapper)', default="", type=str)
+    digestion_args.add_argument('--incremental', help='re-use protease and missed cleavage combinations of a previous digest in the output directory and digest only new ones (not available with --use_original_proteomapper)', action='store_true')
+    digestion_args.add_argument('--mapping_engine', help="map peptides with the k-mer fasta index ('index'), an Aho-Corasick automaton per digest ('aho-corasick', requires the pyahocorasick package), a suffix array of the fasta file ('suffix-array', suited for large and metaproteomic databases), proteins and positions from the built-in digestion without mapping ('provenance') or the original perl scripts ('proteomapper', same as --use_original_proteomapper) (default = index)", default="index", choices=['index', 'aho-corasick', 'suffix-array', 'provenance', 'proteomapper'], type=str)
+    digestion_args.add_argument('--provenance_check', help="with --mapping_engine provenance, also report matches of digested peptides at non-cleavage sites by an exact search in the complete proteome", action='store_true')
+    digestion_args.add_argument('--index_memory_budget', help="split the fasta index into shards of consecutive proteins that are built within this many MB and searched one after the other, for databases too large for one index (default = 0, one index for all proteins, not available with --use_original_proteomapper)", default=0, type=int)
+    digestion_args.add_argument('--pooling', help="pool mapped digests in memory or on disk with external sorting, the latter for pooled tables larger than the available memory (default = memory, not available with --use_original_proteomapper)", default='memory', choices=['memory', 'external'])
+    digestion_args.add_argument('--indexing_key_len', help="length in amino acids of the indexing keys for mapping, shorter length result in longer mapping times while longer increase memory load, several lengths (e.g. 4,7) map each peptide with the longest usable key and 'auto' chooses them from proteome size and minimal peptide length (default = 5)", default='5', type=str)
 
     # analysis arguments
     analysis_args = parser.add_argument_group("Analysis Mode Arguments (required when no mode or -a is provided)")
@@ -332,10 +352,16 @@ def run_export(param_obj: CoMPaseD_gui_param_functions.CoMPaseD_Parameter, file_
         remove(pwf_file_name)
     except OSError:
         pass
+    # binary protein weight files replace the tab-separated file name given in the parameter file
+    table_format = resolve_table_format(args.table_format)
+    if not table_format == 'tsv':
+        if args.export_tsv:
+            protein_df.to_csv(pwf_file_name, index=False, sep="\t")
+        pwf_file_name = table_file_name(pwf_file_name, table_format)
     # set pwf to this file name
     param_obj.Protein_weight_file = pwf_file_name
     param_obj.save_params_to_file_from_cli(param_file_name)
-    protein_df.to_csv(pwf_file_name, index=False, sep="\t")
+    write_table(protein_df, pwf_file_name, dictionary_cols=['Group'])
 
 
 def run_digest(param_obj: CoMPaseD_gui_param_functions.CoMPaseD_Parameter, args):
@@ -349,7 +375,7 @@ def run_digest(param_obj: CoMPaseD_gui_param_functions.CoMPaseD_Parameter, args)
     elif shutil.which("python") is not None:
         python_exec = shutil.which("python")
 
-    if args.use_original_proteomapper:
+    if args.use_original_proteomapper or (args.mapping_engine == 'proteomapper'):
         file_location = path.dirname(path.realpath(__file__))
         CoMPaseD_CruxScript = path.join(file_location, 'lib','CoMPaseD_crux_script.py')
 
@@ -381,6 +407,10 @@ def run_digest(param_obj: CoMPaseD_gui_param_functions.CoMPaseD_Parameter, args)
                      str(param_obj.Max_Pep_Len),
                      "--unique_peps_file",
                      param_obj.Digestion_result_file]
+        if args.threads is not None:
+            args_list.extend(["--threads", str(args.threads)])
+        if args.promast_threads > 1:
+            args_list.extend(["--promast_threads", str(args.promast_threads)])
         if not python_exec == "":
             completed_process = subprocess.run(args_list)
     else:
@@ -410,10 +440,32 @@ def run_digest(param_obj: CoMPaseD_gui_param_functions.CoMPaseD_Parameter, args)
                     "--unique_peps_file",
                     param_obj.Digestion_result_file,
                     "--indexing_key_len",
-                    str(param_obj.Indexing_key_len)
+                    str(param_obj.Indexing_key_len),
+                    "--digestion_engine",
+                    args.digestion_engine
                     ]
+        if args.threads is not None:
+            args_list.extend(["--threads", str(args.threads)])
         if not param_obj.Differentiate_I_L:
             args_list.append("--differentiate_I_L")
+        if args.streaming:
+            args_list.append("--streaming")
+        if not args.mapping_engine == "index":
+            args_list.extend(["--mapping_engine", args.mapping_engine])
+        if args.provenance_check:
+            args_list.append("--provenance_check")
+        if args.index_memory_budget > 0:
+            args_list.extend(["--index_memory_budget", str(args.index_memory_budget)])
+        if not args.table_format == 'tsv':
+            args_list.extend(["--table_format", args.table_format])
+        if args.export_tsv:
+            args_list.append("--export_tsv")
+        if not args.pooling == 'memory':
+            args_list.extend(["--pooling", args.pooling])
+        if args.incremental:
+            args_list.append("--incremental")
+        if not args.digest_cache_dir == "":
+            args_list.extend(["--digest_cache_dir", path.abspath(args.digest_cache_dir)])
 
         if not python_exec == "":
             completed_process = subprocess.run(args_list)
@@ -438,6 +490,10 @@ def run_analysis(param_obj: CoMPaseD_gui_param_functions.CoMPaseD_Parameter, par
                  path.join(param_file_name),
                  "--digestion_result",
                  param_obj.Digestion_result_file]
+    if not args.table_format == 'tsv':
+        args_list.extend(["--table_format", args.table_format])
+    if args.export_tsv:
+        args_list.append("--export_tsv")
 
     if not python_exec == "":
         completed_process = subprocess.run(args_list)
@@ -2,16 +2,63 @@ import argparse
 import os
 import re
 import colorama
-from multiprocessing import Process
-from subprocess import Popen, PIPE
-from datetime import datetime
 from time import perf_counter
-from Bio import SeqIO
 from os import path, remove, makedirs, chdir, listdir
-from pandas import read_csv, DataFrame, Series, concat
-from shutil import copy, rmtree
-import itertools
-import pickle
+from pandas import read_csv, DataFrame
+from shutil import copy, copyfileobj, rmtree
+import json
+
+try:
+    from lib.CoMPaseD_process_runner import run_commands, commands_failed, default_worker_number
+except ModuleNotFoundError:
+    from CoMPaseD_process_runner import run_commands, commands_failed, default_worker_number
+
+try:
+    from lib.CoMPaseD_mapping_engines import mapping_engine_choices, resolve_mapping_engine, iter_engine_mappings, \
+        engine_index_type, MappingMemo
+except ModuleNotFoundError:
+    from CoMPaseD_mapping_engines import mapping_engine_choices, resolve_mapping_engine, iter_engine_mappings, \
+        engine_index_type, MappingMemo
+
+try:
+    from lib.CoMPaseD_fasta_index import FastaIndex, MultiKeyIndex, SuffixArrayIndex, ShardedIndex, index_classes, \
+        index_file_name, resolve_alphabet, check_index, is_single_key_len, indexed_fasta_checksum
+except ModuleNotFoundError:
+    from CoMPaseD_fasta_index import FastaIndex, MultiKeyIndex, SuffixArrayIndex, ShardedIndex, index_classes, \
+        index_file_name, resolve_alphabet, check_index, is_single_key_len, indexed_fasta_checksum
+
+try:
+    from lib.CoMPaseD_digest_cache import fasta_checksum, digestion_settings, mapped_digest_cache_entries, \
+        is_cached, store_mapped_digest, iter_cached_mappings, cache_mapped_rows, mapped_digest_header
+except ModuleNotFoundError:
+    from CoMPaseD_digest_cache import fasta_checksum, digestion_settings, mapped_digest_cache_entries, \
+        is_cached, store_mapped_digest, iter_cached_mappings, cache_mapped_rows, mapped_digest_header
+
+try:
+    from lib.CoMPaseD_external_pool import external_pool_mapped_digests
+except ModuleNotFoundError:
+    from CoMPaseD_external_pool import external_pool_mapped_digests
+
+try:
+    from lib.CoMPaseD_table_io import table_format_choices, resolve_table_format, find_table_file, read_table, \
+        convert_tsv_table
+except ModuleNotFoundError:
+    from CoMPaseD_table_io import table_format_choices, resolve_table_format, find_table_file, read_table, \
+        convert_tsv_table
+
+try:
+    from lib.CoMPaseD_digest import handle_custom_proteases, load_fasta_sequences, digest_proteome_mc_levels, \
+        split_by_missed_cleavages, digest_proteome_provenance
+except ModuleNotFoundError:
+    from CoMPaseD_digest import handle_custom_proteases, load_fasta_sequences, digest_proteome_mc_levels, \
+        split_by_missed_cleavages, digest_proteome_provenance
+
+
+# maximal number of mapped peptides kept in memory before writing in streaming mode
+streaming_chunk_size = 200000
+
+# string columns of the pooled tables that are dictionary-encoded in binary table formats
+pooled_dictionary_cols = ['protein', 'Enzyme']
 
 
 def main():
@@ -19,7 +66,9 @@ def main():
     parser.add_argument('--fasta', required=True)
     parser.add_argument('--out_folder', required=True)
 
-    parser.add_argument('--crux_path', required=True)
+    parser.add_argument('--crux_path', required=False, default='')
+    parser.add_argument('--digestion_engine', required=False, default='crux', choices=['crux', 'native'],
+                        help="use crux generate-peptides or the built-in python digestion (does not require crux)")
     parser.add_argument('--enzyme_list', required=True)
     parser.add_argument('--max_mc_list', help='maximum missed cleavage sites', required=True)
     parser.add_argument('--min_mass', required=False, default=400)
@@ -31,8 +80,36 @@ def main():
     parser.add_argument('--decoy_format', required=False, default='None')
     parser.add_argument('--unique_peps_file', required=False, default='')
 
-    parser.add_argument('--indexing_key_len', required=False, default=5)
+    parser.add_argument('--indexing_key_len', required=False, default=5,
+                        help="index key length, several lengths (e.g. 4,7) or 'auto' to choose them from proteome "
+                             "size and min_len")
     parser.add_argument('--differentiate_I_L', action='store_false')
+    parser.add_argument('--mapping_engine', required=False, default='index', choices=mapping_engine_choices,
+                        help="map peptides with the k-mer fasta index, an Aho-Corasick automaton per digest, a suffix array "
+                             "of the fasta file (suited for large databases) or keep proteins and positions from the "
+                             "built-in digestion without mapping ('provenance')")
+    parser.add_argument('--provenance_check', action='store_true',
+                        help="with provenance mapping, also report matches of digested peptides at non-cleavage sites "
+                             "by an exact search in the complete proteome")
+    parser.add_argument('--index_memory_budget', required=False, default=0, type=int,
+                        help="split the fasta index into shards of consecutive proteins that are built within this "
+                             "many MB and searched one after the other (0: one index for all proteins), peptides shared "
+                             "by several digests are only mapped once if all digests fit this budget")
+    parser.add_argument('--threads', required=False, default=None, type=int,
+                        help="maximal number of parallel processes (default: number of cores - 1)")
+    parser.add_argument('--streaming', action='store_true',
+                        help="map and pool digests in chunks without writing intermediate files")
+    parser.add_argument('--pooling', required=False, default='memory', choices=['memory', 'external'],
+                        help="remove repeated peptide matches in memory or by sorting on disk ('external') for pooled "
+                             "tables larger than memory, the external filtered table also holds protein_count")
+    parser.add_argument('--table_format', required=False, default='tsv', choices=table_format_choices,
+                        help="format of the pooled tables, binary columnar formats require pyarrow")
+    parser.add_argument('--export_tsv', action='store_true',
+                        help="keep tab-separated copies of pooled tables written in a binary format")
+    parser.add_argument('--digest_cache_dir', required=False, default='',
+                        help="folder to store and re-use mapped digests, caching is disabled if empty")
+    parser.add_argument('--incremental', action='store_true',
+                        help="re-use protease/MC combinations from the pooled tables in out_folder and digest only new ones")
 
 
     # get start time
@@ -44,15 +121,6 @@ def main():
     print(f"In-silico digestion started", flush=True)
     print(f"", flush=True)
     print(f"---------------------------------------------------------------------------", flush=True)
-    print(f"Using Crux mass spectrometry toolkit for digestion", flush=True)
-    print(f"\tfor a detailed description please see:", flush=True)
-    print(f"\tSean McIlwain, Kaipo Tamura, Attila Kertesz-Farkas, Charles E. Grant, Benjamin Diament, Barbara Frewen,")
-    print(f"\tJ. Jeffry Howbert, Michael R. Hoopmann, Lukas Käll, Jimmy K. Eng, Michael, J.MacCoss and William S. Noble:",
-        flush=True)
-    print(f"\tCrux: rapid open source protein tandem mass spectrometry analysis.")
-    print(f"\tJournal of Proteome Research. 13(10):4488-4491, 2014.", flush=True)
-    print(f"\tDOI: 10.1021/pr500741y", flush=True)
-    print("---------------------------------------------------------------------------", flush=True)
 
     # switches to remove non-existing dirs later
     tmp_exists = False
@@ -61,10 +129,13 @@ def main():
     # parse arguments
     args = parser.parse_args()
 
-    fasta = args.fasta
+    fasta = os.path.abspath(args.fasta)
     out_folder = args.out_folder
     if not os.path.isabs(out_folder):
         out_folder = os.path.abspath(out_folder)
+    cache_dir = args.digest_cache_dir
+    if not cache_dir == '':
+        cache_dir = os.path.abspath(cache_dir)
 
     # create output folders if necessary
     tmp_out_folder = path.join(out_folder, 'Tmp')
@@ -82,7 +153,6 @@ def main():
     # change directory to tmp_out_folder, all crux output will be in this folder
     chdir(tmp_out_folder)
 
-    print("Start digest:", flush=True)
     crux_path = path.join(args.crux_path)
     # clean crux_path in case it contains escape chr's and is not found initially
     # solution from https://stackoverflow.com/questions/18682695/python-escape-character
@@ -98,7 +168,38 @@ def main():
 
         crux_path = path.join(reconstruct_broken_string(crux_path))
 
-    fasta = path.join(args.fasta)
+    # crux is optional, fall back to the built-in digestion when it cannot be found
+    digestion_engine = args.digestion_engine
+    threads = args.threads if args.threads is not None else default_worker_number()
+    mapping_engine = resolve_mapping_engine(args.mapping_engine)
+    table_format = resolve_table_format(args.table_format)
+    if (digestion_engine == 'crux') and (not path.isfile(crux_path)):
+        print(f"{colorama.Fore.CYAN}WARNING: Crux executable ({crux_path}) not found. Using built-in digestion instead.{colorama.Style.RESET_ALL}", flush=True)
+        digestion_engine = 'native'
+    # proteins and positions of peptides are only known from the built-in digestion
+    provenance = (mapping_engine == 'provenance')
+    if provenance and (digestion_engine == 'crux'):
+        print(f"{colorama.Fore.CYAN}WARNING: Provenance mapping requires the built-in digestion. Using built-in digestion instead.{colorama.Style.RESET_ALL}", flush=True)
+        digestion_engine = 'native'
+    # engine for peptide lookups in the proteome, only required for provenance mapping with exact-match check
+    lookup_engine = 'index' if provenance else mapping_engine
+    peptide_mapping = 'provenance' if (provenance and not args.provenance_check) else 'exact'
+
+    if digestion_engine == 'crux':
+        print(f"Using Crux mass spectrometry toolkit for digestion", flush=True)
+        print(f"\tfor a detailed description please see:", flush=True)
+        print(f"\tSean McIlwain, Kaipo Tamura, Attila Kertesz-Farkas, Charles E. Grant, Benjamin Diament, Barbara Frewen,")
+        print(f"\tJ. Jeffry Howbert, Michael R. Hoopmann, Lukas Käll, Jimmy K. Eng, Michael, J.MacCoss and William S. Noble:",
+            flush=True)
+        print(f"\tCrux: rapid open source protein tandem mass spectrometry analysis.")
+        print(f"\tJournal of Proteome Research. 13(10):4488-4491, 2014.", flush=True)
+        print(f"\tDOI: 10.1021/pr500741y", flush=True)
+    else:
+        print(f"Using built-in python implementation for digestion", flush=True)
+        print(f"\tcleavage rules follow the crux enzyme definitions", flush=True)
+    print("---------------------------------------------------------------------------", flush=True)
+
+    fasta = path.join(fasta)
     out_folder = path.join(out_folder)
     proteases_string = args.enzyme_list
     mc_string = args.max_mc_list
@@ -108,8 +209,68 @@ def main():
     max_pep_mw = args.max_mass
     min_pep_len = args.min_len
     max_pep_len = args.max_len
+    ILEquivalence = args.differentiate_I_L
+    # one key length or a specification of several key lengths for a MultiKeyIndex
+    splitLen = int(args.indexing_key_len) if is_single_key_len(args.indexing_key_len) else str(args.indexing_key_len).strip().lower()
 
-    # get all crux commands in a list
+    complete_df_file = path.join(out_folder, "unique_peptides_table_unfiltered.tsv")
+    filtered_df_file = path.join(out_folder, "unique_peptides_table_filtered.tsv")
+    settings_file = path.join(out_folder, "digestion_settings.json")
+
+    def pool_mapped_digests(mapped_digest_iter):
+        if args.pooling == 'external':
+            return external_pool_mapped_digests(mapped_digest_iter, complete_df_file, filtered_df_file, tmp_out_folder,
+                                                chunk_size=streaming_chunk_size)
+        return stream_mapped_digests(mapped_digest_iter, complete_df_file, filtered_df_file)
+
+    # settings of this run are saved with the pooled tables to allow incremental digestion later on. The fasta
+    # checksum is taken from an up-to-date fasta index if possible and only calculated here if incremental digestion
+    # or the digest cache require it, the fasta index is re-used based on size and modification time otherwise
+    fasta_index_file = index_file_name(fasta, ShardedIndex.index_type if args.index_memory_budget > 0
+                                       else engine_index_type(lookup_engine, splitLen))
+    fasta_hash = None
+    if args.incremental or (not cache_dir == ''):
+        fasta_hash = indexed_fasta_checksum(fasta_index_file, fasta) or fasta_checksum(fasta)
+    run_settings = digestion_settings(fasta_hash, min_pep_mw, max_pep_mw, min_pep_len, max_pep_len,
+                                      args.clip_n_term_met, ILEquivalence, splitLen, digestion_engine,
+                                      peptide_mapping)
+
+    # re-use protease/MC combinations already present in the pooled tables of a previous run
+    previous_digests = dict()
+    reused_idx = set()
+    if args.incremental:
+        previous_df_file = find_table_file(complete_df_file, table_format)
+        previous_df = read_previous_digests(previous_df_file, settings_file, run_settings)
+        if previous_df is not None:
+            # rows of each protease/MC combination in their original order
+            previous_digests = {key: df for key, df in previous_df.groupby(['Enzyme', 'MC'], sort=False)}
+            del previous_df
+            for idx, (protease, mc) in enumerate(zip(protease_list, mc_list)):
+                if all((protease, level) in previous_digests for level in range(mc + 1)):
+                    reused_idx.add(idx)
+                    print(f"\tRe-using previous digest for {protease} with up to {mc} missed cleavages", flush=True)
+            print(f"\tRe-using {len(reused_idx)} of {len(protease_list)} digests from {previous_df_file}", flush=True)
+
+    # look up mapped digests of previous runs with identical fasta file and settings
+    cache_entries = dict()
+    cached_idx = set()
+    if not cache_dir == '':
+        for idx, (protease, mc) in enumerate(zip(protease_list, mc_list)):
+            if idx in reused_idx:
+                continue
+            cache_entries[idx] = mapped_digest_cache_entries(cache_dir, fasta_hash, protease, mc,
+                                                             min_pep_mw, max_pep_mw, min_pep_len, max_pep_len,
+                                                             args.clip_n_term_met, ILEquivalence, splitLen,
+                                                             digestion_engine, peptide_mapping)
+            if all(is_cached(cache_file) for cache_file, _ in cache_entries[idx].values()):
+                cached_idx.add(idx)
+                print(f"\tFound cached digest for {protease} with up to {mc} missed cleavages", flush=True)
+        print(f"\tUsing {len(cached_idx)} of {len(protease_list)} digests from cache {cache_dir}", flush=True)
+
+    print("Start digest:", flush=True)
+
+    # get one crux command per protease, all missed cleavage levels are obtained from this single digestion
+    # file names are used for the built-in digestion as well
     crux_cmd_list, exp_protease_list, exp_mc_list, crux_out_file_list = get_crux_cmds(protease_list,
                                                                                       mc_list,
                                                                                       fasta,
@@ -118,186 +279,246 @@ def main():
                                                                                       max_pep_mw,
                                                                                       min_pep_len,
                                                                                       max_pep_len)
-    crux_file_list_file = path.join(tmp_out_folder, 'crux_result_files.tsv')
-
-    with open(crux_file_list_file, 'w') as f:
-        f.write('\n'.join(crux_out_file_list))
-
-    crux_proc_list = list()
-
-    def crux_process(crux_cmd, n, total, protease, mc):
-        new_proc = Popen(crux_cmd, shell=True, stdout=PIPE, stderr=PIPE)
-        print(f"Started digestion with {protease} and {mc} missed cleavages", flush=True)
-        out = new_proc.stdout.read()
-        err = new_proc.stderr.read()
-        new_proc.wait()
-        out = out.splitlines()
-        err = err.splitlines()
-        for line in out:
-            print(line.decode('utf8'), flush=True)
-        for line in err:
-            print(line.decode('utf8'), flush=True)
-
-        print(f"Finished digestion {n} of {total}.", flush=True)
-
-    # count number of digestions
-    n = 0
-    total = len(crux_cmd_list)
-
-    # init all processes
-    for crux_cmd, protease, mc in zip(crux_cmd_list, exp_protease_list, exp_mc_list):
-        n += 1
-        proc = Process(target=crux_process(crux_cmd, n, total, protease, mc))
-        crux_proc_list.append(proc)
-
-    # start multiprocessing queue
-    for proc in crux_proc_list:
-        proc.start()
-
-    # wait for finishing
-    for proc in crux_proc_list:
-        proc.join()
-
-    print("", flush=True)
-    print("Finished all In-silico digestions", flush=True)
-    print("", flush=True)
-    print("", flush=True)
-    print("---------------------------------------------------------------------------", flush=True)
-    print("", flush=True)
-    print("", flush=True)
-
-    ILEquivalence = args.differentiate_I_L
-    splitLen = int(args.indexing_key_len)
-    # generate fasta index
-    idxing_result = generate_index(fasta, splitLen=splitLen, aaAlphabet = 'extended', ILEquivalence=ILEquivalence)
-    # check index generation
-    if not idxing_result == 0:
-        print(f"{colorama.Fore.RED}ERROR: Index generation for {fasta} failed. Please check. Stopping.{colorama.Style.RESET_ALL}", flush=True)
-        print("", flush=True)
-        return 1
-
-    # get crux-output file names
-    crux_file_list_file = path.join(tmp_out_folder, 'crux_result_files.tsv')
-
-    # lists for protease, crux_file, out_file and MCs
-    crux_file_list = list()
-    mapped_crux_file_list = list()
-    protease_list = list()
-    mc_list = list()
-
-    # pre-load fasta index to avoid repeated loading, this saves some time
-    fastaIndex = path.join(path.dirname(fasta), (path.basename(fasta) + ".idx.pickle"))
-    with open(fastaIndex, 'rb') as handle:
-        fasta_idx = pickle.load(handle)
-        print(f"\t \t Loaded fasta index", flush=True)
-
-    # open list with crux result files
-    with open(crux_file_list_file, 'r') as crux_f:
-        # process line-by-line
-        while (line := crux_f.readline().rstrip()):
-            # crux_file_list_file is tabular with file names in column [0]
-            tmp_col = line.split(sep='\t')
-
-            # generate complete file name from current line
-            crux_file = path.join(tmp_out_folder, 'crux-output', tmp_col[0])
-            # add protease and MC information from current line to lists
-            protease_list.append(str(tmp_col[1]))
-            mc_list.append(str(tmp_col[2]))
-            # generate output file name
-            mapped_crux_file = path.join(tmp_out_folder, str('Mapped_' + tmp_col[0]))
-
-            # read peptide column (first col) from crux file into memory and convert to list
-            # df should be sorted alphabetically
-            # use pandas read_csv, header=None is required to not loose first peptide
-            df = read_csv(crux_file, delimiter='\t', usecols=[0], header=None)[0].to_list()
-
-            # output format should be:
-            # header line, 6 cols: peptide \t protein \t location \t prevAA \t in_fasta \t nextAA \n
-            # body:                AAAAFRVVK \t lcl|AL009126.3_prot_2464 \t 19 \t \t \t \n
-            mapping_result_list = map_peptides(df, fasta, splitLen=splitLen, ILEquivalence=ILEquivalence, protease= str(tmp_col[1]), MC= str(tmp_col[2]), fasta_idx=fasta_idx)
+    # only digest proteases that are neither re-used nor cached
+    miss_idx = [idx for idx in range(len(exp_protease_list)) if (idx not in cached_idx) and (idx not in reused_idx)]
+    crux_cmd_list = [crux_cmd_list[idx] for idx in miss_idx]
+    crux_out_file_list = [crux_out_file_list[idx] for idx in miss_idx]
+    miss_protease_list = [exp_protease_list[idx] for idx in miss_idx]
+    miss_mc_list = [exp_mc_list[idx] for idx in miss_idx]
+
+    if not args.streaming:
+        crux_file_list_file = path.join(tmp_out_folder, 'crux_result_files.tsv')
+        with open(crux_file_list_file, 'w') as f:
+            f.write('\n'.join(crux_out_file_list))
+
+    if digestion_engine == 'crux':
+        # run crux digestions in parallel, limited to the number of threads
+        total = len(crux_cmd_list)
+        start_messages = [f"Started digestion with {protease} and up to {mc} missed cleavages"
+                          for protease, mc in zip(miss_protease_list, miss_mc_list)]
+        finish_messages = [f"Finished digestion {n} of {total}." for n in range(1, total + 1)]
+        crux_results = run_commands(crux_cmd_list, max_workers=threads, start_messages=start_messages,
+                                    finish_messages=finish_messages)
+        if commands_failed(crux_results):
+            print(f"{colorama.Fore.RED}ERROR: In-silico digestion with crux failed. Stopping.{colorama.Style.RESET_ALL}", flush=True)
+            raise RuntimeError
+    elif not args.streaming:
+        # mapped peptides and file lists are kept in the crux output folder for both digestion engines
+        makedirs(path.join(tmp_out_folder, 'crux-output'), exist_ok=True)
+
+    # peptide lists for each protease and exact number of missed cleavages, in streaming mode each protease is
+    # digested (or its crux result read) only when it is mapped
+    digest_iter = iter_mc_level_digests(digestion_engine, fasta, path.join(tmp_out_folder, 'crux-output'),
+                                        crux_out_file_list, miss_protease_list, miss_mc_list,
+                                        min_pep_mw, max_pep_mw, min_pep_len, max_pep_len, args.clip_n_term_met,
+                                        remove_crux_output=args.streaming, provenance=provenance,
+                                        il_equivalence=ILEquivalence)
+    if not args.streaming:
+        # digests are kept for the run-wide mapping memo while it is estimated to fit the index memory budget,
+        # otherwise the remaining digests are digested (or read) and mapped one at a time
+        mc_level_digests = dict()
+        digest_peptide_count = 0
+        for idx in miss_idx:
+            if not MappingMemo.fits_memory_budget(digest_peptide_count, args.index_memory_budget):
+                break
+            _, mc_levels = next(digest_iter)
+            mc_level_digests[idx] = mc_levels
+            digest_peptide_count += sum(len(peptide_list) for peptide_list in mc_levels.values())
+        use_mapping_memo = MappingMemo.fits_memory_budget(digest_peptide_count, args.index_memory_budget)
+
+        if len(mc_level_digests) == len(miss_idx):
+            print("", flush=True)
+            print("Finished all In-silico digestions", flush=True)
+            print("", flush=True)
+            print("", flush=True)
+            print("---------------------------------------------------------------------------", flush=True)
+            print("", flush=True)
+            print("", flush=True)
+        if not use_mapping_memo:
+            print(f"\t Peptides of all digests exceed the index memory budget of {args.index_memory_budget} MB, digests are mapped one at a time", flush=True)
+
+    # the fasta index is only required if any digest is not cached and peptides are searched in the proteome
+    fasta_idx = None
+    if (len(miss_idx) > 0) and (peptide_mapping == 'exact'):
+        # pre-load fasta index to avoid repeated loading, this saves some time
+        fasta_idx = load_fasta_index(fasta, splitLen, ILEquivalence, indexType=engine_index_type(lookup_engine, splitLen),
+                                     fastaHash=fasta_hash, minPepLen=min_pep_len, threads=threads,
+                                     memoryBudget=max(args.index_memory_budget, 0))
+        if fasta_idx is None:
+            return 1
 
-            # check mapping result
-            if mapping_result_list == 1:
-                print(f"{colorama.Fore.RED}ERROR: Mapping failed for {crux_file}. Please check. Stopping.{colorama.Style.RESET_ALL}", flush=True)
-                print("", flush=True)
-                return 1
+    if args.streaming:
+        print("Started mapping and pooling digests", flush=True)
+
+        def iter_mapped_digests():
+            # cached and newly mapped digests in the order of the protease list
+            for idx, protease in enumerate(exp_protease_list):
+                if idx in reused_idx:
+                    for mc in range(exp_mc_list[idx] + 1):
+                        df = previous_digests[(protease, mc)]
+                        yield protease, mc, zip(df['peptide'], df['protein'], df['location'])
+                    continue
+                if idx in cached_idx:
+                    for mc, (cache_file, _) in cache_entries[idx].items():
+                        print(f"\t Using cached mapping for {protease} with {mc} missed cleavages", flush=True)
+                        yield protease, mc, iter_cached_mappings(cache_file)
+                    continue
+                _, mc_levels = next(digest_iter)
+                for mc, peptide_list in mc_levels.items():
+                    print(f"\t Mapping {len(peptide_list)} peptides for {protease} with {mc} missed cleavages", flush=True)
+                    if peptide_mapping == 'provenance':
+                        mapped_rows = iter_provenance_mappings(peptide_list)
+                    else:
+                        mapped_rows = iter_protein_mappings(peptide_list, fasta_idx, lookup_engine, workers=threads)
+                    if idx in cache_entries:
+                        mapped_rows = cache_mapped_rows(mapped_rows, *cache_entries[idx][mc])
+                    yield protease, mc, mapped_rows
 
-            # save result to file
-            with open(mapped_crux_file, 'w') as f:
-                for entry in mapping_result_list:
-                    f.write(entry)
+        pool_mapped_digests(iter_mapped_digests())
 
-            # log finished crux files
-            crux_file_list.append(crux_file)
-            mapped_crux_file_list.append(mapped_crux_file)
+    else:
+        # lists for protease, out_file and MCs
+        mapped_crux_file_list = list()
+        protease_list = list()
+        mc_list = list()
+
+        # look up each distinct peptide sequence of all digests only once
+        mapping_memo = None
+        if use_mapping_memo and (len(mc_level_digests) > 0) and (fasta_idx is not None):
+            mapping_memo = MappingMemo(fasta_idx, lookup_engine, workers=threads)
+            mapping_memo.add([peptide for mc_levels in mc_level_digests.values()
+                              for peptide_list in mc_levels.values() for peptide in peptide_list])
+            print(f"\t Mapped {len(mapping_memo)} distinct peptides of all digests", flush=True)
+            if provenance:
+                extra_count = sum(1 for mc_levels in mc_level_digests.values() for peptide_hits in mc_levels.values()
+                                  for pept, hits in peptide_hits.items() if mapping_memo.hit_count(pept) > len(hits))
+                print(f"\t {extra_count} peptides also match the proteome outside of their digestion sites", flush=True)
+
+        # map peptides of each protease and exact number of missed cleavages
+        for idx, protease in enumerate(exp_protease_list):
+            # re-used digests are taken from the previous pooled table
+            if idx in reused_idx:
+                for mc in range(exp_mc_list[idx] + 1):
+                    protease_list.append(str(protease))
+                    mc_list.append(str(mc))
+                    mapped_crux_file_list.append(complete_df_file)
+                continue
+            # cached digests are pooled directly from the cache
+            if idx in cached_idx:
+                for mc, (cache_file, _) in cache_entries[idx].items():
+                    print(f"\t Using cached mapping for {protease} with {mc} missed cleavages", flush=True)
+                    protease_list.append(str(protease))
+                    mc_list.append(str(mc))
+                    mapped_crux_file_list.append(cache_file)
+                continue
+
+            protease_clean = clean_protease_names([protease])[0]
+            if idx in mc_level_digests:
+                mc_levels = mc_level_digests.pop(idx)
+            else:
+                _, mc_levels = next(digest_iter)
+            for mc, peptide_list in mc_levels.items():
+                # add protease and MC information to lists
+                protease_list.append(str(protease))
+                mc_list.append(str(mc))
+                # generate output file name
+                mapped_crux_file = path.join(tmp_out_folder, f'Mapped_{protease_clean}_{mc}_MCs.generate-peptides.target.txt')
+
+                # output format should be:
+                # header line, 6 cols: peptide \t protein \t location \t prevAA \t in_fasta \t nextAA \n
+                # body:                AAAAFRVVK \t lcl|AL009126.3_prot_2464 \t 19 \t \t \t \n
+                if peptide_mapping == 'provenance':
+                    print(f"\t Using digestion sites of {len(peptide_list)} peptides for {protease} with {mc} missed cleavages", flush=True)
+                    mapping_result_list = [mapped_digest_header]
+                    mapping_result_list.extend(f'{pept}\t{protein}\t{location}\t\t\t\n'
+                                               for pept, protein, location in iter_provenance_mappings(peptide_list))
+                else:
+                    mapping_result_list = map_peptides(peptide_list, fasta, splitLen=splitLen, ILEquivalence=ILEquivalence, protease=str(protease), MC=str(mc), fasta_idx=fasta_idx, mapping_engine=lookup_engine, mapping_memo=mapping_memo)
+
+                # check mapping result
+                if mapping_result_list == 1:
+                    print(f"{colorama.Fore.RED}ERROR: Mapping failed for {protease} with {mc} missed cleavages. Please check. Stopping.{colorama.Style.RESET_ALL}", flush=True)
+                    print("", flush=True)
+                    return 1
+
+                # save result to file
+                with open(mapped_crux_file, 'w') as f:
+                    for entry in mapping_result_list:
+                        f.write(entry)
+                if idx in cache_entries:
+                    cache_file, cache_params = cache_entries[idx][mc]
+                    store_mapped_digest(cache_file, mapping_result_list, cache_params)
+
+                # log finished mapping files
+                mapped_crux_file_list.append(mapped_crux_file)
+
+        if mapping_memo is not None:
+            print(f"\t Re-used mappings of {len(mapping_memo)} distinct peptides for {mapping_memo.requested_count} digested peptides", flush=True)
+        print("", flush=True)
+        print("Finished peptide mapping", flush=True)
+        print("", flush=True)
+        print("", flush=True)
+        print("---------------------------------------------------------------------------", flush=True)
+        print("", flush=True)
+        print("", flush=True)
 
-    # return from open crux_file_list_file
-    print("", flush=True)
-    print("Finished peptide mapping", flush=True)
-    print("", flush=True)
-    print("", flush=True)
-    print("---------------------------------------------------------------------------", flush=True)
-    print("", flush=True)
-    print("", flush=True)
+        # generate list with mapped file names and protease / mc combination
+        crux_out_folder = path.join(out_folder, 'Tmp', 'crux-output')
+        mapped_file_list_file = path.join(crux_out_folder, 'File_List.tsv')
+        mapped_out_file_list = list()
+        for mf, pr, mc in zip(mapped_crux_file_list, protease_list, mc_list):
+            ln = str(mf) + "\t" + str(pr) + "\t" + str(mc)
+            mapped_out_file_list.append(ln)
+        # # save this list
+        with open(mapped_file_list_file, 'w') as mf:
+            mf.write('\n'.join(mapped_out_file_list))
+        # remove files from tmp output and keep only 'Mapped_' peptide lists and 'File_List'
+        print("Removing tmp files", flush=True)
+        for f in listdir(crux_out_folder):
+            if not f.startswith('Mapped_'):
+                if not f.startswith('File_List'):
+                    remove(path.join(crux_out_folder, f))
+        print("Finished removing tmp files ", flush=True)
+
+        # merge mapped files and annotate table
+        print("", flush=True)
+        print("", flush=True)
+        print("Started pooling digests", flush=True)
+
+        def iter_pooled_digests():
+            with open(mapped_file_list_file, 'r') as mfl:
+                while(line := mfl.readline().rstrip()):
+                    # file names with mapped peptides and annotation is tabular
+                    tmp_col = line.split(sep='\t')
+                    f = tmp_col[0]
+                    protease = tmp_col[1]
+                    mc = tmp_col[2]
+                    # re-used digests were read before the pooled table is overwritten, mapped files are read in chunks
+                    if f == complete_df_file:
+                        df = previous_digests[(protease, int(mc))]
+                        yield protease, mc, zip(df['peptide'], df['protein'], df['location'])
+                    else:
+                        yield protease, mc, iter_cached_mappings(f)
 
-    # generate list with mapped file names and protease / mc combination
-    crux_out_folder = path.join(out_folder, 'Tmp', 'crux-output')
-    mapped_file_list_file = path.join(crux_out_folder, 'File_List.tsv')
-    mapped_out_file_list = list()
-    for mf, pr, mc in zip(mapped_crux_file_list, protease_list, mc_list):
-        ln = str(mf) + "\t" + str(pr) + "\t" + str(mc)
-        mapped_out_file_list.append(ln)
-    # # save this list
-    with open(mapped_file_list_file, 'w') as mf:
-        mf.write('\n'.join(mapped_out_file_list))
-    # remove files from tmp output and keep only 'Mapped_' peptide lists and 'File_List'
-    print("Removing tmp files", flush=True)
-    for f in listdir(crux_out_folder):
-        if not f.startswith('Mapped_'):
-            if not f.startswith('File_List'):
-                remove(path.join(crux_out_folder, f))
-    print("Finished removing tmp files ", flush=True)
-
-    # merge mapped files and annotate table
-    print("", flush=True)
-    print("", flush=True)
-    print("Started pooling digests", flush=True)
-    df_complete = DataFrame()
-    with open(mapped_file_list_file, 'r') as mfl:
-        while(line := mfl.readline().rstrip()):
-            # file names with mapped peptides and annotation is tabular
-            tmp_col = line.split(sep='\t')
-            f = tmp_col[0]
-            protease = tmp_col[1]
-            mc = tmp_col[2]
-            # read relevant columns to pandas df
-            df = read_csv(f, delimiter='\t', usecols=["peptide", "protein", "location"])
-            # keep = False to keep only unique peptides within a certain protease / mc combination
-
-            df_non_unique = df.assign(MC=Series([mc] * len(df.index)))
-            df_non_unique = df_non_unique.assign(Enzyme=Series([protease] * len(df_non_unique.index)))
-
-            # df_complete = df_complete.append(df_reduced, ignore_index=True) # deprecated
-            df_complete = concat([df_complete, df_non_unique], axis=0, join='outer', ignore_index=True)
+        # peptides are labelled by their exact number of missed cleavages and pooled in increasing MC order,
+        # the filtered table keeps the first match of each peptide within a protein per protease, i.e. removes
+        # repeated matches within the same protein and retains the lowest MC for peptides that become identical
+        # by I/L equivalence
+        pool_mapped_digests(iter_pooled_digests())
 
-    complete_df_file = path.join(out_folder, "unique_peptides_table_unfiltered.tsv")
-    df_complete.to_csv(complete_df_file, index=False, sep="\t")
+    if fasta_idx is not None:
+        print_mapping_counters(fasta_idx)
 
-    # remove redundant peptides from multiple missed cleavages
-    df_complete_sorted = df_complete.sort_values(by='MC', ascending=False, kind='mergesort')
-    # keep=last to remove duplicates with less than max mc in each file (crux generates peptides with zero to max mc's)
-    df_filtered_sorted = df_complete_sorted.drop_duplicates(subset=['peptide', 'Enzyme', 'protein'], keep='last',
-                                                            ignore_index=True)
+    # pooled tables are written tab-separated and replaced by binary columnar tables if requested
+    if not table_format == 'tsv':
+        for table_file in (complete_df_file, filtered_df_file):
+            convert_tsv_table(table_file, table_format, dictionary_cols=pooled_dictionary_cols,
+                              keep_tsv=args.export_tsv, dtype={'MC': int})
 
-
-    '''
-    if not path.join(args.unique_peps_file) == "":
-        filtered_df_file = path.join(out_folder, "unique_peptides_table_filtered.tsv")
-    else:
-        filtered_df_file = path.join(out_folder, "unique_peptides_table_filtered.tsv")
-    '''
-    filtered_df_file = path.join(out_folder, "unique_peptides_table_filtered.tsv")
-    df_filtered_sorted.to_csv(filtered_df_file, index=False, sep="\t")
+    if run_settings['fasta_sha256'] is None:
+        run_settings['fasta_sha256'] = indexed_fasta_checksum(fasta_index_file, fasta) or fasta_checksum(fasta)
+    with open(settings_file, 'w') as f:
+        json.dump(run_settings, f, indent=1, sort_keys=True)
 
     print("Finished pooling digests", flush=True)
     chdir(out_folder)
@@ -361,10 +582,7 @@ def generate_peptides_call(out_folder,
     if enzyme.lower().startswith("custom"):
         return_code, cleavage_spec = handle_custom_proteases(enzyme)
 
-        if return_code == -1:
-            str_help = "{P}"
-            raise ValueError(f"Custom proteases must contain exactly two pairs of squared or curly brackets, e.g. 'custom,trypsin,[KR]|{str_help}'. '{enzyme}' is mal-formatted. Please check. Stopping.")
-        elif return_code == -2:
+        if return_code == -2:
             raise ValueError(f"Inconsistent bracket type in first bracket pair of '{enzyme}'. Please check. Stopping.")
         elif return_code == -3:
             raise ValueError(f"Inconsistent bracket type in second bracket pair of '{enzyme}'. Please check. Stopping.")
@@ -393,81 +611,158 @@ def generate_peptides_call(out_folder,
 
 
 def get_crux_cmds(protease_list, mc_list, fasta, crux_path, min_pep_mw=400, max_pep_mw=6000, min_pep_len=6, max_pep_len=55):
-    # get plain list with possible protease / MCs combinations
+    """
+    one crux command per protease with its maximal number of missed cleavages,
+        peptides are split by their exact number of missed cleavages afterwards
+    """
     expanded_protease_list = list()
     expanded_mc_list = list()
     # list out files to file for later read back
     crux_out_file_list = list()
-    # use protease_list instead of protease_list_clean for crux command
-    for each_protease, each_max_mc in zip(protease_list, mc_list):
-        for each_mc in range(each_max_mc + 1):
-            expanded_protease_list.append(each_protease)
-            expanded_mc_list.append(each_mc)
     crux_cmd_list = list()
-    crux_opt_list = list()
-    # loop through both expanded lists and generate crux call
-    for protease, mc in zip(expanded_protease_list, expanded_mc_list):
-        protease_ls = list()
-        protease_ls.append(protease)
-        protease_clean = clean_protease_names(protease_ls)
-        result_name = str(str(protease_clean[0]) + "_" + str(mc) + "_MCs")
+    # use protease_list instead of protease_list_clean for crux command
+    for protease, max_mc in zip(protease_list, mc_list):
+        expanded_protease_list.append(protease)
+        expanded_mc_list.append(int(max_mc))
+        protease_clean = clean_protease_names([protease])
+        result_name = str(str(protease_clean[0]) + "_" + str(max_mc) + "_MCs")
         crux_cmd = generate_peptides_call(out_folder=result_name,
                                           fasta=path.join(fasta),
                                           crux_path=path.join(crux_path),
                                           enzyme=protease,
-                                          missed_cleavages=mc,
+                                          missed_cleavages=max_mc,
                                           min_mass=min_pep_mw,
                                           max_mass=max_pep_mw,
                                           min_len=min_pep_len,
                                           max_len=max_pep_len)
         crux_cmd_list.append(crux_cmd)
-        crux_out_file_str = str(protease_clean[0]) + "_" + str(mc) + \
+        crux_out_file_str = str(protease_clean[0]) + "_" + str(max_mc) + \
                             "_MCs.generate-peptides.target.txt" + "\t" + protease + \
-                            "\t" + str(mc)
+                            "\t" + str(max_mc)
 
         crux_out_file_list.append(crux_out_file_str)
     return crux_cmd_list, expanded_protease_list, expanded_mc_list, crux_out_file_list
 
 
-def generate_index(fastaFile, splitLen=5, aaAlphabet='ACDEFGHIKLMNPQRSTVWYBXZJUO', ILEquivalence = True):
+def iter_mc_level_digests(digestion_engine, fasta, crux_out_folder, crux_out_file_list, protease_list, mc_list,
+                          min_pep_mw=400, max_pep_mw=6000, min_pep_len=6, max_pep_len=55, clip_n_term_met='T',
+                          remove_crux_output=False, provenance=False, il_equivalence=True):
+    """
+    yield (protease, {mc: peptide_list}) for one protease at a time
+
+        for crux the peptides are read from the finished crux output files (removed after reading if
+        remove_crux_output is set), the built-in digestion runs only when the next protease is requested.
+        With provenance, the built-in digestion returns {mc: {peptide: [(protein, 1-based position), ...]}}
+        instead (see CoMPaseD_digest.digest_proteome_provenance).
+    """
+    protein_seq_list = None
+    total = len(protease_list)
+    for n, (crux_out_file_str, protease, mc) in enumerate(zip(crux_out_file_list, protease_list, mc_list), start=1):
+        if digestion_engine == 'crux':
+            crux_file = path.join(crux_out_folder, crux_out_file_str.split('\t')[0])
+            # read peptide column (first col) from crux file, header=None is required to not loose first peptide
+            peptide_list = read_csv(crux_file, delimiter='\t', usecols=[0], header=None)[0].to_list()
+            if remove_crux_output:
+                remove(crux_file)
+            # label peptides by their exact number of missed cleavages
+            yield protease, split_by_missed_cleavages(peptide_list, protease, mc)
+        else:
+            # read the fasta file only once for all digestions
+            if protein_seq_list is None:
+                protein_seq_list = load_fasta_sequences(fasta)
+            print(f"Started digestion with {protease} and up to {mc} missed cleavages", flush=True)
+            if provenance:
+                mc_levels = digest_proteome_provenance(protein_seq_list,
+                                                       enzyme=protease,
+                                                       max_missed_cleavages=mc,
+                                                       min_mass=min_pep_mw,
+                                                       max_mass=max_pep_mw,
+                                                       min_len=min_pep_len,
+                                                       max_len=max_pep_len,
+                                                       clip_n_term_met=clip_n_term_met,
+                                                       il_equivalence=il_equivalence)
+            else:
+                mc_levels = digest_proteome_mc_levels(protein_seq_list,
+                                                      enzyme=protease,
+                                                      max_missed_cleavages=mc,
+                                                      min_mass=min_pep_mw,
+                                                      max_mass=max_pep_mw,
+                                                      min_len=min_pep_len,
+                                                      max_len=max_pep_len,
+                                                      clip_n_term_met=clip_n_term_met)
+            print(f"Finished digestion {n} of {total}.", flush=True)
+            yield protease, mc_levels
+
+
+def load_fasta_index(fastaFile, splitLen=5, ILEquivalence=True, indexType='kmer', fastaHash=None, minPepLen=6,
+                     threads=1, memoryBudget=0):
+    '''
+    Function to memory-map the fasta index of indexType (or a ShardedIndex of it with memoryBudget > 0),
+        an existing index is re-used if fasta file and index settings did not change and generated otherwise.
+        Returns None if the index could not be generated.
+    '''
+    fastaIndex = index_file_name(fastaFile, ShardedIndex.index_type if memoryBudget > 0 else indexType)
+    index_valid, index_reason = check_index(fastaIndex, fastaFile, split_len=splitLen, alphabet='extended',
+                                            il_equivalence=ILEquivalence, fasta_hash=fastaHash,
+                                            index_type=indexType, min_pep_len=minPepLen,
+                                            memory_budget=memoryBudget)
+    if index_valid:
+        print(f"\t Re-using existing fasta index {fastaIndex}", flush=True)
+    else:
+        if path.isfile(fastaIndex):
+            print(f"\t Existing fasta index {fastaIndex} is outdated: {index_reason}", flush=True)
+        # generate fasta index
+        idxing_result = generate_index(fastaFile, splitLen=splitLen, aaAlphabet = 'extended', ILEquivalence=ILEquivalence,
+                                       fastaHash=fastaHash, indexType=indexType, minPepLen=minPepLen,
+                                       threads=threads, memoryBudget=memoryBudget)
+        # check index generation
+        if not idxing_result == 0:
+            print(f"{colorama.Fore.RED}ERROR: Index generation for {fastaFile} failed. Please check. Stopping.{colorama.Style.RESET_ALL}", flush=True)
+            print("", flush=True)
+            return None
+
+    fasta_idx = index_classes[ShardedIndex.index_type if memoryBudget > 0 else indexType].load(fastaIndex)
+    print(f"\t \t Loaded fasta index", flush=True)
+    return fasta_idx
+
+
+def generate_index(fastaFile, splitLen=5, aaAlphabet='ACDEFGHIKLMNPQRSTVWYBXZJUO', ILEquivalence = True, fastaHash = None,
+                   indexType = 'kmer', minPepLen = 6, threads = 1, memoryBudget = 0):
     '''
     This is a simplified python implementation of ProteoMappers Clips.pl script
 
-    Function to generate a pickled fasta index based on aa-combinations of length=splitLen
-        protein identifier are encoded as six-digit hexadecimal values and
-         start position of each aa-combination is assigned (1-based), e.g:
+    Function to generate a fasta index based on aa-combinations of length=splitLen
+        only aa-combinations that occur in the fasta file are indexed, each is encoded as integer and
+         points to an array range of (protein number, start position) pairs, e.g:
 
-         'AAACD': ['000001, 1', '0000CD, 18', '0000E3, 21', '0000EF, 2']
+         'AAACD': [(1, 0), (205, 17), (227, 20), (239, 1)]
 
          would be one entry indicating matches of the sequence AAACD to four proteins at
-         position 1, 18, 21 and 2 respectively.
+         position 1, 18, 21 and 2 respectively (see CoMPaseD_fasta_index.FastaIndex).
 
-         As the index is saved as a python dict memory may become an issue for very large fasta files.
-         An additional dict will be created to save ID mappings and log index generation settings.
+         The index is saved as binary file with a header that logs index generation settings and the fasta
+         checksum, its arrays are memory-mapped when loading.
 
          Extended alphabet from Bio.Alphabet is set as default for aaAlphabet to ensure complete mapping
          but may be modified by direct setting ('ABC...') or the following key-words: 20-aa; 22-aa, extended
 
-    '''
+         With indexType='suffix-array' a suffix array of all protein sequences is saved instead (file extension
+         .csa, see CoMPaseD_fasta_index.SuffixArrayIndex), splitLen and aaAlphabet are not used in this case.
+         indexType='multi-kmer' saves one k-mer index per key length in splitLen, e.g. '4,7', or chooses the key
+         lengths from proteome size and minPepLen for 'auto' (file extension .cmidx, see
+         CoMPaseD_fasta_index.MultiKeyIndex).
 
-    # correct aaAlphabet for key-words
-    if aaAlphabet == '20-aa':
-        if ILEquivalence:
-            aaAlphabet = 'ACDEFGHKLMNPQRSTVWY'
-        else:
-            aaAlphabet = 'ACDEFGHIKLMNPQRSTVWY'
+         k-mer indices of large proteomes are built by up to threads worker processes, each indexing a shard of
+         complete proteins.
 
-    if aaAlphabet == '22-aa':
-        if ILEquivalence:
-            aaAlphabet = 'ACDEFGHKLMNPQRSTVWYOU'
-        else:
-            aaAlphabet = 'ACDEFGHIKLMNPQRSTVWYOU'
+         With memoryBudget > 0 (MB), an index of indexType is built and saved for each part of the fasta file that
+         can be indexed within the memory budget, a shard manifest (file extension .cshd, see
+         CoMPaseD_fasta_index.ShardedIndex) lists these shards.
 
-    if aaAlphabet == 'extended':
-        if ILEquivalence:
-            aaAlphabet = 'ACDEFGHKLMNPQRSTVWYBXZJUO'
-        else:
-            aaAlphabet = 'ACDEFGHIKLMNPQRSTVWYBXZJUO'
+    '''
+
+    # correct aaAlphabet for key-words
+    aaAlphabet = resolve_alphabet(aaAlphabet, ILEquivalence)
 
     # inform user on indexing start and currently used aaAlphabet
     print(f"---------------------------------------------------------------------------", flush=True)
@@ -481,7 +776,10 @@ def generate_index(fastaFile, splitLen=5, aaAlphabet='ACDEFGHIKLMNPQRSTVWYBXZJUO
     print(f"---------------------------------------------------------------------------", flush=True)
 
     print(f"\t Started index generation for {fastaFile}.", flush=True)
-    print(f"\t \t indexed amino acids: {aaAlphabet}.", flush=True)
+    if indexType == 'suffix-array':
+        print(f"\t \t building suffix array of all protein sequences.", flush=True)
+    else:
+        print(f"\t \t indexed amino acids: {aaAlphabet}.", flush=True)
     if ILEquivalence:
         print(f"\t \t treating L and I amino acids as the same.", flush=True)
 
@@ -491,53 +789,24 @@ def generate_index(fastaFile, splitLen=5, aaAlphabet='ACDEFGHIKLMNPQRSTVWYBXZJUO
         print("", flush=True)
         return 1
     else:
-        # init entry ID to hexadecimal conversion for reduced file size compared to decimal numbering
-        n = 0
-        id_dict = dict()
-        inv_id_dict = dict()
-        id_seq_dict = dict()
-
-        # generate all possible combinations, result is list of tuples
-        aa_idxs = [p for p in itertools.product(aaAlphabet, repeat=splitLen)]
-
-        # create dict to hold all combinations
-        split_dict = dict()
-        # loop through aa_idxs, convert each idx tuple of individual characters to one string and add empty list
-        for idx in aa_idxs:
-            split_dict[''.join(idx)] = list()
-
-        # open fasta
-        with open(fastaFile) as handle:
-            # process each entry separately
-            for record in SeqIO.parse(handle, "fasta"):
-
-                # get sequence
-                rec_seq = record.seq
-                # replace I with L
-                if ILEquivalence:
-                    rec_seq = rec_seq.replace('I', 'L')
-
-                # fill ID translation dicts
-                id_dict[f'{n:06x}'] = record.id
-                inv_id_dict[record.id] = f'{n:06x}'
-                # fill id_seq_dict
-                id_seq_dict[f'{n:06x}'] = rec_seq
-
-                # split sequence into substrings of split_len length
-                splits = [rec_seq[idx:idx + splitLen] for idx in range(len(rec_seq) - splitLen + 1)]
-
-                # add splits to split_dict
-                ii = 1
-                for split in splits:
-                    split_dict[split].append(str(inv_id_dict[record.id]) + ', ' + str(ii))
-                    ii += 1
-
-                # increase ID counter
-                n += 1
-
-        # generate standardised idx file name
-        fastaIndex = path.join(path.dirname(fastaFile), (path.basename(fastaFile) + ".idx.pickle"))
-        indexAnnot = path.join(path.dirname(fastaFile), (path.basename(fastaFile) + ".annot.pickle"))
+        if fastaHash is None:
+            fastaHash = fasta_checksum(fastaFile)
+        fastaIndex = index_file_name(fastaFile, ShardedIndex.index_type if memoryBudget > 0 else indexType)
+
+        # index all proteins of the fasta file
+        if memoryBudget > 0:
+            print(f"\t \t splitting the index into shards built within {memoryBudget} MB.", flush=True)
+            fasta_idx = ShardedIndex.from_fasta(fastaFile, fastaIndex, shard_type=indexType, memory_budget=memoryBudget,
+                                                key_len_spec=splitLen, alphabet=aaAlphabet, il_equivalence=ILEquivalence,
+                                                min_pep_len=minPepLen, workers=threads, fasta_hash=fastaHash)
+        elif indexType == 'suffix-array':
+            fasta_idx = SuffixArrayIndex.from_fasta(fastaFile, il_equivalence=ILEquivalence)
+        elif indexType == 'multi-kmer':
+            fasta_idx = MultiKeyIndex.from_fasta(fastaFile, key_len_spec=splitLen, alphabet=aaAlphabet,
+                                                 il_equivalence=ILEquivalence, min_pep_len=minPepLen, workers=threads)
+        else:
+            fasta_idx = FastaIndex.from_fasta(fastaFile, split_len=splitLen, alphabet=aaAlphabet, il_equivalence=ILEquivalence,
+                                              workers=threads)
 
         # remove any existing index but warn the user about this
         if path.isfile(fastaIndex):
@@ -549,49 +818,37 @@ def generate_index(fastaFile, splitLen=5, aaAlphabet='ACDEFGHIKLMNPQRSTVWYBXZJUO
                 print("", flush=True)
                 return 1
 
-        # remove any existing index annotation but warn the user about this
-        if path.isfile(indexAnnot):
-            print(f"\t\tWARNING: Existing index annotation ({indexAnnot}) was found and will be replaced. Please check", flush=True)
-            try:
-                remove(indexAnnot)
-            except Exception as e:
-                print(f"{colorama.Fore.RED}ERROR: Existing fasta file index annotation for {indexAnnot} could not be deleted due to {e}. Please check permission. \n Stopping. {colorama.Style.RESET_ALL}", flush=True)
-                print("", flush=True)
-                return 1
-
-        with open(fastaIndex, 'wb') as handle:
-            pickle.dump(split_dict, handle)
-
-        with open(indexAnnot, 'wb') as handle:
-            pickle.dump(fastaFile, handle) # fasta file
-            pickle.dump(fastaIndex, handle) # index file
-            pickle.dump(str(datetime.now().strftime("%d/%m/%Y %H:%M:%S")), handle) # creation date and time
-            pickle.dump(splitLen, handle)  # index splitLen
-            pickle.dump(id_dict, handle)  # id-to-hexid dict
-            pickle.dump(inv_id_dict, handle)  # hexid-to-id dict
-            pickle.dump(id_seq_dict, handle) # id-to-sequence dict
-            pickle.dump(aaAlphabet, handle)  # aa-alphabet
-            if ILEquivalence:
-                pickle.dump(True, handle) # ILEquivalence
-            else:
-                pickle.dump(False, handle) # ILEquivalence
+        fasta_idx.save(fastaIndex, fasta=fastaFile, fasta_hash=fastaHash)
 
+        if memoryBudget > 0:
+            print(f"\t \t indexed {len(fasta_idx)} proteins in {len(fasta_idx.shard_files)} shards.", flush=True)
+        elif indexType == 'suffix-array':
+            print(f"\t \t indexed {len(fasta_idx.suffix_array)} suffixes in {len(fasta_idx)} proteins.", flush=True)
+        elif indexType == 'multi-kmer':
+            for key_len, level in fasta_idx.levels.items():
+                print(f"\t \t indexed {len(level.kmer_codes)} aa-combinations of length {key_len} in {len(fasta_idx)} proteins.", flush=True)
+        else:
+            print(f"\t \t indexed {len(fasta_idx.kmer_codes)} aa-combinations in {len(fasta_idx)} proteins.", flush=True)
         print(f"\t Finished index generation.", flush=True)
         print("", flush=True)
 
         return 0
 
-def map_peptides(peptideList, fastaFile, splitLen, ILEquivalence, protease, MC, fasta_idx = None):
+
+def map_peptides(peptideList, fastaFile, splitLen, ILEquivalence, protease, MC, fasta_idx = None, mapping_engine = 'index',
+                 mapping_memo = None):
     '''
     This is a simplified python implementation of ProteoMappers Promast.pl script
 
     Function to map a list of peptides to their positions in a fasta file
-        using the pickled index file as template
+        using the binary index file as template
          start position of mappings is 1-based, e.g in:
          >Protein
          MPEPTIDE
          the peptide EPTIDE is at pos 3-8
 
+         Mappings are taken from mapping_memo (CoMPaseD_mapping_engines.MappingMemo) if provided.
+
     '''
 
     # check whether fasta file exists
@@ -605,13 +862,18 @@ def map_peptides(peptideList, fastaFile, splitLen, ILEquivalence, protease, MC,
     indexing_result = 0
 
     # retrieve standardised idx file name
-    fastaIndex = path.join(path.dirname(fastaFile), (path.basename(fastaFile) + ".idx.pickle"))
-    indexAnnot = path.join(path.dirname(fastaFile), (path.basename(fastaFile) + ".annot.pickle"))
-
-    if (not path.isfile(fastaIndex)) or (not path.isfile(indexAnnot)):
-        print(f"\t\tWARNING: No existing index was found. Start indexing fasta file.", flush=True)
+    index_type = engine_index_type(mapping_engine, splitLen)
+    fastaIndex = index_file_name(fastaFile, index_type)
+
+    index_valid, index_reason = (True, '')
+    if fasta_idx is None:
+        index_valid, index_reason = check_index(fastaIndex, fastaFile, split_len=splitLen, alphabet='extended',
+                                                il_equivalence=ILEquivalence, index_type=index_type)
+    if not index_valid:
+        print(f"\t\tWARNING: No valid index was found ({index_reason}). Start indexing fasta file.", flush=True)
         try:
-            indexing_result = generate_index(fastaFile=fastaFile, splitLen=splitLen, aaAlphabet='extended', ILEquivalence=ILEquivalence)
+            indexing_result = generate_index(fastaFile=fastaFile, splitLen=splitLen, aaAlphabet='extended', ILEquivalence=ILEquivalence,
+                                              indexType=index_type)
         except Exception as e:
             print(
                 f"{colorama.Fore.RED}ERROR: Could not create fasta file index for {fastaFile} due to {e}. Please check permission. \n Stopping. {colorama.Style.RESET_ALL}",
@@ -620,19 +882,19 @@ def map_peptides(peptideList, fastaFile, splitLen, ILEquivalence, protease, MC,
             return 1
 
     if indexing_result == 0:
-        # load annotations
-        with open(indexAnnot, 'rb') as handle:
-            # re-load fasta file and index file names from annotation to ensure correct index-fasta mapping
-            fastaFile = pickle.load(handle)
-            fastaIndex = pickle.load(handle)
-            # show idx_creation time, splitLen and len of fasta file in log later
-            idx_creation_date_time = pickle.load(handle)
-            splitLen = pickle.load(handle)
-            id_dict = pickle.load(handle)  # id-to-hexid dict
-            inv_id_dict = pickle.load(handle)  # hexid-to-id dict
-            id_seq_dict = pickle.load(handle)  # hexid-to-sequence dict
-            aaAlphabet = pickle.load(handle)  # indexed amino acids
-            ILEquivalence = pickle.load(handle) # bool ILEquivalence
+        # load index header, the index is memory-mapped and loads fast if not provided as function parameter
+        if fasta_idx is None:
+            fasta_idx = index_classes[index_type].load(fastaIndex)
+            print(f"\t \t Loaded fasta index", flush=True)
+        idx_header = fasta_idx.header
+        # re-load fasta file name from index header to ensure correct index-fasta mapping
+        fastaFile = idx_header.get('fasta', fastaFile)
+        # show idx_creation time, splitLen and len of fasta file in log later
+        idx_creation_date_time = idx_header.get('creation_date', '')
+        settings_type = fasta_idx.shard_type if fasta_idx.index_type == 'sharded' else fasta_idx.index_type
+        splitLen = ','.join(map(str, fasta_idx.split_lens)) if settings_type == 'multi-kmer' else fasta_idx.split_len
+        aaAlphabet = fasta_idx.alphabet  # indexed amino acids
+        ILEquivalence = fasta_idx.il_equivalence  # bool ILEquivalence
 
         print(" ", flush=True)
         print(f"\t Started peptide mapping for {len(peptideList)} peptides.", flush=True)
@@ -640,124 +902,162 @@ def map_peptides(peptideList, fastaFile, splitLen, ILEquivalence, protease, MC,
         print(f"\t \t Missed cleavages: {MC}", flush=True)
         print(f"\t \t Indexed fasta file: {fastaFile}", flush=True)
         print(f"\t \t Index creation date: {idx_creation_date_time}", flush=True)
-        print(f"\t \t Protein entries: {len(id_dict)}", flush=True)
-        print(f"\t \t Index len: {str(splitLen)}", flush=True)
-        print(f"\t \t Indexed amino acids: {str(aaAlphabet)}", flush=True)
-
-        # load fasta index if not provided as function parameter
-        if fasta_idx == None:
-            with open(fastaIndex, 'rb') as handle:
-                fasta_idx = pickle.load(handle)
-                print(f"\t \t Loaded fasta index", flush=True)
+        print(f"\t \t Protein entries: {len(fasta_idx)}", flush=True)
+        if fasta_idx.index_type == 'sharded':
+            print(f"\t \t Index shards: {len(fasta_idx.shard_files)}", flush=True)
+        if settings_type == 'suffix-array':
+            print(f"\t \t Suffix array depth: {str(fasta_idx.depth)}", flush=True)
+        else:
+            print(f"\t \t Index len: {str(splitLen)}", flush=True)
+            print(f"\t \t Indexed amino acids: {str(aaAlphabet)}", flush=True)
 
-        print(f"\t \t Mapping...", flush=True)
+        print(f"\t \t Mapping with {mapping_engine} engine...", flush=True)
 
         result_list = list()
         result_list.append(f'peptide\tprotein\tlocation\tprevAA\tin_fasta\tnextAA\n')
         # loop through peptide list and map to all possible proteins
-        for pept in peptideList:
-            if len(pept) < splitLen:
-                print(f"\t \t \t WARNING: Peptide '{pept}' is shorter than index len and will be removed. Please check digestion settings.", flush=True)
-            else:
-                # handle ILEquivalence on-the fly
-                if ILEquivalence:
-                    pept = pept.replace('I', 'L')
-
-                pept_idx = pept[0:splitLen]
-                idx_mapping_list = fasta_idx[pept_idx]
-
-                for idx_mapping in idx_mapping_list:
-                    # split individual mappings to key and position
-                    idx_mapping_split = idx_mapping.split(', ')
-                    idx_key = str(idx_mapping_split[0])
-                    idx_pos = int(idx_mapping_split[1])
-
-                    # correct for zero-position
-                    idx_start = idx_pos - 1
-                    idx_end = idx_start + len(pept)
-
-                    retrieved_seq = id_seq_dict[idx_key][idx_start:idx_end]
-                    if retrieved_seq == pept:
-
-                        # output format should be:
-                        # header line, 6 cols: peptide \t protein \t location \t prevAA \t in_fasta \t nextAA
-                        # body:                AAAAFRVVK \t lcl|AL009126.3_prot_2464 \t 19 \t \t \t
-                        result_list.append(f'{pept}\t{id_dict[idx_key]}\t{idx_pos}\t\t\t\n')
-                        #print(f"Mapped: '{pept}' to {id_dict[idx_key]} starting at position {idx_pos} and ending at position {idx_end}.")
-
-                    else:
-                        #print(f"\t '{pept}' is not equal to '{retrieved_seq}'")
-                        pass
+        for pept, protein, location in iter_protein_mappings(peptideList, fasta_idx, mapping_engine, mapping_memo):
+            # output format should be:
+            # header line, 6 cols: peptide \t protein \t location \t prevAA \t in_fasta \t nextAA
+            # body:                AAAAFRVVK \t lcl|AL009126.3_prot_2464 \t 19 \t \t \t
+            result_list.append(f'{pept}\t{protein}\t{location}\t\t\t\n')
 
         return result_list
 
 
-def handle_custom_proteases(protease_string):
-    """generate string for custom enzyme in crux"""
-
-    backup_protease_string = protease_string
-
-    # protease cleavage string can only be in the form []|[], []|{}, {}|[] or {}|{} filled with any letter in between
-    # there is no check whether letters are part of bio-alphabet but upper-case is required
-    # X indicates any amino acid
-    # input would be, e.g. 'custom [X]|[RKD]' for lysarginase and asp-n
-    # whitespaces are stripped
-
-    # remove all whitespaces, including e.g. tab which might originate from pasting
-    protease_string = "".join(protease_string.split())
-
-    # custom - trypsin + chymotrypsin [FWYLKR]|{P}
-    # regex that extracts the opening bracket, letters and closing bracket before and after the pipe as individual groups
-    pattern = r'.*?([\[{])([A-Za-z]*)([\]}])\|([\[{])([A-Za-z]*)([\]}])'
-
-    m = re.match(pattern, protease_string)
-    if not m:
-        # if pattern was not found, there is no way to handle this - directly raise error
-        raise ValueError(f"Invalid custom enzyme syntax: {protease_string}")
+def print_mapping_counters(fasta_idx):
+    """report lookups and verified candidates of this run and the most frequent k-mers of the index"""
+    counters = fasta_idx.counters
+    print("", flush=True)
+    print("Peptide mapping statistics:", flush=True)
+    print(f"\t Index lookups: {counters['lookups']}", flush=True)
+    print(f"\t Candidate positions checked: {counters['candidates']}", flush=True)
+    print(f"\t Verification misses: {counters['verification_misses']}", flush=True)
+    settings_type = fasta_idx.shard_type if fasta_idx.index_type == 'sharded' else fasta_idx.index_type
+    if settings_type in ('kmer', 'multi-kmer'):
+        print(f"\t Lookups using second index level: {counters['secondary_lookups']}", flush=True)
+    if fasta_idx.index_type == 'sharded':
+        print(f"\t Index shards: {len(fasta_idx.shard_files)} (memory budget {fasta_idx.memory_budget} MB)", flush=True)
+    # k-mer indices of all key lengths
+    kmer_levels = dict()
+    if fasta_idx.index_type == 'kmer':
+        kmer_levels = {fasta_idx.split_len: fasta_idx}
+    elif fasta_idx.index_type == 'multi-kmer':
+        kmer_levels = fasta_idx.levels
+    for key_len, level in kmer_levels.items():
+        posting_stats = level.posting_statistics()
+        print(f"\t Key length {key_len}:", flush=True)
+        print(f"\t \t Postings per k-mer: mean {posting_stats['mean']:0.1f}, 99th percentile {posting_stats['p99']:0.0f}, "
+              f"max {posting_stats['max']}", flush=True)
+        largest = ', '.join(f"{kmer} ({count})" for kmer, count in posting_stats['largest'])
+        print(f"\t \t Largest postings: {largest}", flush=True)
+        print(f"\t \t K-mers with second index level (> {level.heavy_threshold} postings): {len(level.heavy_kmers)}", flush=True)
+    print("", flush=True)
 
-    pre_open, pre_content, pre_close, post_open, post_content, post_close = m.groups()
 
-    # change amino acids to upper-case and handle empty brackets as any amino acid
-    if pre_content:
-        pre_content = pre_content.upper()
-    elif pre_open == "{":
-        print(
-            f"WARNING: First bracket pair in {backup_protease_string} is empty. Will be replaced with X for any amino acid.",
-            flush=True)
-        print("This results in undigested proteins sequences.", flush=True)
-        print("Please check if this was intended.", flush=True)
-        pre_content = "X"
-    else:
-        print(
-            f"WARNING: First bracket pair in {backup_protease_string} is empty. Will be replaced with X for any amino acid.",
-            flush=True)
-        print("Please check if this was intended.", flush=True)
-        pre_content = "X"
-
-    if post_content:
-        post_content = post_content.upper()
-    elif post_open == "{":
-        print(
-            f"WARNING: Second bracket pair in {backup_protease_string} is empty. Will be replaced with X for any amino acid.",
-            flush=True)
-        print("This results in undigested proteins sequences.", flush=True)
-        print("Please check if this was intended.", flush=True)
-        post_content = "X"
+def stream_mapped_digests(mapped_digest_iter, unfiltered_file, filtered_file, chunk_size=streaming_chunk_size):
+    """
+    write the pooled peptide tables in chunks of at most chunk_size rows
+
+        mapped_digest_iter yields (protease, mc, mapped_rows) in the order of pooling, i.e. increasing MC per
+        protease, with mapped_rows yielding (peptide, protein, location). Rows are appended to unfiltered_file and,
+        without repeated peptide-protein matches per protease, to filtered_file. The filtered table is sorted by
+        decreasing MC with rows of the same MC in pooling order, filtered rows of each MC are collected in a
+        temporary file next to filtered_file until all digests are pooled. Only one chunk and the set of
+        peptide-protein matches of the current protease are kept in memory, the result is identical to pooling
+        all mapped digests at once and dropping duplicates afterwards.
+    """
+    pooled_cols = ['peptide', 'protein', 'location', 'MC', 'Enzyme']
+
+    # write headers, all chunks are appended afterwards
+    DataFrame(columns=pooled_cols).to_csv(unfiltered_file, index=False, sep="\t")
+    DataFrame(columns=pooled_cols).to_csv(filtered_file, index=False, sep="\t")
+
+    def write_chunk(rows, out_file):
+        DataFrame(rows, columns=pooled_cols).to_csv(out_file, index=False, header=False, sep="\t", mode='a')
+
+    # filtered rows and their temporary file by MC
+    mc_filtered_rows = dict()
+    mc_filtered_files = dict()
+
+    def write_filtered_chunks():
+        for chunk_mc, rows in mc_filtered_rows.items():
+            if chunk_mc not in mc_filtered_files:
+                mc_filtered_files[chunk_mc] = f"{filtered_file}.MC{chunk_mc}.tmp"
+                if path.isfile(mc_filtered_files[chunk_mc]):
+                    remove(mc_filtered_files[chunk_mc])
+            write_chunk(rows, mc_filtered_files[chunk_mc])
+        mc_filtered_rows.clear()
+
+    unfiltered_rows = list()
+    current_protease = None
+    seen_matches = set()
+    try:
+        for protease, mc, mapped_rows in mapped_digest_iter:
+            # peptide-protein matches need to be unique within one protease only
+            if protease != current_protease:
+                current_protease = protease
+                seen_matches = set()
+            mc = str(mc)
+            filtered_rows = mc_filtered_rows.setdefault(mc, list())
+            for pept, protein, location in mapped_rows:
+                row = (pept, protein, location, mc, protease)
+                unfiltered_rows.append(row)
+                if (pept, protein) not in seen_matches:
+                    seen_matches.add((pept, protein))
+                    filtered_rows.append(row)
+                if len(unfiltered_rows) >= chunk_size:
+                    write_chunk(unfiltered_rows, unfiltered_file)
+                    write_filtered_chunks()
+                    unfiltered_rows = list()
+                    filtered_rows = mc_filtered_rows.setdefault(mc, list())
+        write_chunk(unfiltered_rows, unfiltered_file)
+        write_filtered_chunks()
+
+        # decreasing MC order of the filtered table
+        with open(filtered_file, 'a', newline='') as out_handle:
+            for mc in sorted(mc_filtered_files, key=int, reverse=True):
+                with open(mc_filtered_files[mc], 'r', newline='') as mc_handle:
+                    copyfileobj(mc_handle, out_handle)
+    finally:
+        for mc_filtered_file in mc_filtered_files.values():
+            if path.isfile(mc_filtered_file):
+                remove(mc_filtered_file)
+    return 0
+
+
+def iter_protein_mappings(peptideList, fasta_idx, mapping_engine='index', mapping_memo=None, workers=1):
+    """yield (peptide, protein identifier, 1-based position) for every occurrence of each peptide"""
+    protein_ids = fasta_idx.protein_ids
+    if mapping_memo is not None:
+        mappings = mapping_memo.iter_mappings(peptideList)
     else:
-        print(
-            f"WARNING: Second bracket pair in {backup_protease_string} is empty. Will be replaced with X for any amino acid.",
-            flush=True)
-        print("Please check if this was intended.", flush=True)
-        post_content = "X"
-
-    # check that opening and closing brackets match, return error code otherwise
-    bracket_dict = {"[": "]", "{": "}"}
-    if bracket_dict.get(pre_open) != pre_close:
-        return -2, "", ""
-    if bracket_dict.get(post_open) != post_close:
-        return -3, "", ""
-
-    return 0, f"{pre_open}{pre_content}{pre_close}|{post_open}{post_content}{post_close}"
+        mappings = iter_engine_mappings(peptideList, fasta_idx, mapping_engine, workers)
+    for pept, protein_number, location in mappings:
+        yield pept, protein_ids[protein_number], location
+
+
+def iter_provenance_mappings(peptide_hits):
+    """yield (peptide, protein identifier, 1-based position) from a provenance digest {peptide: [(protein, position)]}"""
+    for pept, hits in peptide_hits.items():
+        for protein, location in hits:
+            yield pept, protein, location
+
+
+def read_previous_digests(unfiltered_file, settings_file, run_settings):
+    """pooled digests of a previous run with identical digestion settings, None if not available"""
+    if not path.isfile(unfiltered_file):
+        print(f"{colorama.Fore.CYAN}WARNING: No previous digest found in {path.dirname(unfiltered_file)}. Digesting all proteases.{colorama.Style.RESET_ALL}", flush=True)
+        return None
+    if not path.isfile(settings_file):
+        print(f"{colorama.Fore.CYAN}WARNING: Settings of previous digest are unknown ({settings_file} is missing). Digesting all proteases.{colorama.Style.RESET_ALL}", flush=True)
+        return None
+    with open(settings_file, 'r') as f:
+        previous_settings = json.load(f)
+    if not previous_settings == run_settings:
+        print(f"{colorama.Fore.CYAN}WARNING: Previous digest used a different fasta file or digestion settings. Digesting all proteases.{colorama.Style.RESET_ALL}", flush=True)
+        return None
+    return read_table(unfiltered_file, dtype={'MC': int})
 
 
 if __name__ == "__main__":
@@ -6,7 +6,8 @@ from os import environ, rename
 from datetime import datetime
 from time import perf_counter
 from Bio import SeqIO
-from pandas import read_csv, merge
+from numpy import arange, full, nan, unique, zeros
+from pandas import merge, concat, factorize, Categorical, Index, Series
 
 try:
     from lib.CoMPaseD_gui_param_functions import *
@@ -18,6 +19,13 @@ try:
 except ModuleNotFoundError:
     from CoMPaseD_protein_class import *
 
+try:
+    from lib.CoMPaseD_table_io import table_format_choices, table_extensions, resolve_table_format, table_file_name, \
+        find_table_file, read_table, write_table
+except ModuleNotFoundError:
+    from CoMPaseD_table_io import table_format_choices, table_extensions, resolve_table_format, table_file_name, \
+        find_table_file, read_table, write_table
+
 # disable tensorflow warnings / info during import and reset to default
 environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 try:
@@ -26,6 +34,14 @@ except ModuleNotFoundError:
     from CoMPaseD_DMSP import *
 environ['TF_CPP_MIN_LOG_LEVEL'] = '0'
 
+# string columns with repeated values that are dictionary-encoded in binary table formats
+sampling_dictionary_cols = ['protein', 'Enzyme', 'Identifier', 'Group', 'subset']
+result_dictionary_cols = ['Protease combination', 'Protein group']
+
+# code table used to decode each integer-coded column of pep_df (see encode_ids)
+decoded_cols = {'peptide': 'peptide', 'protein': 'protein', 'Identifier': 'protein', 'Enzyme': 'Enzyme',
+                'subset': 'subset'}
+
 
 def main():
     parser = argparse.ArgumentParser(description="run CoMPaseD analysis functions")
@@ -37,6 +53,10 @@ def main():
     parser.add_argument('--sampling_output_path', required=False, help="path to pre-computed sampling_output file",
                         default="This is not a path")
     parser.add_argument('--digestion_result', required=False, help="set unique peptides table from in-silico digestion", default="")
+    parser.add_argument('--table_format', required=False, default='tsv', choices=table_format_choices,
+                        help="format of sampling output and result tables, binary columnar formats require pyarrow")
+    parser.add_argument('--export_tsv', required=False, action='store_true',
+                        help="write tab-separated copies of tables written in a binary format")
 
     # get start time
     time_0 = perf_counter()
@@ -50,6 +70,7 @@ def main():
 
     # parse arguments
     args = parser.parse_args()
+    table_format = resolve_table_format(args.table_format)
 
     # ensure absolute path in case relative path is provided on cmd line
     if not os.path.isabs(args.param_file):
@@ -78,6 +99,8 @@ def main():
 
     # check previous digestion
     if not path.join(args.digestion_result) == "":
+        # the digestion result might be saved in the binary format instead of the given file name
+        args.digestion_result = find_table_file(args.digestion_result, table_format)
         if path.isfile(path.join(args.digestion_result)):
             digest_file = path.join(args.digestion_result)
 
@@ -89,7 +112,8 @@ def main():
             raise FileNotFoundError(f"Digestion result file ({args.digestion_result}) not found. \n"
                                     f"Did you forgot to digest?")
     else:
-        digest_file = path.join(params.Output_directory, "unique_peptides_table_filtered.tsv")
+        digest_file = find_table_file(path.join(params.Output_directory, "unique_peptides_table_filtered.tsv"),
+                                      table_format)
         if not path.isfile(digest_file):
             print(f"Digestion result file ({digest_file}) not found. \n"
                                     f"Did you forgot to digest?")
@@ -100,31 +124,43 @@ def main():
     if args.use_existing_sampling_output:
         if path.isfile(path.join(args.sampling_output_path)):
             try:
-                pep_df = read_csv(path.join(args.sampling_output_path), sep='\t')
+                pep_df = read_table(path.join(args.sampling_output_path))
             except Exception as e:
                 print(f"{colorama.Fore.RED}ERROR: Could not open {path.join(args.sampling_output_path)} due to {e}. Stopping.{colorama.Style.RESET_ALL}")
                 raise RuntimeError
+            pep_df, _, code_tables = encode_ids(pep_df, params.Proteases)
 
     # execute random sampling when --use_existing_sampling_output was not set on cmd
     else:
         # import files
-        pwf_df = read_csv(path.join(params.Protein_weight_file), sep='\t')
-        pep_df = read_csv(digest_file, sep='\t')
+        pwf_df = read_table(path.join(params.Protein_weight_file))
+        pep_df = read_table(digest_file)
 
-        # add number of mapping proteins for each peptide, can be used for filtering on unique peptides later
-        pep_df['protein_count'] = pep_df.groupby(['peptide', 'MC', 'Enzyme'])['protein'].transform('nunique')
+        # peptides, proteins and enzymes are handled as integer codes, strings are only restored for output
+        pep_df, pwf_df, code_tables = encode_ids(pep_df, params.Proteases, pwf_df)
+
+        # random sampling weights are kept per protein instead of being merged into every peptide row
+        rand_sampling_cols, weight_matrix = get_weight_matrix(pwf_df, len(code_tables['protein']))
+        pwf_df = pwf_df.drop(rand_sampling_cols, axis=1)
+
+        # add number of mapping proteins for each peptide, can be used for filtering on unique peptides later,
+        # digests pooled with external sorting already contain it
+        if 'protein_count' not in pep_df.columns:
+            pep_df['protein_count'] = pep_df.groupby(['peptide', 'MC', 'Enzyme'])['protein'].transform('nunique')
 
         # filter for unique peptides per enzyme and MC if set so in the params
         if params.Use_Unique_Peptides_Only == "True":
             pep_df = pep_df[pep_df['protein_count'] == 1]
 
-        # merge raw sampling weights into pep_df
-        pep_df = merge(left=pep_df, right=pwf_df,
-                       left_on="protein", right_on="Identifier",
-                       how="left").reset_index()
+        # merge protein weight file cols into pep_df
+        pep_df = merge_protein_weights(pep_df, pwf_df)
 
         # get protease / mc combinations
         protease_mc_df = protease_mc_expansion(params.Proteases, params.Max_MCs)
+        # generate col with subset codes, i.e. the protease / mc combination of each peptide, to allow subsetting
+        # by only one col
+        pep_df["subset"] = get_subset_codes(pep_df, protease_mc_df, params.Proteases)
+        code_tables['subset'] = Index(protease_mc_df["Enzyme"].astype(str) + "__" + protease_mc_df["MC"].astype(str))
         # add mc freq
         freq_mc = get_numeric_list(params.Freq_MCs)
 
@@ -146,23 +182,14 @@ def main():
             if path.isfile(path.join(params.Path_DeepMSPeptide_Model)):
                 pep_df = predict_detectability(pep_df,
                                                path.join(params.Path_DeepMSPeptide_Model),
-                                               float(params.Weights_DeepMSPeptide_Predictions))
+                                               float(params.Weights_DeepMSPeptide_Predictions),
+                                               code_tables['peptide'])
             else:
                 print(f"{colorama.Fore.RED}ERROR: No valid Deep-MS-Peptide model file provided. Please check: {path.join(params.Path_DeepMSPeptide_Model)}. Stopping.{colorama.Style.RESET_ALL}")
                 raise FileNotFoundError
         else:
             pep_df['DeepMSPep_prediction'] = 1
-        # modify random sampling columns by DeepMSPeptide prediction
-        pep_df = multiply_dmsp(pep_df)
-
-        # generate col with subset keys to allow subsetting by only one col
-        pep_df["subset"] = pep_df["Enzyme"].astype(str) + "__" + pep_df["MC"].astype(str)
-
-        # find random sampling columns
-        rand_sampling_cols = list()
-        for pep_df_col in pep_df.columns:
-            if pep_df_col.lower().startswith("random_sampling_"):
-                rand_sampling_cols.append(pep_df_col)
+        # random sampling weights are multiplied by DeepMSPeptide prediction for each sampling (get_sampling_weights)
 
         # get pep_df index to assign sampled peptides later
         pep_df = pep_df.reset_index(drop=True)
@@ -171,14 +198,16 @@ def main():
         # loop through rand_sampling_cols and sample peptides
         # returning list and assigning samples peptides by ID requires less memory than merging within each loop
         smp_col_list = list()
-        for smp_col in rand_sampling_cols:
+        for col_idx, smp_col in enumerate(rand_sampling_cols):
             print(f"Started {smp_col}", flush=True)
-            tmp_id_list = rand_smp(pep_df, protease_mc_df, column_to_sample=smp_col)
+            tmp_id_list = rand_smp(pep_df, protease_mc_df, get_sampling_weights(pep_df, weight_matrix, col_idx))
             smp_col_name = smp_col.lower().replace("random_sampling_", "sampling_")
 
-            # init sampling_N col with 0 and replace with 1 where ID was obtained from rand_smp
-            pep_df[smp_col_name] = 0
-            pep_df.loc[pep_df["ID"].isin(tmp_id_list), smp_col_name] = 1
+            # init sampling_N col with 0 and replace with 1 where ID (i.e. the row number) was obtained from rand_smp,
+            # 0/1 columns are int8 to save memory
+            smp_values = zeros(len(pep_df), dtype='int8')
+            smp_values[tmp_id_list] = 1
+            pep_df[smp_col_name] = smp_values
             smp_col_list.append(smp_col_name)
 
         # remove unused peptides to reduce file / df size
@@ -187,24 +216,31 @@ def main():
         pep_df.drop(['pep_used'], axis=1, inplace=True)
         pep_df.reset_index(drop=True, inplace=True)
 
-        # convert 0/1 columns to int8 to save memory
-        pep_df[smp_col_list] = pep_df[smp_col_list].astype('int8')
-
         # write output if required
         if params.Sampling_output == "True":
-            sampling_out_file = path.join(params.Output_directory, "RandomSampling.tsv")
+            sampling_out_file = path.join(params.Output_directory, "RandomSampling" + table_extensions[table_format])
 
             # if file exists, try to rename existing file with last modification date and time
             if path.isfile(sampling_out_file):
                 mti = datetime.fromtimestamp(path.getmtime(sampling_out_file))
-                rename_f_name = path.join(params.Output_directory, mti.strftime("%Y-%m-%d_%Hh%Mmin%Ssec_RandomSampling.tsv"))
+                rename_f_name = path.join(params.Output_directory, mti.strftime("%Y-%m-%d_%Hh%Mmin%Ssec_RandomSampling") + table_extensions[table_format])
                 try:
                     rename(sampling_out_file, rename_f_name)
                 except Exception as e:
                     print(f"{colorama.Fore.CYAN}WARNING: Could not rename existing file {sampling_out_file} due to {e}. \n File will be overwritten.{colorama.Style.RESET_ALL}")
 
             print("Started writing sampling output table", flush=True)
-            pep_df.to_csv(sampling_out_file, sep="\t", index=False)
+            sampling_out_df = decode_ids(pep_df, code_tables)
+            # sampling weights are only broadcast to the peptides of the output table, at the position of the
+            # protein weight file cols
+            weight_col_pos = sampling_out_df.columns.get_loc('subset')
+            for col_idx, smp_col in enumerate(rand_sampling_cols):
+                sampling_out_df.insert(weight_col_pos + col_idx, smp_col,
+                                       get_sampling_weights(pep_df, weight_matrix, col_idx))
+            write_table(sampling_out_df, sampling_out_file, dictionary_cols=sampling_dictionary_cols)
+            if args.export_tsv and not table_format == 'tsv':
+                write_table(sampling_out_df, table_file_name(sampling_out_file, 'tsv'))
+            del sampling_out_df
             print("Finished writing sampling output table", flush=True)
 
     # find possible protease combinations to analyse
@@ -217,6 +253,9 @@ def main():
     groups_list = list(set(tmp_grouping_df["Group"].to_list()))
     groups_list.sort()
 
+    # protein identifiers of the fasta file are matched to the protein codes of pep_df
+    protein_codes = {protein: code for code, protein in enumerate(code_tables['protein'])}
+
     # analyse results and store as nested list of CoMPaseD_results objs
     result_list = list()
     for curr_group in groups_list:
@@ -249,7 +288,7 @@ def main():
         # generate analyse_sampling argument tuple for all protease combinations
         analysis_args_list = list()
         for combin in combin_list:
-            analysis_args = (group_pep_df, combin, curr_group, params, n, tot_n)
+            analysis_args = (group_pep_df, combin, curr_group, params, n, tot_n, protein_codes)
             analysis_args_list.append(analysis_args)
             n += 1
 
@@ -329,19 +368,21 @@ def main():
         'Protein coverage weight'])))
 
     # generate output file name and save
-    final_res_df_file_name = path.join(params.Output_directory, "CoMPaseD_results.tsv")
+    final_res_df_file_name = path.join(params.Output_directory, "CoMPaseD_results" + table_extensions[table_format])
 
     # if file exists, try to rename existing file with last modification date and time
     if path.isfile(final_res_df_file_name):
         mti = datetime.fromtimestamp(path.getmtime(final_res_df_file_name))
-        rename_f_name = path.join(params.Output_directory, mti.strftime("%Y-%m-%d_%Hh%Mmin%Ssec_CoMPaseD_results.tsv"))
+        rename_f_name = path.join(params.Output_directory, mti.strftime("%Y-%m-%d_%Hh%Mmin%Ssec_CoMPaseD_results") + table_extensions[table_format])
         try:
             rename(final_res_df_file_name, rename_f_name)
         except Exception as e:
             print(f"{colorama.Fore.CYAN}WARNING: Could not rename existing file {final_res_df_file_name} due to {e}. \n File will be overwritten.{colorama.Style.RESET_ALL}")
 
     print(f"Saved results to {final_res_df_file_name}")
-    final_res_df.to_csv(final_res_df_file_name, sep='\t', index=False)
+    write_table(final_res_df, final_res_df_file_name, dictionary_cols=result_dictionary_cols)
+    if args.export_tsv and not table_format == 'tsv':
+        write_table(final_res_df, table_file_name(final_res_df_file_name, 'tsv'))
 
     # generate summary output table and save
     agg_res_df = final_res_df.groupby(['Protease combination', 'Protein group'], as_index=False).agg(
@@ -424,8 +465,12 @@ def make_result_df(result_list):
     return tmp_res_df
 
 
-def analyse_sampling(pep_df, protease_combin, curr_group, params, n, tot_n) -> list:
-    """Analyse results for one (combination of) protease(s)"""
+def analyse_sampling(pep_df, protease_combin, curr_group, params, n, tot_n, protein_codes=None) -> list:
+    """
+    Analyse results for one (combination of) protease(s),
+    pep_df holds integer codes for peptides, proteins and enzymes (see encode_ids) and protein_codes maps protein
+    identifiers to the protein codes
+    """
 
     # convert potential protease list to string prior print
     combination_str = " - ".join(protease_combin)
@@ -433,8 +478,9 @@ def analyse_sampling(pep_df, protease_combin, curr_group, params, n, tot_n) -> l
 
     # result_list
     combin_result_list = list()
-    # subset pep_df
-    tmp_df = pep_df.loc[pep_df["Enzyme"].isin(protease_combin)]
+    # subset pep_df, enzyme codes follow the order of params.Proteases
+    protease_codes = list(dict.fromkeys(params.Proteases))
+    tmp_df = pep_df.loc[pep_df["Enzyme"].isin([protease_codes.index(protease) for protease in protease_combin])]
 
     # number of random sampling is taken from params instead of df to allow fewer samplings than available
     sampling_col_list = list()
@@ -444,8 +490,8 @@ def analyse_sampling(pep_df, protease_combin, curr_group, params, n, tot_n) -> l
     # generate list of "identified" proteins and fill protein objs with peptides for each random_sampling
     for sampling_col in sampling_col_list:
         protein_list = makeProteinList(SeqIO.parse(params.Fasta, "fasta"))
-        tmp_df_smp = tmp_df.loc[tmp_df[sampling_col] == 1, ["peptide", "protein", "location"]].reset_index(drop=True)
-        protein_list = fillProteinList(protein_list, tmp_df_smp)
+        tmp_df_smp = tmp_df.loc[tmp_df[sampling_col] == 1, ["peptide", "protein", "location", "peptide_length"]].reset_index(drop=True)
+        protein_list = fillProteinList(protein_list, tmp_df_smp, protein_codes)
 
         # after each sampling generate new result obj and put to list
         tmp_result = CoMPaseD_results(protease_combin, sampling_col, curr_group, min_peps_per_prot=2, use_unique_peps_only=params.Use_Unique_Peptides_Only)
@@ -470,7 +516,7 @@ def group_proteins_parsimony(protein_list):
     Returns a list of protein groups (lists of ProteinClass objects).
     """
     # store peptide sets for each protein
-    prot_to_peps = {p: set(str(pep) for pep in p.peps) for p in protein_list}
+    prot_to_peps = {p: set(p.peps) for p in protein_list}
 
     # uncovered peptides
     uncovered_peps = set.union(*prot_to_peps.values())
@@ -517,14 +563,87 @@ def protease_mc_expansion(protease_list, mc_list):
     return_df = DataFrame()
     return_df['Enzyme'] = protease_list_expanded
     return_df['MC'] = MC_list_expanded
+    # code of each protease / mc combination used for the subset col of pep_df (see get_subset_codes)
+    return_df['subset_code'] = arange(len(return_df), dtype='int32')
     return return_df
 
 
-def predict_detectability(pep_df, dmsp_model, dmsp_weight):
-    """Predict peptide detectability by DeepMSPeptide and annotate pep_df"""
+def encode_ids(pep_df, proteases, pwf_df=None):
+    """
+    Dictionary-encode peptide, protein and enzyme strings of pep_df as integer codes
+
+    Peptides and proteins are replaced by int32 codes in order of appearance, with the protein identifiers of pwf_df
+    encoded by the same codes. Enzymes are replaced by int8 codes in order of proteases (-1 for other enzymes) and
+    MC is converted to int8. Peptide lengths are kept in the peptide_length col. Returns pep_df, pwf_df and the code
+    tables to decode the cols (see decode_ids).
+    """
+    code_tables = dict()
+
+    peptide_codes, code_tables['peptide'] = factorize(pep_df['peptide'])
+    pep_df['peptide'] = peptide_codes.astype('int32')
+    pep_df['peptide_length'] = code_tables['peptide'].str.len().to_numpy(dtype='int16')[peptide_codes]
+
+    if pwf_df is not None:
+        # proteins of pwf_df are numbered first to merge both dfs on protein codes
+        protein_codes, code_tables['protein'] = factorize(concat([pwf_df['Identifier'], pep_df['protein']],
+                                                                 ignore_index=True))
+        pwf_df['Identifier'] = protein_codes[:len(pwf_df)].astype('int32')
+        pep_df['protein'] = protein_codes[len(pwf_df):].astype('int32')
+    else:
+        protein_codes, code_tables['protein'] = factorize(pep_df['protein'])
+        pep_df['protein'] = protein_codes.astype('int32')
+
+    code_tables['Enzyme'] = Index(list(dict.fromkeys(proteases)))
+    pep_df['Enzyme'] = Categorical(pep_df['Enzyme'], categories=code_tables['Enzyme']).codes
+    pep_df['MC'] = pep_df['MC'].astype('int8')
+
+    return pep_df, pwf_df, code_tables
+
+
+def merge_protein_weights(pep_df, pwf_df):
+    """
+    Merge the protein weight file cols of pwf_df into pep_df by protein code
+
+    Proteins missing in the protein weight file keep the Identifier code -1, i.e. no Identifier after decoding,
+    and are never sampled as their random sampling weights are NaN (see get_weight_matrix).
+    """
+    pep_df = merge(left=pep_df, right=pwf_df,
+                   left_on="protein", right_on="Identifier",
+                   how="left").reset_index()
+    pep_df['Identifier'] = pep_df['Identifier'].fillna(-1).astype('int32')
+    return pep_df
+
+
+def decode_ids(pep_df, code_tables):
+    """Copy of pep_df with the integer-coded cols replaced by their strings, e.g. for output files"""
+    out_df = pep_df.drop(['peptide_length'], axis=1, errors='ignore')
+    for col, code_table in decoded_cols.items():
+        if (col in out_df.columns) and (code_table in code_tables):
+            out_df[col] = Categorical.from_codes(out_df[col], categories=code_tables[code_table]).astype(object)
+    return out_df
+
+
+def get_subset_codes(pep_df, protease_mc_df, proteases):
+    """Code of the protease / mc combination in protease_mc_df of each peptide in pep_df (-1 if not listed)"""
+    # lookup table of codes by enzyme code and MC, the last row and col hold -1 for enzymes and MCs not listed
+    protease_codes = list(dict.fromkeys(proteases))
+    max_mc = int(protease_mc_df['MC'].max())
+    subset_lookup = full((len(protease_codes) + 1, max_mc + 2), -1, dtype='int32')
+    for protease, mc, subset_code in zip(protease_mc_df['Enzyme'], protease_mc_df['MC'], protease_mc_df['subset_code']):
+        subset_lookup[protease_codes.index(protease), mc] = subset_code
+
+    mc_values = pep_df['MC'].to_numpy()
+    mc_values = mc_values.clip(-1, max_mc + 1)
+    mc_values[mc_values < 0] = max_mc + 1
+    return subset_lookup[pep_df['Enzyme'].to_numpy(), mc_values]
+
+
+def predict_detectability(pep_df, dmsp_model, dmsp_weight, peptide_table):
+    """Predict peptide detectability by DeepMSPeptide and annotate pep_df with peptide codes of peptide_table"""
 
     # get unique peptide sequences
-    peptide_seqs = pep_df['peptide'].unique().tolist()
+    peptide_codes = unique(pep_df['peptide'].to_numpy())
+    peptide_seqs = peptide_table[peptide_codes].tolist()
 
     print("Started peptide detectability prediction", flush=True)
 
@@ -537,23 +656,34 @@ def predict_detectability(pep_df, dmsp_model, dmsp_weight):
     peptide_detectability['DeepMSPep_prediction'] = peptide_detectability['DeepMSPep_prediction'] / max(
         peptide_detectability['DeepMSPep_prediction'])
 
-    # merge results into peptide_df
-    if 'DeepMSPep_prediction' in pep_df.columns:
-        pep_df = pep_df.drop('DeepMSPep_prediction', axis=1)
-    pep_df = merge(left=pep_df, right=peptide_detectability, on='peptide', how='left')
+    # assign results to peptide_df by peptide code, peptides with special amino acids are reported twice and
+    # set to the mean prediction
+    peptide_detectability = peptide_detectability.drop_duplicates('peptide', keep='last')
+    code_prediction = full(len(peptide_table), nan)
+    code_prediction[peptide_codes] = Series(peptide_detectability['DeepMSPep_prediction'].to_numpy(),
+                                            index=peptide_detectability['peptide']).reindex(peptide_seqs).to_numpy()
+    pep_df['DeepMSPep_prediction'] = code_prediction[pep_df['peptide'].to_numpy()]
 
     return pep_df
 
 
-def multiply_dmsp(pep_df, rand_sampling_col="random_sampling_", dmsp_col="DeepMSPep_prediction"):
-    """Multiply random sampling weights with DeepMSPep prediction"""
+def get_weight_matrix(pwf_df, protein_number, rand_sampling_col="random_sampling_"):
+    """
+    Protein-indexed matrix of the random sampling weights in pwf_df
 
-    # find random_sampling_ cols and multiply with dmsp prediction
-    for df_col_name in pep_df.columns:
-        if df_col_name.lower().startswith(rand_sampling_col):
-            pep_df[df_col_name] = pep_df[df_col_name] * pep_df[dmsp_col]
+    Rows are protein codes (see encode_ids) with NaN weights for proteins missing in pwf_df, cols are the random
+    sampling cols of pwf_df. Returns the names of the random sampling cols and the matrix.
+    """
+    rand_sampling_cols = [col for col in pwf_df.columns if col.lower().startswith(rand_sampling_col)]
+    # column-major order as weights are gathered for one random sampling at a time
+    weight_matrix = full((protein_number, len(rand_sampling_cols)), nan, order='F')
+    weight_matrix[pwf_df['Identifier'].to_numpy()] = pwf_df[rand_sampling_cols].to_numpy(dtype='float64')
+    return rand_sampling_cols, weight_matrix
 
-    return pep_df
+
+def get_sampling_weights(pep_df, weight_matrix, col_idx, dmsp_col="DeepMSPep_prediction"):
+    """Weight of each peptide in random sampling col_idx, i.e. its protein weight multiplied with DeepMSPep prediction"""
+    return weight_matrix[pep_df['protein'].to_numpy(), col_idx] * pep_df[dmsp_col].to_numpy()
 
 
 def get_numeric_list(mc_freq_string):
@@ -627,11 +757,8 @@ def normalise_mc(df):
 def get_pep_counts(df, protease_mc_df):
     """Count peptides per protease and mc in pep_df"""
 
-    grouped_df = df.groupby(['Enzyme', 'MC']).agg({'peptide': ['count']})
-    grouped_df.columns = ['pep_count']
-    grouped_df = grouped_df.reset_index()
-    # merge back
-    protease_mc_df = merge(left=protease_mc_df, right=grouped_df, on=['Enzyme', 'MC'], how='left')
+    # count by subset code of each protease / mc combination
+    protease_mc_df['pep_count'] = protease_mc_df['subset_code'].map(df['subset'].value_counts())
 
     return protease_mc_df
 
@@ -711,11 +838,15 @@ def get_peps_required(protease_mc_df, params: CoMPaseD_Parameter):
     return protease_mc_df
 
 
-def rand_smp(pep_df, protease_mc_df, column_to_sample="Random_sampling_1"):
-    """Randomly sample peptides from pep_df"""
+def rand_smp(pep_df, protease_mc_df, sampling_weights):
+    """Randomly sample peptides from pep_df with the sampling weight of each peptide (see get_sampling_weights)"""
+
+    # shuffle pep_df to ensure randomness, only the cols required for sampling are copied
+    pep_df = DataFrame({"subset": pep_df["subset"].to_numpy(), "sampling_weight": sampling_weights,
+                        "ID": pep_df["ID"].to_numpy()}).sample(frac=1).reset_index(drop=True)
 
-    # shuffle pep_df to ensure randomness
-    pep_df = pep_df.sample(frac=1).reset_index(drop=True)
+    # rows of each protease / mc combination by subset code
+    subset_rows = pep_df.groupby("subset", sort=False).indices
 
     # generate list for pep_df['ID']
     pep_id_list = list()
@@ -723,7 +854,7 @@ def rand_smp(pep_df, protease_mc_df, column_to_sample="Random_sampling_1"):
     # iterate through all protease / mc combinations and sample peptides
     for row in protease_mc_df.itertuples():
         # subset pep_df for current protease / mc combination
-        tmp_df = pep_df.loc[(pep_df["subset"] == getattr(row, "subset")), :].reset_index(drop=True)
+        tmp_df = pep_df.take(subset_rows.get(getattr(row, "subset_code"), [])).reset_index(drop=True)
 
         # check number of available peptides
         tmp_sample_size = int(getattr(row, 'sampling_size'))
@@ -733,9 +864,9 @@ def rand_smp(pep_df, protease_mc_df, column_to_sample="Random_sampling_1"):
             print(f"{colorama.Fore.RED}\t Current settings require {tmp_sample_size} peptides to sample but there are less peptides for this category (you should not sample all peptides).{colorama.Style.RESET_ALL}")
             raise RuntimeError
 
-        # sample according to sample size and remove column_to_sample
+        # sample according to sample size
         tmp_df = tmp_df.sample(n=int(getattr(row, 'sampling_size')), replace=False,
-                               weights=column_to_sample).reset_index(drop=True)
+                               weights="sampling_weight").reset_index(drop=True)
 
         # copy ID to pep_id_list
         pep_id_list.append(tmp_df['ID'])
@@ -1,14 +1,27 @@
 import argparse
 import colorama
-import re
-from multiprocessing import Process
+import json
 from sys import platform
 from pandas import read_csv, DataFrame, Series, concat
-from subprocess import Popen, PIPE
 from time import perf_counter
-from os import path, makedirs, chdir, listdir, remove
+from os import path, makedirs, chdir, listdir, remove, stat, access, W_OK
 from shutil import copy, rmtree
 
+try:
+    from lib.CoMPaseD_process_runner import run_commands, commands_failed, default_worker_number
+except ModuleNotFoundError:
+    from CoMPaseD_process_runner import run_commands, commands_failed, default_worker_number
+
+try:
+    from lib.CoMPaseD_digest import split_by_missed_cleavages, handle_custom_proteases
+except ModuleNotFoundError:
+    from CoMPaseD_digest import split_by_missed_cleavages, handle_custom_proteases
+
+try:
+    from lib.CoMPaseD_digest_cache import fasta_checksum
+except ModuleNotFoundError:
+    from CoMPaseD_digest_cache import fasta_checksum
+
 
 def main():
     parser = argparse.ArgumentParser(description="run in-silico digestions using crux toolkit")
@@ -27,6 +40,10 @@ def main():
     parser.add_argument('--clip_n_term_met', required=False, default='T')
     parser.add_argument('--decoy_format', required=False, default='None')
     parser.add_argument('--unique_peps_file', required=False, default='')
+    parser.add_argument('--threads', required=False, default=None, type=int,
+                        help="maximal number of parallel processes (default: number of cores - 1)")
+    parser.add_argument('--promast_threads', required=False, default=1, type=int,
+                        help="threads of each promast process, threads / promast_threads digests are mapped at a time")
 
     # get start time
     time_0 = perf_counter()
@@ -85,6 +102,8 @@ def main():
     max_pep_mw = args.max_mass
     min_pep_len = args.min_len
     max_pep_len = args.max_len
+    threads = args.threads if args.threads is not None else default_worker_number()
+    promast_threads = max(args.promast_threads, 1)
 
     # get all crux commands in a list
     crux_cmd_list, exp_protease_list, exp_mc_list, crux_out_file_list = get_crux_cmds(protease_list,
@@ -100,41 +119,16 @@ def main():
     with open(crux_file_list_file, 'w') as f:
         f.write('\n'.join(crux_out_file_list))
 
-    crux_proc_list = list()
-
-    def crux_process(crux_cmd, n, total, protease, mc):
-        new_proc = Popen(crux_cmd, shell=True, stdout=PIPE, stderr=PIPE)
-        print("", flush=True)
-        print(f"\t\tStarted digestion with {protease} and {mc} missed cleavages", flush=True)
-        out = new_proc.stdout.read()
-        err = new_proc.stderr.read()
-        new_proc.wait()
-        out = out.splitlines()
-        err = err.splitlines()
-        for line in out:
-            print(line.decode('utf8'), flush=True)
-        for line in err:
-            print(line.decode('utf8'), flush=True)
-
-        print(f"\t\tFinished digestion {n} of {total}.", flush=True)
-
-    # count number of digestions
-    n = 0
+    # run crux digestions in parallel, limited to the number of threads
     total = len(crux_cmd_list)
-
-    # init all processes
-    for crux_cmd, protease, mc in zip(crux_cmd_list, exp_protease_list, exp_mc_list):
-        n += 1
-        proc = Process(target=crux_process(crux_cmd, n, total, protease, mc))
-        crux_proc_list.append(proc)
-
-    # start multiprocessing queue
-    for proc in crux_proc_list:
-        proc.start()
-
-    # wait for finishing
-    for proc in crux_proc_list:
-        proc.join()
+    start_messages = [f"\n\t\tStarted digestion with {protease} and up to {mc} missed cleavages"
+                      for protease, mc in zip(exp_protease_list, exp_mc_list)]
+    finish_messages = [f"\t\tFinished digestion {n} of {total}." for n in range(1, total + 1)]
+    crux_results = run_commands(crux_cmd_list, max_workers=threads, start_messages=start_messages,
+                                finish_messages=finish_messages)
+    if commands_failed(crux_results):
+        print(f"{colorama.Fore.RED}ERROR: In-silico digestion with crux failed. Stopping.{colorama.Style.RESET_ALL}", flush=True)
+        raise RuntimeError
 
     print("", flush=True)
     print("Finished all In-silico digestions", flush=True)
@@ -148,82 +142,55 @@ def main():
     print(f"\tDOI: 10.1021/acs.jproteome.8b00544", flush=True)
     print("", flush=True)
 
-    # generate fasta index with clips
-    def clips_process(clips_cmd):
-        new_proc = Popen(clips_cmd, shell=True, stdout=PIPE, stderr=PIPE)
-        print(f"\tStart fasta file index generation", flush=True)
-        out = new_proc.stdout.read()
-        err = new_proc.stderr.read()
-        new_proc.wait()
-        out = out.splitlines()
-        err = err.splitlines()
-        for line in out:
-            print(line.decode('utf8'), flush=True)
-        for line in err:
-            print(line.decode('utf8'), flush=True)
-        print(f"\tFinished fasta file index generation.", flush=True)
-        print("", flush=True)
-
-    # clips needs to run only once to index the fasta file but will be treated in a queue like the other cmds
-    clips_proc_list = list()
-    # copy fasta for clips to crux-output dir
+    # generate fasta index with clips, clips needs to run only once to index the fasta file
+    # the index is kept next to the fasta file and re-used while fasta file and index settings do not change
     chdir(path.join(tmp_out_folder, 'crux-output'))
-    tmp_fasta_loc = path.join(path.join(tmp_out_folder, 'crux-output'), path.basename(fasta))
-    copy(fasta, tmp_fasta_loc)
-    # init clips process
-    clips_proc_list.append(
-        Process(target=clips_process(clips_cmd=generate_clips_call(tmp_fasta_loc, clips_path))))
-    # start multiprocessing queue
-    for proc in clips_proc_list:
-        proc.start()
-    # wait for finishing
-    for proc in clips_proc_list:
-        proc.join()
+    clips_fasta = path.abspath(fasta)
+    if access(path.dirname(clips_fasta), W_OK):
+        index_valid, index_reason = clips_index_valid(clips_fasta)
+    else:
+        # copy fasta for clips to crux-output dir if its folder is not writable
+        clips_fasta = path.join(path.join(tmp_out_folder, 'crux-output'), path.basename(fasta))
+        copy(fasta, clips_fasta)
+        index_valid, index_reason = (False, "fasta folder is not writable")
+    if index_valid:
+        print(f"\tRe-using existing fasta file index {clips_fasta}.pep.idx", flush=True)
+    else:
+        print(f"\tNo valid fasta file index found ({index_reason})", flush=True)
+        clips_results = run_commands([generate_clips_call(clips_fasta, clips_path)], max_workers=1,
+                                     start_messages=["\tStart fasta file index generation"],
+                                     finish_messages=["\tFinished fasta file index generation.\n"])
+        if commands_failed(clips_results):
+            print(f"{colorama.Fore.RED}ERROR: Fasta file index generation with clips failed. Stopping.{colorama.Style.RESET_ALL}", flush=True)
+            raise RuntimeError
+        save_clips_index_settings(clips_fasta)
 
     # map peptides with promast
-    promast_proc_list = list()
-
-    def promast_process(promast_cmd, n, total, protease, mc):
-        new_proc = Popen(promast_cmd, shell=True, stdout=PIPE, stderr=PIPE)
-        print(f"\tStarted peptide mapping for {protease} and {mc} missed cleavages", flush=True)
-        out = new_proc.stdout.read()
-        err = new_proc.stderr.read()
-        new_proc.wait()
-        out = out.splitlines()
-        err = err.splitlines()
-        # promast reports via stderr, thus filter there
-        for line in out:
-            print(line.decode('utf8'), flush=True)
-        for line in err:
-            out_ln = line.decode('utf8')
-            # filter un-necessary information here
-            if "Cannot provide peptide mapping context" not in out_ln:
-                if not out_ln.startswith("Reading index file header"):
-                    print(out_ln, flush=True)
-        print(f"\tFinished peptide mapping for digest {n} of {total}.", flush=True)
-        print("", flush=True)
+    def promast_line_filter(out_ln):
+        # promast reports via stderr, filter un-necessary information here
+        if "Cannot provide peptide mapping context" in out_ln:
+            return False
+        if out_ln.startswith("Reading index file header"):
+            return False
+        return True
 
     promast_cmd_list, protease_list, mc_list, mapped_file_list = map_peptides(out_folder=path.join(out_folder, 'Tmp', 'crux-output'),
                                                                               tmp_out_folder=path.join(out_folder, 'Tmp'),
-                                                                              fasta=tmp_fasta_loc,
-                                                                              promast_path=promast_path)
+                                                                              fasta=clips_fasta,
+                                                                              promast_path=promast_path,
+                                                                              promast_threads=promast_threads)
 
-    n = 0
+    # promast processes use promast_threads each, all processes together at most threads
     total = len(promast_cmd_list)
-
-    # init all processes
-    for promast_cmd, protease, mc in zip(promast_cmd_list, protease_list, mc_list):
-        n += 1
-        proc = Process(target=promast_process(promast_cmd, n, total, protease, mc))
-        promast_proc_list.append(proc)
-
-    # start multiprocessing queue
-    for proc in promast_proc_list:
-        proc.start()
-
-    # wait for finishing
-    for proc in promast_proc_list:
-        proc.join()
+    start_messages = [f"\tStarted peptide mapping for {protease} and {mc} missed cleavages"
+                      for protease, mc in zip(protease_list, mc_list)]
+    finish_messages = [f"\tFinished peptide mapping for digest {n} of {total}.\n" for n in range(1, total + 1)]
+    promast_results = run_commands(promast_cmd_list, max_workers=max(threads // promast_threads, 1),
+                                   start_messages=start_messages, finish_messages=finish_messages,
+                                   line_filter=promast_line_filter)
+    if commands_failed(promast_results):
+        print(f"{colorama.Fore.RED}ERROR: Peptide mapping with promast failed. Stopping.{colorama.Style.RESET_ALL}", flush=True)
+        raise RuntimeError
 
     print("", flush=True)
     print("Finished peptide mapping", flush=True)
@@ -272,11 +239,10 @@ def main():
     complete_df_file = path.join(out_folder, "unique_peptides_table_unfiltered.tsv")
     df_complete.to_csv(complete_df_file, index=False, sep="\t")
 
-    # remove redundant peptides from multiple missed cleavages
-    df_complete_sorted = df_complete.sort_values(by='MC', ascending=False, kind='mergesort')
-    # keep=last to remove duplicates with less than max mc in each file (crux generates peptides with zero to max mc's)
-    df_filtered_sorted = df_complete_sorted.drop_duplicates(subset=['peptide', 'Enzyme'], keep='last',
-                                                            ignore_index=True)
+    # peptides are labelled by their exact number of missed cleavages and pooled in increasing MC order,
+    # keep=first retains the lowest MC for peptides that become identical by I/L equivalence during mapping
+    df_filtered_sorted = df_complete.drop_duplicates(subset=['peptide', 'Enzyme'], keep='first',
+                                                     ignore_index=True)
 
     if not path.join(args.unique_peps_file) == "":
         filtered_df_file = path.join(args.unique_peps_file)
@@ -344,10 +310,7 @@ def generate_peptides_call(out_folder,
     if enzyme.lower().startswith("custom"):
         return_code, cleavage_spec = handle_custom_proteases(enzyme)
 
-        if return_code == -1:
-            str_help = "{P}"
-            raise ValueError(f"Custom proteases must contain exactly two pairs of squared or curly brackets, e.g. 'custom,trypsin,[KR]|{str_help}'. '{enzyme}' is mal-formatted. Please check. Stopping.")
-        elif return_code == -2:
+        if return_code == -2:
             raise ValueError(f"Inconsistent bracket type in first bracket pair of '{enzyme}'. Please check. Stopping.")
         elif return_code == -3:
             raise ValueError(f"Inconsistent bracket type in second bracket pair of '{enzyme}'. Please check. Stopping.")
@@ -374,11 +337,47 @@ def generate_peptides_call(out_folder,
     return peptide_cutter_command
 
 
+def clips_index_valid(fasta, segment_size=5) -> tuple:
+    """
+    compare the settings saved with the clips index of a fasta file (<fasta>.pep.idx) with fasta file and
+        segment size, returns (True, '') if the index can be re-used and (False, reason) otherwise.
+        The fasta checksum is only calculated if size or modification time of the fasta file changed.
+    """
+    index_file = f"{fasta}.pep.idx"
+    settings_file = f"{index_file}.json"
+    if not (path.isfile(index_file) and path.isfile(settings_file)):
+        return False, "no index found"
+    try:
+        with open(settings_file, 'r') as f:
+            settings = json.load(f)
+    except (OSError, ValueError) as e:
+        return False, f"index settings could not be read ({e})"
+    if not settings.get('segment_size') == int(segment_size):
+        return False, f"index segment size {settings.get('segment_size')} differs from {segment_size}"
+    fasta_stat = stat(fasta)
+    if (settings.get('fasta_mtime') == fasta_stat.st_mtime) and (settings.get('fasta_size') == fasta_stat.st_size):
+        return True, ''
+    if not settings.get('fasta_sha256') == fasta_checksum(fasta):
+        return False, "fasta file content changed"
+    return True, ''
+
+
+def save_clips_index_settings(fasta, segment_size=5):
+    """save fasta fingerprint and segment size next to a clips index created by generate_clips_call"""
+    fasta_stat = stat(fasta)
+    settings = {'fasta_sha256': fasta_checksum(fasta),
+                'fasta_mtime': fasta_stat.st_mtime,
+                'fasta_size': fasta_stat.st_size,
+                'segment_size': int(segment_size)}
+    with open(f"{fasta}.pep.idx.json", 'w') as f:
+        json.dump(settings, f, indent=1)
+
+
 def generate_clips_call(fasta, clips_path, segment_size=5):
     """
     clips.pl provides further command line options: \n
         -V = do not use PEFF variants (default: use them) \n
-        -f = force index file overwriting (default clips.pl: do not; here set to -f in order to avoid errors) \n
+        -f = force index file overwriting (default clips.pl: do not; here set to -f as outdated indices are replaced) \n
 	    -I = do not convert I->L (default: convert) \n
 	    -A = do not generate all possible keys in index \n
 
@@ -413,43 +412,49 @@ def generate_promast_call(fasta, peptide_list, out_name, promast_path, number_cp
 
 
 def get_crux_cmds(protease_list, mc_list, fasta, crux_path, min_pep_mw=400, max_pep_mw=6000, min_pep_len=6, max_pep_len=55):
-    # get plain list with possible protease / MCs combinations
+    """
+    one crux command per protease with its maximal number of missed cleavages,
+        peptides are split by their exact number of missed cleavages before mapping
+    """
     expanded_protease_list = list()
     expanded_mc_list = list()
     # list out files to file for later read back
     crux_out_file_list = list()
-    # use protease_list instead of protease_list_clean for crux command
-    for each_protease, each_max_mc in zip(protease_list, mc_list):
-        for each_mc in range(each_max_mc + 1):
-            expanded_protease_list.append(each_protease)
-            expanded_mc_list.append(each_mc)
     crux_cmd_list = list()
-    crux_opt_list = list()
-    # loop through both expanded lists and generate crux call
-    for protease, mc in zip(expanded_protease_list, expanded_mc_list):
-        protease_ls = list()
-        protease_ls.append(protease)
-        protease_clean = clean_protease_names(protease_ls)
-        result_name = str(str(protease_clean[0]) + "_" + str(mc) + "_MCs")
+    # use protease_list instead of protease_list_clean for crux command
+    for protease, max_mc in zip(protease_list, mc_list):
+        expanded_protease_list.append(protease)
+        expanded_mc_list.append(int(max_mc))
+        protease_clean = clean_protease_names([protease])
+        result_name = str(str(protease_clean[0]) + "_" + str(max_mc) + "_MCs")
         crux_cmd = generate_peptides_call(out_folder=result_name,
                                           fasta=path.join(fasta),
                                           crux_path=path.join(crux_path),
                                           enzyme=protease,
-                                          missed_cleavages=mc,
+                                          missed_cleavages=max_mc,
                                           min_mass=min_pep_mw,
                                           max_mass=max_pep_mw,
                                           min_len=min_pep_len,
                                           max_len=max_pep_len)
         crux_cmd_list.append(crux_cmd)
-        crux_out_file_str = str(protease_clean[0]) + "_" + str(mc) + \
+        crux_out_file_str = str(protease_clean[0]) + "_" + str(max_mc) + \
                             "_MCs.generate-peptides.target.txt" + "\t" + protease + \
-                            "\t" + str(mc)
+                            "\t" + str(max_mc)
 
         crux_out_file_list.append(crux_out_file_str)
     return crux_cmd_list, expanded_protease_list, expanded_mc_list, crux_out_file_list
 
 
-def map_peptides(out_folder, tmp_out_folder, fasta, promast_path):
+def iter_peptide_column(crux_file):
+    """yield the header and all values of the first column of a crux result file, reading line by line"""
+    with open(crux_file, 'r') as f:
+        for line in f:
+            value = line.split('\t', 1)[0].rstrip('\r\n')
+            if value:
+                yield value
+
+
+def map_peptides(out_folder, tmp_out_folder, fasta, promast_path, promast_threads=1):
     """
     Use promast_write.pl to map peptide positions in protein.fasta \n\n
 
@@ -457,6 +462,7 @@ def map_peptides(out_folder, tmp_out_folder, fasta, promast_path):
     :param tmp_out_folder: path.join(args.out_folder, 'Tmp')
     :param fasta: path.join(args.fasta)
     :param promast_path: path.join(args.promast_path)
+    :param promast_threads: number of threads of each promast process
     :return:
     """
     # get crux-output file names
@@ -471,93 +477,32 @@ def map_peptides(out_folder, tmp_out_folder, fasta, promast_path):
             # crux_file_list_file is tabular with file names in column [0]
             tmp_col = line.split(sep='\t')
 
-            # remove MW and protein ID from file and save under modified name
+            # remove MW and protein ID from file, split by exact number of missed cleavages and save
+            # each missed cleavage level under modified name
             crux_file = path.join(out_folder, tmp_col[0])
-            mapping_crux_file = path.join(out_folder, str('Mapping_' + tmp_col[0]))
-            mapped_crux_file = path.join(out_folder, str('Mapped_' + tmp_col[0]))
-            df = read_csv(crux_file, delimiter='\t', usecols=[0])  # use pandas read_csv
-            df.to_csv(mapping_crux_file, index=False)
-
-            crux_file_list.append(crux_file)
-            mapping_crux_file_list.append(mapping_crux_file)
-            mapped_crux_file_list.append(mapped_crux_file)
-            protease_list.append(str(tmp_col[1]))
-            mc_list.append(str(tmp_col[2]))
+            peptide_column = iter_peptide_column(crux_file)
+            peptide_col = next(peptide_column, 'sequence')
+            protease_clean = clean_protease_names([tmp_col[1]])[0]
+            for mc, peptide_list in split_by_missed_cleavages(peptide_column, tmp_col[1], tmp_col[2]).items():
+                level_file = f'{protease_clean}_{mc}_MCs.generate-peptides.target.txt'
+                mapping_crux_file = path.join(out_folder, str('Mapping_' + level_file))
+                mapped_crux_file = path.join(out_folder, str('Mapped_' + level_file))
+                with open(mapping_crux_file, 'w') as mapping_f:
+                    mapping_f.write('\n'.join([peptide_col] + peptide_list) + '\n')
+
+                crux_file_list.append(crux_file)
+                mapping_crux_file_list.append(mapping_crux_file)
+                mapped_crux_file_list.append(mapped_crux_file)
+                protease_list.append(str(tmp_col[1]))
+                mc_list.append(str(mc))
 
     promast_cmd_list = list()
     for f, o in zip(mapping_crux_file_list, mapped_crux_file_list):
-        promast_cmd_list.append(generate_promast_call(fasta, peptide_list=f, out_name=o, promast_path=promast_path))
+        promast_cmd_list.append(generate_promast_call(fasta, peptide_list=f, out_name=o, promast_path=promast_path,
+                                                      number_cpus=promast_threads))
 
     return promast_cmd_list, protease_list, mc_list, mapped_crux_file_list
 
 
-def handle_custom_proteases(protease_string):
-    """generate string for custom enzyme in crux"""
-
-    backup_protease_string = protease_string
-
-    # protease cleavage string can only be in the form []|[], []|{}, {}|[] or {}|{} filled with any letter in between
-    # there is no check whether letters are part of bio-alphabet but upper-case is required
-    # X indicates any amino acid
-    # input would be, e.g. 'custom [X]|[RKD]' for lysarginase and asp-n
-    # whitespaces are stripped
-
-    # remove all whitespaces, including e.g. tab which might originate from pasting
-    protease_string = "".join(protease_string.split())
-
-    # custom - trypsin + chymotrypsin [FWYLKR]|{P}
-    # regex that extracts the opening bracket, letters and closing bracket before and after the pipe as individual groups
-    pattern = r'.*?([\[{])([A-Za-z]*)([\]}])\|([\[{])([A-Za-z]*)([\]}])'
-
-    m = re.match(pattern, protease_string)
-    if not m:
-        # if pattern was not found, there is no way to handle this - directly raise error
-        raise ValueError(f"Invalid custom enzyme syntax: {protease_string}")
-
-    pre_open, pre_content, pre_close, post_open, post_content, post_close = m.groups()
-
-    # change amino acids to upper-case and handle empty brackets as any amino acid
-    if pre_content:
-        pre_content = pre_content.upper()
-    elif pre_open == "{":
-        print(
-            f"WARNING: First bracket pair in {backup_protease_string} is empty. Will be replaced with X for any amino acid.",
-            flush=True)
-        print("This results in undigested proteins sequences.", flush=True)
-        print("Please check if this was intended.", flush=True)
-        pre_content = "X"
-    else:
-        print(
-            f"WARNING: First bracket pair in {backup_protease_string} is empty. Will be replaced with X for any amino acid.",
-            flush=True)
-        print("Please check if this was intended.", flush=True)
-        pre_content = "X"
-
-    if post_content:
-        post_content = post_content.upper()
-    elif post_open == "{":
-        print(
-            f"WARNING: Second bracket pair in {backup_protease_string} is empty. Will be replaced with X for any amino acid.",
-            flush=True)
-        print("This results in undigested proteins sequences.", flush=True)
-        print("Please check if this was intended.", flush=True)
-        post_content = "X"
-    else:
-        print(
-            f"WARNING: Second bracket pair in {backup_protease_string} is empty. Will be replaced with X for any amino acid.",
-            flush=True)
-        print("Please check if this was intended.", flush=True)
-        post_content = "X"
-
-    # check that opening and closing brackets match, return error code otherwise
-    bracket_dict = {"[": "]", "{": "}"}
-    if bracket_dict.get(pre_open) != pre_close:
-        return -2, "", ""
-    if bracket_dict.get(post_open) != post_close:
-        return -3, "", ""
-
-    return 0, f"{pre_open}{pre_content}{pre_close}|{post_open}{post_content}{post_close}"
-
-
 if __name__ == "__main__":
     main()
@@ -0,0 +1,289 @@
+import re
+import colorama
+from Bio import SeqIO
+from os import path
+
+
+# cleavage rules of the crux enzymes in crux custom-enzyme syntax, see http://crux.ms/commands/generate-peptides.html
+# square brackets list residues at which cleavage occurs, curly brackets list residues that prevent cleavage
+# and X represents any amino acid
+enzyme_rules = {"trypsin": "[RK]|{P}",
+                "trypsin/p": "[RK]|[X]",
+                "chymotrypsin": "[FWYL]|{P}",
+                "elastase": "[ALIV]|{P}",
+                "clostripain": "[R]|[X]",
+                "cyanogen-bromide": "[M]|[X]",
+                "iodosobenzoate": "[W]|[X]",
+                "proline-endopeptidase": "[P]|[X]",
+                "staph-protease": "[E]|[X]",
+                "asp-n": "[X]|[D]",
+                "lys-c": "[K]|{P}",
+                "lys-n": "[X]|[K]",
+                "arg-c": "[R]|{P}",
+                "glu-c": "[DE]|{P}",
+                "pepsin-a": "[FL]|{P}",
+                "elastase-trypsin-chymotrypsin": "[ALIVKRWFY]|{P}",
+                "lysarginase": "[X]|[KR]"}
+
+# average and monoisotopic amino acid residue masses, amino acids without defined mass (B, J, X, Z) are not digested
+average_masses = {'A': 71.0788, 'R': 156.1875, 'N': 114.1038, 'D': 115.0886, 'C': 103.1388, 'E': 129.1155,
+                  'Q': 128.1307, 'G': 57.0519, 'H': 137.1411, 'I': 113.1594, 'L': 113.1594, 'K': 128.1741,
+                  'M': 131.1926, 'F': 147.1766, 'P': 97.1167, 'S': 87.0782, 'T': 101.1051, 'W': 186.2132,
+                  'Y': 163.1760, 'V': 99.1326, 'U': 150.0388, 'O': 237.2982}
+mono_masses = {'A': 71.03711, 'R': 156.10111, 'N': 114.04293, 'D': 115.02694, 'C': 103.00919, 'E': 129.04259,
+               'Q': 128.05858, 'G': 57.02146, 'H': 137.05891, 'I': 113.08406, 'L': 113.08406, 'K': 128.09496,
+               'M': 131.04049, 'F': 147.06841, 'P': 97.05276, 'S': 87.03203, 'T': 101.04768, 'W': 186.07931,
+               'Y': 163.06333, 'V': 99.06841, 'U': 150.95364, 'O': 237.14773}
+water_mass = {'average': 18.01528, 'mono': 18.010565}
+
+
+def handle_custom_proteases(protease_string):
+    """
+    generate string for custom enzyme in crux, returns (0, cleavage specificity) or (-2, "") and (-3, "") for
+        inconsistent brackets in the first and second bracket pair, raises ValueError for mal-formatted strings
+    """
+
+    backup_protease_string = protease_string
+
+    # protease cleavage string can only be in the form []|[], []|{}, {}|[] or {}|{} filled with any letter in between
+    # there is no check whether letters are part of bio-alphabet but upper-case is required
+    # X indicates any amino acid
+    # input would be, e.g. 'custom [X]|[RKD]' for lysarginase and asp-n
+    # whitespaces are stripped
+
+    # remove all whitespaces, including e.g. tab which might originate from pasting
+    protease_string = "".join(protease_string.split())
+
+    # custom - trypsin + chymotrypsin [FWYLKR]|{P}
+    # regex that extracts the opening bracket, letters and closing bracket before and after the pipe as individual groups
+    pattern = r'.*?([\[{])([A-Za-z]*)([\]}])\|([\[{])([A-Za-z]*)([\]}])'
+
+    m = re.match(pattern, protease_string)
+    if not m:
+        # if pattern was not found, there is no way to handle this - directly raise error
+        raise ValueError(f"Invalid custom enzyme syntax: {protease_string}")
+
+    pre_open, pre_content, pre_close, post_open, post_content, post_close = m.groups()
+
+    # change amino acids to upper-case and handle empty brackets as any amino acid
+    if pre_content:
+        pre_content = pre_content.upper()
+    elif pre_open == "{":
+        print(
+            f"WARNING: First bracket pair in {backup_protease_string} is empty. Will be replaced with X for any amino acid.",
+            flush=True)
+        print("This results in undigested proteins sequences.", flush=True)
+        print("Please check if this was intended.", flush=True)
+        pre_content = "X"
+    else:
+        print(
+            f"WARNING: First bracket pair in {backup_protease_string} is empty. Will be replaced with X for any amino acid.",
+            flush=True)
+        print("Please check if this was intended.", flush=True)
+        pre_content = "X"
+
+    if post_content:
+        post_content = post_content.upper()
+    elif post_open == "{":
+        print(
+            f"WARNING: Second bracket pair in {backup_protease_string} is empty. Will be replaced with X for any amino acid.",
+            flush=True)
+        print("This results in undigested proteins sequences.", flush=True)
+        print("Please check if this was intended.", flush=True)
+        post_content = "X"
+    else:
+        print(
+            f"WARNING: Second bracket pair in {backup_protease_string} is empty. Will be replaced with X for any amino acid.",
+            flush=True)
+        print("Please check if this was intended.", flush=True)
+        post_content = "X"
+
+    # check that opening and closing brackets match, return error code otherwise
+    bracket_dict = {"[": "]", "{": "}"}
+    if bracket_dict.get(pre_open) != pre_close:
+        return -2, ""
+    if bracket_dict.get(post_open) != post_close:
+        return -3, ""
+
+    return 0, f"{pre_open}{pre_content}{pre_close}|{post_open}{post_content}{post_close}"
+
+
+def get_cleavage_rule(enzyme):
+    """return the crux-style cleavage specificity string for a crux enzyme name or a custom enzyme"""
+
+    if enzyme.lower().startswith("custom"):
+        custom_result = handle_custom_proteases(enzyme)
+        if not custom_result[0] == 0:
+            raise ValueError(f"Inconsistent bracket types in '{enzyme}'. Please check. Stopping.")
+        return custom_result[1]
+
+    if enzyme not in enzyme_rules:
+        raise ValueError(f"Protease not defined. Must be one of {set(enzyme_rules.keys())}.")
+
+    return enzyme_rules[enzyme]
+
+
+def compile_cleavage_rule(cleavage_spec):
+    """
+    Convert a crux-style cleavage specificity like '[RK]|{P}' to a regular expression
+        matching the (zero-width) cleavage sites within a protein sequence
+    """
+
+    m = re.fullmatch(r'([\[{])([A-Z]*)([\]}])\|([\[{])([A-Z]*)([\]}])', cleavage_spec)
+    if not m:
+        raise ValueError(f"Invalid cleavage specificity: {cleavage_spec}")
+    pre_open, pre_content, _, post_open, post_content, _ = m.groups()
+
+    def residue_class(bracket, content):
+        # empty brackets or X represent any amino acid, curly brackets negate the amino acid selection
+        if (content == "") or ("X" in content):
+            return "." if bracket == "[" else None
+        if bracket == "[":
+            return f"[{content}]"
+        return f"[^{content}]"
+
+    pre_class = residue_class(pre_open, pre_content)
+    post_class = residue_class(post_open, post_content)
+
+    # {X} prevents any cleavage, use a pattern that never matches
+    if (pre_class is None) or (post_class is None):
+        return re.compile(r'(?!)')
+
+    return re.compile(f"(?<={pre_class})(?={post_class})")
+
+
+def peptide_mass(peptide, mass_type='average'):
+    """calculate neutral peptide mass, returns None for peptides with undefined amino acids"""
+    mass_dict = average_masses if mass_type == 'average' else mono_masses
+    try:
+        return sum(mass_dict[aa] for aa in peptide) + water_mass[mass_type]
+    except KeyError:
+        return None
+
+
+def digest_sequence(sequence, cleavage_pattern, max_missed_cleavages=0, min_len=6, max_len=55,
+                    min_mass=400, max_mass=6000, clip_n_term_met=True, mass_type='average'):
+    """
+    Digest one protein sequence in-silico, yields (peptide, start, missed_cleavages) tuples
+        with 0-based start positions for all peptides passing length and mass filters
+    """
+
+    seq_len = len(sequence)
+    # cleavage site vector including protein termini
+    sites = [0] + [m.start() for m in cleavage_pattern.finditer(sequence)] + [seq_len]
+    # n-terminal methionine can be clipped off, the first peptide is then reported with and without methionine
+    # (not required when the protease already cleaves after the initial methionine)
+    clip_met = clip_n_term_met and sequence.startswith('M') and (sites[1] != 1)
+
+    for start_idx in range(len(sites) - 1):
+        start = sites[start_idx]
+        # consider peptides spanning up to max_missed_cleavages internal cleavage sites
+        for end_idx in range(start_idx + 1, min(start_idx + max_missed_cleavages + 2, len(sites))):
+            end = sites[end_idx]
+            missed = end_idx - start_idx - 1
+
+            peptide_starts = [start]
+            if clip_met and start == 0:
+                peptide_starts.append(1)
+
+            for pep_start in peptide_starts:
+                pep_len = end - pep_start
+                if pep_len > max_len:
+                    continue
+                if pep_len < min_len:
+                    continue
+                peptide = sequence[pep_start:end]
+                mass = peptide_mass(peptide, mass_type)
+                if mass is None:
+                    continue
+                if min_mass <= mass <= max_mass:
+                    yield peptide, pep_start, missed
+
+            # longer peptides from the same start will not pass the length filter
+            if end - start > max_len:
+                break
+
+
+def iter_fasta_sequences(fasta):
+    """yield (identifier, upper-case sequence) tuples of a fasta file without keeping all proteins in memory"""
+    if not path.isfile(fasta):
+        print(f"{colorama.Fore.RED}ERROR: Fasta file not existing. Please check: {fasta}. \n Stopping. {colorama.Style.RESET_ALL}", flush=True)
+        raise FileNotFoundError(fasta)
+
+    with open(fasta) as handle:
+        for record in SeqIO.parse(handle, "fasta"):
+            yield record.id, str(record.seq).upper()
+
+
+def load_fasta_sequences(fasta):
+    """read fasta file once and return a list of (identifier, upper-case sequence) tuples"""
+    return list(iter_fasta_sequences(fasta))
+
+
+def count_missed_cleavages(peptide, cleavage_pattern):
+    """number of internal cleavage sites of a peptide, i.e. its exact number of missed cleavages"""
+    # the zero-width pattern cannot match at the peptide termini as look-behind/-ahead need a residue there
+    return sum(1 for _ in cleavage_pattern.finditer(peptide))
+
+
+def split_by_missed_cleavages(peptide_list, enzyme, max_missed_cleavages) -> dict:
+    """
+    Split peptides of a digest with up to max_missed_cleavages into lists with exactly 0, 1, ... missed cleavages,
+        allows to label peptides from a single crux digestion by their missed cleavage level
+    """
+    cleavage_pattern = compile_cleavage_rule(get_cleavage_rule(enzyme))
+    mc_levels = {mc: list() for mc in range(int(max_missed_cleavages) + 1)}
+    for peptide in peptide_list:
+        mc = count_missed_cleavages(peptide, cleavage_pattern)
+        # peptides from crux should not exceed max_missed_cleavages, keep them at the highest level otherwise
+        mc_levels[min(mc, int(max_missed_cleavages))].append(peptide)
+    return mc_levels
+
+
+def digest_proteome_mc_levels(protein_list, enzyme, max_missed_cleavages=0, min_mass=400, max_mass=6000, min_len=6,
+                              max_len=55, clip_n_term_met="T", mass_type='average') -> dict:
+    """
+    Digest all proteins once with up to max_missed_cleavages and return a dict with alphabetically sorted lists
+        of unique peptides for each exact number of missed cleavages
+    """
+
+    cleavage_pattern = compile_cleavage_rule(get_cleavage_rule(enzyme))
+    clip_met = str(clip_n_term_met).upper() in ("T", "TRUE")
+
+    # the number of missed cleavages only depends on the peptide sequence, thus each peptide is in exactly one set
+    mc_sets = {mc: set() for mc in range(int(max_missed_cleavages) + 1)}
+    for _, sequence in protein_list:
+        for peptide, _, missed in digest_sequence(sequence, cleavage_pattern,
+                                                  max_missed_cleavages=int(max_missed_cleavages),
+                                                  min_len=int(min_len), max_len=int(max_len),
+                                                  min_mass=float(min_mass), max_mass=float(max_mass),
+                                                  clip_n_term_met=clip_met, mass_type=mass_type):
+            mc_sets[missed].add(peptide)
+
+    return {mc: sorted(peptide_set) for mc, peptide_set in mc_sets.items()}
+
+
+def digest_proteome_provenance(protein_list, enzyme, max_missed_cleavages=0, min_mass=400, max_mass=6000, min_len=6,
+                               max_len=55, clip_n_term_met="T", il_equivalence=True, mass_type='average') -> dict:
+    """
+    Digest all proteins once and keep the origin of each peptide, returns a dict for each exact number of missed
+        cleavages that maps alphabetically sorted peptides to lists of (protein identifier, 1-based position)
+        tuples in fasta file order. The proteins of a peptide directly show whether it is shared or unique.
+        With il_equivalence, I is replaced by L in all peptides as in mapped digests.
+    """
+
+    cleavage_pattern = compile_cleavage_rule(get_cleavage_rule(enzyme))
+    clip_met = str(clip_n_term_met).upper() in ("T", "TRUE")
+
+    mc_hits = {mc: dict() for mc in range(int(max_missed_cleavages) + 1)}
+    for protein_id, sequence in protein_list:
+        for peptide, start, missed in digest_sequence(sequence, cleavage_pattern,
+                                                      max_missed_cleavages=int(max_missed_cleavages),
+                                                      min_len=int(min_len), max_len=int(max_len),
+                                                      min_mass=float(min_mass), max_mass=float(max_mass),
+                                                      clip_n_term_met=clip_met, mass_type=mass_type):
+            if il_equivalence:
+                peptide = peptide.replace('I', 'L')
+            mc_hits[missed].setdefault(peptide, list()).append((protein_id, start + 1))
+
+    return {mc: dict(sorted(hits.items())) for mc, hits in mc_hits.items()}
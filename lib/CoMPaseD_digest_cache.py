@@ -0,0 +1,125 @@
+import hashlib
+import json
+from os import path, makedirs, replace, remove
+from pandas import read_csv
+
+try:
+    from lib.CoMPaseD_digest import get_cleavage_rule
+except ModuleNotFoundError:
+    from CoMPaseD_digest import get_cleavage_rule
+
+
+# increase if the format of mapped digests changes to invalidate old cache entries
+digest_cache_version = 1
+
+# header of mapped digests, identical to the 'Mapped_' files of CoMPaseD_PeptideMapper
+mapped_digest_header = 'peptide\tprotein\tlocation\tprevAA\tin_fasta\tnextAA\n'
+
+
+def fasta_checksum(fasta, block_size=1 << 20) -> str:
+    """sha256 of the fasta file content, identical fasta files at different locations share cache entries"""
+    sha = hashlib.sha256()
+    with open(fasta, 'rb') as handle:
+        while block := handle.read(block_size):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def digestion_settings(fasta_hash, min_mass, max_mass, min_len, max_len, clip_n_term_met, il_equivalence,
+                       indexing_key_len, digestion_engine, peptide_mapping='exact') -> dict:
+    """
+    settings shared by all digests of one run, also saved with the pooled peptide tables,
+        peptide_mapping is 'exact' for all matches in the proteome or 'provenance' for digestion sites only
+    """
+    settings = {'version': digest_cache_version,
+                'fasta_sha256': fasta_hash,
+                'min_mass': float(min_mass),
+                'max_mass': float(max_mass),
+                'min_len': int(min_len),
+                'max_len': int(max_len),
+                'clip_n_term_met': str(clip_n_term_met).upper() in ("T", "TRUE"),
+                'il_equivalence': bool(il_equivalence),
+                'indexing_key_len': int(indexing_key_len) if str(indexing_key_len).strip().isdigit()
+                else str(indexing_key_len).strip().lower(),
+                'digestion_engine': digestion_engine}
+    # only stored if not default to keep cache entries of exact mappings valid
+    if not peptide_mapping == 'exact':
+        settings['peptide_mapping'] = peptide_mapping
+    return settings
+
+
+def digest_cache_params(fasta_hash, protease, mc, min_mass, max_mass, min_len, max_len, clip_n_term_met,
+                        il_equivalence, indexing_key_len, digestion_engine, peptide_mapping='exact') -> dict:
+    """all settings that determine the mapped peptides of one protease and exact number of missed cleavages"""
+    cache_params = digestion_settings(fasta_hash, min_mass, max_mass, min_len, max_len, clip_n_term_met,
+                                      il_equivalence, indexing_key_len, digestion_engine, peptide_mapping)
+    # custom and named enzymes with identical cleavage rules share cache entries
+    cache_params['cleavage_rule'] = get_cleavage_rule(protease)
+    cache_params['mc'] = int(mc)
+    return cache_params
+
+
+def digest_cache_file(cache_dir, cache_params) -> str:
+    """location of the mapped digest for cache_params, named by the hash of the parameters"""
+    key = hashlib.sha256(json.dumps(cache_params, sort_keys=True).encode()).hexdigest()
+    return path.join(cache_dir, key[:2], f"{key}.mapped.tsv")
+
+
+def mapped_digest_cache_entries(cache_dir, fasta_hash, protease, max_mc, min_mass, max_mass, min_len, max_len,
+                                clip_n_term_met, il_equivalence, indexing_key_len, digestion_engine,
+                                peptide_mapping='exact') -> dict:
+    """return {mc: (cache_file, cache_params)} for all exact missed cleavage levels up to max_mc of a protease"""
+    cache_entries = dict()
+    for mc in range(int(max_mc) + 1):
+        cache_params = digest_cache_params(fasta_hash, protease, mc, min_mass, max_mass, min_len, max_len,
+                                           clip_n_term_met, il_equivalence, indexing_key_len, digestion_engine,
+                                           peptide_mapping)
+        cache_entries[mc] = (digest_cache_file(cache_dir, cache_params), cache_params)
+    return cache_entries
+
+
+def is_cached(cache_file) -> bool:
+    return path.isfile(cache_file)
+
+
+def store_mapped_digest(cache_file, mapped_lines, cache_params):
+    """
+    write mapped digest lines (including header) to the cache,
+        the entry is written to a temporary file first to never leave incomplete entries behind
+    """
+    makedirs(path.dirname(cache_file), exist_ok=True)
+    tmp_file = f"{cache_file}.tmp"
+    with open(tmp_file, 'w') as f:
+        for entry in mapped_lines:
+            f.write(entry)
+    with open(f"{cache_file}.json", 'w') as f:
+        json.dump(cache_params, f, indent=1, sort_keys=True)
+    replace(tmp_file, cache_file)
+
+
+def iter_cached_mappings(cache_file, chunk_size=200000):
+    """yield (peptide, protein, location) from a cached mapped digest in chunks of chunk_size rows"""
+    for df in read_csv(cache_file, delimiter='\t', usecols=["peptide", "protein", "location"], chunksize=chunk_size):
+        yield from zip(df['peptide'], df['protein'], df['location'])
+
+
+def cache_mapped_rows(mapped_rows, cache_file, cache_params):
+    """
+    pass (peptide, protein, location) tuples through and store them as mapped digest,
+        the cache entry is only created if all rows were consumed
+    """
+    makedirs(path.dirname(cache_file), exist_ok=True)
+    tmp_file = f"{cache_file}.tmp"
+    try:
+        with open(tmp_file, 'w') as f:
+            f.write(mapped_digest_header)
+            for pept, protein, location in mapped_rows:
+                f.write(f'{pept}\t{protein}\t{location}\t\t\t\n')
+                yield pept, protein, location
+    except BaseException:
+        if path.isfile(tmp_file):
+            remove(tmp_file)
+        raise
+    with open(f"{cache_file}.json", 'w') as f:
+        json.dump(cache_params, f, indent=1, sort_keys=True)
+    replace(tmp_file, cache_file)
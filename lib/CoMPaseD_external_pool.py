@@ -0,0 +1,140 @@
+import heapq
+import tempfile
+from os import path
+from pandas import DataFrame
+from shutil import rmtree
+
+
+# columns of the pooled peptide tables, the filtered table of external pooling also holds protein_count
+pooled_cols = ['peptide', 'protein', 'location', 'MC', 'Enzyme']
+
+# maximal number of rows sorted in memory before they are written to a temporary run file
+external_run_size = 2000000
+
+
+def write_sorted_run(rows, key, run_dir) -> str:
+    """sort rows (tuples of str and int) by key and write them as tab-separated lines to a new run file"""
+    rows.sort(key=key)
+    with tempfile.NamedTemporaryFile('w', dir=run_dir, suffix='.run', delete=False) as handle:
+        for row in rows:
+            handle.write('\t'.join(map(str, row)) + '\n')
+    return handle.name
+
+
+def iter_run(run_file, int_fields):
+    """rows of a run file, fields at the positions in int_fields are converted back to int"""
+    with open(run_file, 'r') as handle:
+        for line in handle:
+            row = line.rstrip('\n').split('\t')
+            for field in int_fields:
+                row[field] = int(row[field])
+            yield tuple(row)
+
+
+def external_sort(rows, key, run_dir, int_fields, run_size=external_run_size):
+    """
+    yield rows sorted by key with at most run_size rows in memory
+
+        Rows are sorted in runs of run_size rows that are spilled to temporary files in run_dir and combined by a
+        k-way merge. Ties keep the input order as runs are merged in the order they were written.
+    """
+    run_files = list()
+    buffer = list()
+    for row in rows:
+        buffer.append(row)
+        if len(buffer) >= run_size:
+            run_files.append(write_sorted_run(buffer, key, run_dir))
+            buffer = list()
+    if not run_files:
+        # all rows fit into one run, no need to write it
+        buffer.sort(key=key)
+        yield from buffer
+        return
+    if buffer:
+        run_files.append(write_sorted_run(buffer, key, run_dir))
+    del buffer
+    yield from heapq.merge(*(iter_run(run_file, int_fields) for run_file in run_files), key=key)
+
+
+def iter_first_matches(sorted_rows):
+    """
+    rows of (seq, peptide, protein, location, MC, Enzyme) sorted by Enzyme, peptide, protein and seq,
+        only the first row (lowest seq) of each peptide-protein match per protease is kept and extended by
+        protein_count, the number of proteins a peptide is kept for with the same MC and protease
+    """
+    group_key = None
+    group_rows = list()
+    last_match = None
+
+    def finish_group():
+        protein_counts = dict()
+        for row in group_rows:
+            protein_counts[row[4]] = protein_counts.get(row[4], 0) + 1
+        for row in group_rows:
+            yield row + (protein_counts[row[4]],)
+
+    for row in sorted_rows:
+        seq, pept, protein, location, mc, protease = row
+        if not (protease, pept) == group_key:
+            yield from finish_group()
+            group_key = (protease, pept)
+            group_rows = list()
+            last_match = None
+        # repeated matches within the same protein
+        if protein == last_match:
+            continue
+        last_match = protein
+        group_rows.append(row)
+    yield from finish_group()
+
+
+def external_pool_mapped_digests(mapped_digest_iter, unfiltered_file, filtered_file, tmp_dir, chunk_size=200000,
+                                 run_size=external_run_size):
+    """
+    disk-backed alternative to CoMPaseD_PeptideMapper.stream_mapped_digests for pooled tables larger than memory
+
+        mapped_digest_iter yields (protease, mc, mapped_rows) in the order of pooling, rows are appended to
+        unfiltered_file in chunks. The filtered table is created by two external sorts with at most run_size rows
+        in memory: sorting by protease, peptide, protein and pooling position keeps the first match of each
+        peptide within a protein per protease (same rows as stream_mapped_digests) and counts the proteins per
+        peptide, MC and protease (protein_count, as calculated by CoMPaseD_analysis_script), sorting by decreasing
+        MC and pooling position gives the row order of stream_mapped_digests. Temporary run files are written to
+        tmp_dir.
+    """
+    DataFrame(columns=pooled_cols).to_csv(unfiltered_file, index=False, sep="\t")
+    DataFrame(columns=pooled_cols + ['protein_count']).to_csv(filtered_file, index=False, sep="\t")
+
+    def write_chunk(rows, out_file, columns):
+        DataFrame(rows, columns=columns).to_csv(out_file, index=False, header=False, sep="\t", mode='a')
+
+    def iter_numbered_rows():
+        # rows are numbered by their position in the unfiltered table and appended to it on the way
+        seq = 0
+        unfiltered_rows = list()
+        for protease, mc, mapped_rows in mapped_digest_iter:
+            mc = str(mc)
+            for pept, protein, location in mapped_rows:
+                unfiltered_rows.append((pept, protein, location, mc, protease))
+                yield seq, pept, protein, int(location), mc, protease
+                seq += 1
+                if len(unfiltered_rows) >= chunk_size:
+                    write_chunk(unfiltered_rows, unfiltered_file, pooled_cols)
+                    unfiltered_rows = list()
+        write_chunk(unfiltered_rows, unfiltered_file, pooled_cols)
+
+    run_dir = tempfile.mkdtemp(prefix='pooling_', dir=tmp_dir if path.isdir(tmp_dir) else None)
+    try:
+        match_rows = external_sort(iter_numbered_rows(), key=lambda row: (row[5], row[1], row[2], row[0]),
+                                   run_dir=run_dir, int_fields=(0, 3), run_size=run_size)
+        first_matches = iter_first_matches(match_rows)
+        filtered_rows = list()
+        for row in external_sort(first_matches, key=lambda row: (-int(row[4]), row[0]), run_dir=run_dir,
+                                 int_fields=(0, 3, 6), run_size=run_size):
+            filtered_rows.append(row[1:])
+            if len(filtered_rows) >= chunk_size:
+                write_chunk(filtered_rows, filtered_file, pooled_cols + ['protein_count'])
+                filtered_rows = list()
+        write_chunk(filtered_rows, filtered_file, pooled_cols + ['protein_count'])
+    finally:
+        rmtree(run_dir, ignore_errors=True)
+    return 0
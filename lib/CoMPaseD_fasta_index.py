@@ -0,0 +1,1169 @@
+import json
+import mmap
+import struct
+from bisect import bisect_right
+import numpy as np
+from datetime import datetime
+from multiprocessing import Pool
+from os import path, remove, replace, stat
+
+try:
+    from lib.CoMPaseD_digest import iter_fasta_sequences, load_fasta_sequences
+except ModuleNotFoundError:
+    from CoMPaseD_digest import iter_fasta_sequences, load_fasta_sequences
+
+try:
+    from lib.CoMPaseD_digest_cache import fasta_checksum
+except ModuleNotFoundError:
+    from CoMPaseD_digest_cache import fasta_checksum
+
+
+# binary index file format, increase index_version if the layout changes
+index_magic = b'CoMPaseDidx\0'
+index_version = 1
+index_alignment = 64
+
+# code for residues that are not part of the indexed alphabet and for the separator between proteins
+invalid_code = 255
+
+# k-mers with more postings get a second index level keyed by the following k-mer
+heavy_posting_threshold = 256
+
+# number of most frequent k-mers listed in the index header
+largest_postings_count = 10
+
+# minimal number of residues per shard for parallel index construction
+min_shard_residues = 1 << 20
+
+# number of peptides streamed through all shards of a ShardedIndex at a time
+shard_batch_size = 1000000
+
+# mapping statistics collected by all index types, reported at the end of a run
+counter_names = ('lookups', 'candidates', 'verification_misses', 'secondary_lookups')
+
+
+def resolve_alphabet(aaAlphabet='extended', ILEquivalence=True) -> str:
+    """
+    translate the key-words 20-aa, 22-aa and extended to the indexed amino acids,
+        I is not indexed if ILEquivalence is set as it is replaced by L
+    """
+    if aaAlphabet == '20-aa':
+        aaAlphabet = 'ACDEFGHIKLMNPQRSTVWY'
+    elif aaAlphabet == '22-aa':
+        aaAlphabet = 'ACDEFGHIKLMNPQRSTVWYOU'
+    elif aaAlphabet == 'extended':
+        aaAlphabet = 'ACDEFGHIKLMNPQRSTVWYBXZJUO'
+    if ILEquivalence:
+        aaAlphabet = aaAlphabet.replace('I', '')
+    return aaAlphabet
+
+
+def is_single_key_len(key_len_spec) -> bool:
+    """True if key_len_spec is one index key length, False for several lengths ('4,7') or 'auto'"""
+    return str(key_len_spec).strip().isdigit()
+
+
+def resolve_key_lengths(key_len_spec, residue_count=0, min_pep_len=6, alphabet_len=25) -> list:
+    """
+    sorted index key lengths for a key length specification, i.e. one length ('5'), several lengths ('4,7')
+        or 'auto' to choose them from the number of residues in the proteome and the minimal peptide length:
+        the base length gives about one posting per k-mer for 20 amino acids, peptides of minimal length are
+        mapped with a key of their length and a key three residues longer is used for long peptides
+    """
+    key_len_spec = str(key_len_spec).strip().lower()
+    if key_len_spec == 'auto':
+        base_len = max(4, int(np.ceil(np.log(max(residue_count, 2)) / np.log(20))))
+        key_lens = {min(int(min_pep_len), base_len), base_len, base_len + 3}
+    else:
+        key_lens = {int(key_len) for key_len in key_len_spec.split(',') if key_len.strip()}
+    # k-mer codes are int64 numbers in base alphabet_len
+    key_lens = sorted(key_len for key_len in key_lens if (key_len >= 1) and (alphabet_len ** key_len < 2 ** 63))
+    if len(key_lens) == 0:
+        raise ValueError(f"No valid index key length in '{key_len_spec}'.")
+    return key_lens
+
+
+def kmer_window_codes(sequence, split_len, alphabet) -> np.ndarray:
+    """
+    integer code of the k-mer starting at each position of the concatenated sequences,
+        -1 for k-mers with non-indexed residues or separators, i.e. k-mers spanning two proteins
+    """
+    # translate residues to their codes, the separator and non-indexed residues become invalid_code
+    translation = np.full(256, invalid_code, dtype=np.uint8)
+    for code, aa in enumerate(alphabet):
+        translation[ord(aa)] = code
+    residue_codes = translation[np.frombuffer(sequence, dtype=np.uint8)]
+
+    # rolling codes over all positions at once, one pass per k-mer position
+    n_kmers = max(len(residue_codes) - split_len + 1, 0)
+    kmer_codes = np.zeros(n_kmers, dtype=np.int64)
+    invalid_count = np.zeros(n_kmers, dtype=np.int32)
+    for offset in range(split_len):
+        window = residue_codes[offset:offset + n_kmers]
+        kmer_codes = kmer_codes * len(alphabet) + np.where(window == invalid_code, 0, window)
+        invalid_count += (window == invalid_code)
+    return np.where(invalid_count == 0, kmer_codes, -1)
+
+
+def _sorted_shard_kmers(args):
+    """window codes of one shard and its valid k-mers sorted by code, positions relative to the shard start"""
+    shard_sequence, split_len, alphabet = args
+    window_codes = kmer_window_codes(shard_sequence, split_len, alphabet)
+    shard_starts = np.flatnonzero(window_codes >= 0)
+    shard_codes = window_codes[shard_starts]
+    # stable sort keeps postings of each k-mer in position order
+    order = np.argsort(shard_codes, kind='stable')
+    return window_codes, shard_codes[order], shard_starts[order]
+
+
+def protein_shards(seq_starts, workers=1) -> list:
+    """
+    (start, end) ranges in the concatenated sequences of at most workers shards with similar residue numbers
+        and at least min_shard_residues residues, shards only contain complete proteins
+    """
+    seq_starts = np.asarray(seq_starts)
+    total = int(seq_starts[-1])
+    shard_count = max(min(int(workers), total // max(min_shard_residues, 1)), 1)
+    targets = np.arange(1, shard_count) * (total / shard_count)
+    bounds = np.unique(np.concatenate(([0], seq_starts[np.searchsorted(seq_starts, targets)], [total])))
+    return [(int(start), int(end)) for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def concatenate_proteins(protein_list, il_equivalence=True):
+    """
+    protein identifiers, all sequences as one byte string with a line break after each protein and the start
+        position of each protein in it (with one additional entry for the end)
+    """
+    protein_ids = [protein_id for protein_id, _ in protein_list]
+    sequences = [sequence.replace('I', 'L') if il_equivalence else sequence for _, sequence in protein_list]
+    seq_starts = np.zeros(len(sequences) + 1, dtype=np.int64)
+    np.cumsum([len(sequence) + 1 for sequence in sequences], out=seq_starts[1:])
+    sequence = ('\n'.join(sequences) + '\n').encode('ascii', errors='replace')
+    return protein_ids, sequence, seq_starts
+
+
+class ProteinSequences:
+    """
+    protein identifiers and sequences shared by all fasta index types
+
+        Protein sequences are kept as one byte string (or memory-mapped buffer) with proteins separated by a
+        line break, seq_starts holds the start of each protein in it.
+    """
+
+    index_type = ''
+
+    def __init__(self, il_equivalence, protein_ids, sequence, seq_starts):
+        self.il_equivalence = bool(il_equivalence)
+        self.protein_ids = protein_ids
+        self.sequence = sequence
+        self.seq_starts = seq_starts
+        self.header = dict()
+        # file the index was saved to or memory-mapped from, allows other processes to map the same file
+        self.index_file = ''
+        self.counters = dict.fromkeys(counter_names, 0)
+        self._sequence_str = None
+        self._seq_starts_list = np.asarray(seq_starts).tolist()
+
+    def __len__(self):
+        return len(self.protein_ids)
+
+    def protein_sequence(self, protein_number) -> str:
+        start = self._seq_starts_list[protein_number]
+        end = self._seq_starts_list[protein_number + 1] - 1
+        return bytes(self.sequence[start:end]).decode('ascii')
+
+    def sequence_string(self) -> str:
+        """all protein sequences separated by line breaks as one str, created once on first use"""
+        if self._sequence_str is None:
+            self._sequence_str = bytes(self.sequence).decode('ascii')
+        return self._sequence_str
+
+    def locate(self, global_position):
+        """(protein number, 1-based position) for a position in the concatenated protein sequences"""
+        protein_number = bisect_right(self._seq_starts_list, global_position) - 1
+        return protein_number, global_position - self._seq_starts_list[protein_number] + 1
+
+    def _header(self, fasta, fasta_hash) -> dict:
+        return {'index_type': self.index_type,
+                'fasta': fasta,
+                'fasta_sha256': fasta_hash,
+                'fasta_mtime': stat(fasta).st_mtime if path.isfile(fasta) else 0.0,
+                'fasta_size': stat(fasta).st_size if path.isfile(fasta) else 0,
+                'creation_date': datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
+                'il_equivalence': self.il_equivalence,
+                'protein_count': len(self.protein_ids)}
+
+    def _sections(self) -> dict:
+        return {'protein_ids': np.frombuffer('\n'.join(self.protein_ids).encode('utf-8'), dtype=np.uint8),
+                'sequence': np.frombuffer(self.sequence, dtype=np.uint8),
+                'seq_starts': np.asarray(self.seq_starts, dtype=np.int64)}
+
+    def _write(self, index_file, header, sections):
+        """the file is written to a temporary file first to never leave incomplete indices behind"""
+        tmp_file = f"{index_file}.tmp"
+        write_index_file(tmp_file, header, sections)
+        replace(tmp_file, index_file)
+        self.header = header
+        self.index_file = index_file
+
+    @staticmethod
+    def _protein_ids(sections) -> list:
+        protein_ids = bytes(sections['protein_ids']).decode('utf-8')
+        return protein_ids.split('\n') if protein_ids else list()
+
+
+class FastaIndex(ProteinSequences):
+    """
+    k-mer index of all protein sequences in a fasta file
+
+        Only k-mers that occur in the proteome are stored. K-mers are encoded as integers in base len(alphabet),
+        kmer_codes holds the sorted unique codes and kmer_offsets[i]:kmer_offsets[i + 1] is the range of their
+        postings in posting_proteins (0-based protein number) and posting_positions (0-based start position).
+        Postings of a k-mer are sorted by protein and position, i.e. in fasta file order.
+
+        K-mers with more than heavy_threshold postings (e.g. poly-Q or His tags) have a second level that groups
+        their postings by the k-mer following the posting: heavy_kmers holds their positions in kmer_codes,
+        heavy_bucket_offsets[h]:heavy_bucket_offsets[h + 1] their range of buckets in bucket_codes (code of the
+        following k-mer, -1 if incomplete) and bucket_offsets[b]:bucket_offsets[b + 1] the range of posting
+        numbers of a bucket in secondary_postings.
+    """
+
+    index_type = 'kmer'
+    # approximate peak memory of index construction
+    build_bytes_per_residue = 80
+
+    def __init__(self, split_len, alphabet, il_equivalence, protein_ids, sequence, seq_starts,
+                 kmer_codes, kmer_offsets, posting_proteins, posting_positions, heavy_threshold=0,
+                 heavy_kmers=None, heavy_bucket_offsets=None, bucket_codes=None, bucket_offsets=None,
+                 secondary_postings=None):
+        super().__init__(il_equivalence, protein_ids, sequence, seq_starts)
+        self.split_len = int(split_len)
+        self.alphabet = alphabet
+        self.kmer_codes = kmer_codes
+        self.kmer_offsets = kmer_offsets
+        self.posting_proteins = posting_proteins
+        self.posting_positions = posting_positions
+        self.heavy_threshold = int(heavy_threshold)
+        empty = np.zeros(0, dtype=np.int64)
+        self.heavy_kmers = empty if heavy_kmers is None else heavy_kmers
+        self.heavy_bucket_offsets = np.zeros(1, dtype=np.int64) if heavy_bucket_offsets is None else heavy_bucket_offsets
+        self.bucket_codes = empty if bucket_codes is None else bucket_codes
+        self.bucket_offsets = np.zeros(1, dtype=np.int64) if bucket_offsets is None else bucket_offsets
+        self.secondary_postings = empty if secondary_postings is None else secondary_postings
+        self._code_dict = {aa: code for code, aa in enumerate(alphabet)}
+
+    @classmethod
+    def build(cls, protein_list, split_len=5, alphabet='extended', il_equivalence=True,
+              heavy_threshold=heavy_posting_threshold, workers=1):
+        """
+        index a list of (identifier, sequence) tuples as returned by load_fasta_sequences,
+            a heavy_threshold of 0 disables the second index level
+        """
+        protein_ids, sequence, seq_starts = concatenate_proteins(protein_list, il_equivalence)
+        return cls.from_sequences(protein_ids, sequence, seq_starts, split_len, alphabet, il_equivalence,
+                                  heavy_threshold, workers)
+
+    @classmethod
+    def from_sequences(cls, protein_ids, sequence, seq_starts, split_len=5, alphabet='extended',
+                       il_equivalence=True, heavy_threshold=heavy_posting_threshold, workers=1):
+        """
+        index sequences already concatenated by concatenate_proteins
+
+            With workers > 1, large proteomes are split into shards of complete proteins. Worker processes
+            compute and sort the k-mers of one shard each, the sorted shards are merged afterwards.
+        """
+        alphabet = resolve_alphabet(alphabet, il_equivalence)
+        if len(alphabet) ** split_len >= 2 ** 63:
+            raise ValueError(f"Index len {split_len} is too large for {len(alphabet)} indexed amino acids.")
+
+        shards = protein_shards(seq_starts, workers)
+        if len(shards) > 1:
+            with Pool(processes=len(shards)) as pool:
+                shard_kmers = pool.map(_sorted_shard_kmers, [(bytes(sequence[start:end]), split_len, alphabet)
+                                                             for start, end in shards])
+        else:
+            shard_kmers = [_sorted_shard_kmers((sequence, split_len, alphabet))]
+
+        # k-mers at the end of a shard contain the separator of its last protein and stay invalid
+        n_kmers = max(len(sequence) - split_len + 1, 0)
+        window_codes = np.full(n_kmers, -1, dtype=np.int64)
+        for (start, _), (shard_window_codes, _, _) in zip(shards, shard_kmers):
+            window_codes[start:start + len(shard_window_codes)] = shard_window_codes
+        kmer_codes = np.concatenate([shard_codes for _, shard_codes, _ in shard_kmers])
+        global_starts = np.concatenate([shard_starts + start for (start, _), (_, _, shard_starts)
+                                        in zip(shards, shard_kmers)])
+        del shard_kmers
+        if len(shards) > 1:
+            # k-way merge of the sorted shards: the stable sort (timsort for int64) merges presorted runs and keeps
+            # postings of each k-mer in shard, i.e. protein and position, order
+            order = np.argsort(kmer_codes, kind='stable')
+            kmer_codes = kmer_codes[order]
+            global_starts = global_starts[order]
+        unique_codes, first_idx = np.unique(kmer_codes, return_index=True)
+        kmer_offsets = np.append(first_idx, len(kmer_codes)).astype(np.int64)
+
+        posting_proteins = (np.searchsorted(seq_starts, global_starts, side='right') - 1).astype(np.int32)
+        posting_positions = (global_starts - seq_starts[posting_proteins]).astype(np.int32)
+
+        # second level for k-mers with long posting lists
+        posting_counts = np.diff(kmer_offsets)
+        if heavy_threshold > 0:
+            heavy_kmers = np.flatnonzero(posting_counts > heavy_threshold).astype(np.int64)
+        else:
+            heavy_kmers = np.zeros(0, dtype=np.int64)
+        heavy_counts = posting_counts[heavy_kmers]
+        heavy_group = np.repeat(np.arange(len(heavy_kmers)), heavy_counts)
+        group_firsts = np.repeat(np.cumsum(heavy_counts) - heavy_counts, heavy_counts)
+        heavy_postings = np.repeat(kmer_offsets[heavy_kmers], heavy_counts) + np.arange(len(heavy_group)) - group_firsts
+        # code of the k-mer following each posting, -1 if it is incomplete or contains non-indexed residues
+        following_starts = global_starts[heavy_postings] + split_len
+        following_codes = np.full(len(following_starts), -1, dtype=np.int64)
+        inside = following_starts < n_kmers
+        following_codes[inside] = window_codes[following_starts[inside]]
+        del window_codes
+
+        # buckets of equal following k-mer per heavy k-mer, postings of a bucket stay in fasta file order
+        order = np.lexsort((heavy_postings, following_codes, heavy_group))
+        heavy_group = heavy_group[order]
+        following_codes = following_codes[order]
+        secondary_postings = heavy_postings[order]
+        new_bucket = np.ones(len(order), dtype=bool)
+        new_bucket[1:] = (heavy_group[1:] != heavy_group[:-1]) | (following_codes[1:] != following_codes[:-1])
+        bucket_firsts = np.flatnonzero(new_bucket)
+        bucket_codes = following_codes[bucket_firsts]
+        bucket_offsets = np.append(bucket_firsts, len(order)).astype(np.int64)
+        heavy_bucket_offsets = np.searchsorted(heavy_group[bucket_firsts], np.arange(len(heavy_kmers) + 1)).astype(np.int64)
+
+        return cls(split_len, alphabet, il_equivalence, protein_ids, sequence, seq_starts,
+                   unique_codes, kmer_offsets, posting_proteins, posting_positions, heavy_threshold,
+                   heavy_kmers, heavy_bucket_offsets, bucket_codes, bucket_offsets, secondary_postings)
+
+    @classmethod
+    def from_fasta(cls, fasta, split_len=5, alphabet='extended', il_equivalence=True,
+                   heavy_threshold=heavy_posting_threshold, workers=1):
+        return cls.build(load_fasta_sequences(fasta), split_len, alphabet, il_equivalence, heavy_threshold,
+                         workers)
+
+    def kmer_code(self, kmer) -> int:
+        """integer code of a k-mer, -1 if it contains non-indexed residues"""
+        code = 0
+        for aa in kmer:
+            aa_code = self._code_dict.get(aa)
+            if aa_code is None:
+                return -1
+            code = code * len(self.alphabet) + aa_code
+        return code
+
+    def kmer_string(self, code) -> str:
+        """k-mer of an integer code"""
+        kmer = list()
+        for _ in range(self.split_len):
+            code, aa_code = divmod(int(code), len(self.alphabet))
+            kmer.append(self.alphabet[aa_code])
+        return ''.join(reversed(kmer))
+
+    def posting_statistics(self) -> dict:
+        """posting list lengths of all k-mers and the most frequent k-mers"""
+        posting_counts = np.diff(self.kmer_offsets)
+        if len(posting_counts) == 0:
+            return {'mean': 0.0, 'p99': 0.0, 'max': 0, 'largest': list()}
+        largest = np.argsort(posting_counts, kind='stable')[::-1][0:largest_postings_count]
+        return {'mean': float(posting_counts.mean()),
+                'p99': float(np.percentile(posting_counts, 99)),
+                'max': int(posting_counts.max()),
+                'largest': [[self.kmer_string(self.kmer_codes[idx]), int(posting_counts[idx])] for idx in largest]}
+
+    def _secondary_candidates(self, pept, heavy_number):
+        """sorted posting numbers of a heavy k-mer that can match pept according to the following k-mer"""
+        split_len = self.split_len
+        bucket_start = self.heavy_bucket_offsets[heavy_number]
+        bucket_end = self.heavy_bucket_offsets[heavy_number + 1]
+        bucket_codes = self.bucket_codes[bucket_start:bucket_end]
+        # postings without complete following k-mer are always candidates
+        unknown_end = bucket_start + 1 if bucket_codes[0] < 0 else bucket_start
+
+        # a following part shorter than split_len matches a range of following k-mer codes
+        following = pept[split_len:2 * split_len]
+        code = self.kmer_code(following)
+        first_bucket = last_bucket = bucket_start
+        if code >= 0:
+            scale = len(self.alphabet) ** (split_len - len(following))
+            first_bucket = bucket_start + np.searchsorted(bucket_codes, code * scale)
+            last_bucket = bucket_start + np.searchsorted(bucket_codes, (code + 1) * scale)
+
+        offsets = self.bucket_offsets
+        return np.sort(np.concatenate((self.secondary_postings[offsets[bucket_start]:offsets[unknown_end]],
+                                       self.secondary_postings[offsets[first_bucket]:offsets[last_bucket]])))
+
+    def postings(self, kmer):
+        """(protein numbers, 0-based positions) of all occurrences of a k-mer"""
+        code = self.kmer_code(kmer)
+        idx = np.searchsorted(self.kmer_codes, code)
+        if (code < 0) or (idx == len(self.kmer_codes)) or (self.kmer_codes[idx] != code):
+            return self.posting_proteins[0:0], self.posting_positions[0:0]
+        start, end = self.kmer_offsets[idx], self.kmer_offsets[idx + 1]
+        return self.posting_proteins[start:end], self.posting_positions[start:end]
+
+    def iter_mappings(self, peptide_list):
+        """
+        yield (peptide, protein number, 1-based position) for every occurrence of each peptide,
+            peptides are returned with I replaced by L if il_equivalence is set
+        """
+        split_len = self.split_len
+        peptides = list()
+        codes = list()
+        for pept in peptide_list:
+            if len(pept) < split_len:
+                print(f"\t \t \t WARNING: Peptide '{pept}' is shorter than index len and will be removed. Please check digestion settings.", flush=True)
+                continue
+            # handle ILEquivalence on-the fly
+            if self.il_equivalence:
+                pept = pept.replace('I', 'L')
+            peptides.append(pept)
+            codes.append(self.kmer_code(pept[0:split_len]))
+        if (len(peptides) == 0) or (len(self.kmer_codes) == 0):
+            return
+
+        # look up all peptide prefixes at once
+        codes = np.array(codes, dtype=np.int64)
+        idx = np.minimum(np.searchsorted(self.kmer_codes, codes), len(self.kmer_codes) - 1)
+        found = (self.kmer_codes[idx] == codes) & (codes >= 0)
+        starts = np.where(found, self.kmer_offsets[idx], 0).tolist()
+        ends = np.where(found, self.kmer_offsets[idx + 1], 0).tolist()
+        # position of the k-mer in heavy_kmers, -1 for k-mers without second level
+        heavy_numbers = [-1] * len(peptides)
+        if len(self.heavy_kmers) > 0:
+            heavy_pos = np.minimum(np.searchsorted(self.heavy_kmers, idx), len(self.heavy_kmers) - 1)
+            heavy_numbers = np.where(found & (self.heavy_kmers[heavy_pos] == idx), heavy_pos, -1).tolist()
+
+        sequence = self.sequence
+        seq_starts = self._seq_starts_list
+        lookups = candidates = misses = secondary_lookups = 0
+        try:
+            for pept, start, end, heavy_number in zip(peptides, starts, ends, heavy_numbers):
+                lookups += 1
+                if start == end:
+                    continue
+                if (heavy_number >= 0) and (len(pept) > split_len):
+                    secondary_lookups += 1
+                    posting_numbers = self._secondary_candidates(pept, heavy_number)
+                    proteins = self.posting_proteins[posting_numbers].tolist()
+                    positions = self.posting_positions[posting_numbers].tolist()
+                else:
+                    proteins = self.posting_proteins[start:end].tolist()
+                    positions = self.posting_positions[start:end].tolist()
+                candidates += len(proteins)
+                pept_bytes = pept.encode('ascii', errors='replace')
+                pept_len = len(pept_bytes)
+                for protein_number, position in zip(proteins, positions):
+                    global_start = seq_starts[protein_number] + position
+                    if sequence[global_start:global_start + pept_len] == pept_bytes:
+                        yield pept, protein_number, position + 1
+                    else:
+                        misses += 1
+        finally:
+            self.counters['lookups'] += lookups
+            self.counters['candidates'] += candidates
+            self.counters['verification_misses'] += misses
+            self.counters['secondary_lookups'] += secondary_lookups
+
+    def _kmer_header(self) -> dict:
+        return {'split_len': self.split_len,
+                'alphabet': self.alphabet,
+                'kmer_count': len(self.kmer_codes),
+                'heavy_threshold': self.heavy_threshold,
+                'heavy_kmer_count': len(self.heavy_kmers),
+                'posting_statistics': self.posting_statistics()}
+
+    def _kmer_sections(self) -> dict:
+        return {'kmer_codes': np.asarray(self.kmer_codes, dtype=np.int64),
+                'kmer_offsets': np.asarray(self.kmer_offsets, dtype=np.int64),
+                'posting_proteins': np.asarray(self.posting_proteins, dtype=np.int32),
+                'posting_positions': np.asarray(self.posting_positions, dtype=np.int32),
+                'heavy_kmers': np.asarray(self.heavy_kmers, dtype=np.int64),
+                'heavy_bucket_offsets': np.asarray(self.heavy_bucket_offsets, dtype=np.int64),
+                'bucket_codes': np.asarray(self.bucket_codes, dtype=np.int64),
+                'bucket_offsets': np.asarray(self.bucket_offsets, dtype=np.int64),
+                'secondary_postings': np.asarray(self.secondary_postings, dtype=np.int64)}
+
+    def save(self, index_file, fasta='', fasta_hash=''):
+        """write the index to a binary file that can be memory-mapped, see write_index_file for the format"""
+        header = dict(self._header(fasta, fasta_hash), **self._kmer_header())
+        sections = dict(self._sections(), **self._kmer_sections())
+        self._write(index_file, header, sections)
+
+    @classmethod
+    def _from_sections(cls, kmer_header, sections, il_equivalence, protein_ids, sequence, seq_starts, prefix=''):
+        """k-mer index from the header entries and memory-mapped sections of one key length"""
+        return cls(kmer_header['split_len'],
+                   kmer_header['alphabet'],
+                   il_equivalence,
+                   protein_ids,
+                   sequence,
+                   seq_starts,
+                   sections[f'{prefix}kmer_codes'],
+                   sections[f'{prefix}kmer_offsets'],
+                   sections[f'{prefix}posting_proteins'],
+                   sections[f'{prefix}posting_positions'],
+                   kmer_header.get('heavy_threshold', 0),
+                   sections.get(f'{prefix}heavy_kmers'),
+                   sections.get(f'{prefix}heavy_bucket_offsets'),
+                   sections.get(f'{prefix}bucket_codes'),
+                   sections.get(f'{prefix}bucket_offsets'),
+                   sections.get(f'{prefix}secondary_postings'))
+
+    @classmethod
+    def load(cls, index_file):
+        """memory-map an index file, arrays are read from the page cache on access and shared between processes"""
+        header, sections = map_index_file(index_file)
+        fasta_idx = cls._from_sections(header, sections, header['il_equivalence'], cls._protein_ids(sections),
+                                       sections['sequence'].data, sections['seq_starts'])
+        fasta_idx.header = header
+        fasta_idx.index_file = index_file
+        return fasta_idx
+
+
+class MultiKeyIndex(ProteinSequences):
+    """
+    k-mer indices with several key lengths over the same protein sequences
+
+        Each peptide is looked up with the longest key that is not longer than the peptide, i.e. long peptides
+        check far fewer candidates while short peptides are still mapped. Peptides shorter than all keys are
+        searched in the concatenated protein sequences directly. levels holds one FastaIndex per key length,
+        all levels share protein identifiers, sequences and mapping counters.
+    """
+
+    index_type = 'multi-kmer'
+
+    def __init__(self, key_len_spec, il_equivalence, protein_ids, sequence, seq_starts, levels, min_pep_len=0):
+        super().__init__(il_equivalence, protein_ids, sequence, seq_starts)
+        self.key_len_spec = str(key_len_spec)
+        self.min_pep_len = int(min_pep_len)
+        self.levels = levels
+        self.split_lens = sorted(levels.keys())
+        # attributes of the single key length index used for logging
+        self.split_len = self.split_lens[0]
+        self.alphabet = levels[self.split_len].alphabet
+        for level in levels.values():
+            level.counters = self.counters
+
+    @classmethod
+    def build(cls, protein_list, key_len_spec='auto', alphabet='extended', il_equivalence=True, min_pep_len=6,
+              heavy_threshold=heavy_posting_threshold, workers=1):
+        """index a list of (identifier, sequence) tuples with all key lengths of key_len_spec"""
+        protein_ids, sequence, seq_starts = concatenate_proteins(protein_list, il_equivalence)
+        residue_count = len(sequence) - len(protein_ids)
+        key_lens = resolve_key_lengths(key_len_spec, residue_count, min_pep_len,
+                                       len(resolve_alphabet(alphabet, il_equivalence)))
+        levels = {key_len: FastaIndex.from_sequences(protein_ids, sequence, seq_starts, key_len, alphabet,
+                                                     il_equivalence, heavy_threshold, workers) for key_len in key_lens}
+        return cls(key_len_spec, il_equivalence, protein_ids, sequence, seq_starts, levels, min_pep_len)
+
+    @classmethod
+    def from_fasta(cls, fasta, key_len_spec='auto', alphabet='extended', il_equivalence=True, min_pep_len=6,
+                   heavy_threshold=heavy_posting_threshold, workers=1):
+        return cls.build(load_fasta_sequences(fasta), key_len_spec, alphabet, il_equivalence, min_pep_len,
+                         heavy_threshold, workers)
+
+    def _iter_unindexed_positions(self, pept):
+        """1-based (protein number, position) of a peptide shorter than all keys by scanning all sequences"""
+        seq_str = self.sequence_string()
+        global_start = seq_str.find(pept) if pept else -1
+        while global_start >= 0:
+            yield self.locate(global_start)
+            global_start = seq_str.find(pept, global_start + 1)
+
+    def iter_mappings(self, peptide_list):
+        """
+        yield (peptide, protein number, 1-based position) for every occurrence of each peptide,
+            peptides are returned with I replaced by L if il_equivalence is set
+        """
+        peptides = [pept.replace('I', 'L') if self.il_equivalence else pept for pept in peptide_list]
+        # distinct peptides per key length, the hits of each level are returned grouped by peptide
+        level_peptides = {key_len: dict() for key_len in self.split_lens}
+        short_peptides = dict()
+        for pept in peptides:
+            usable = [key_len for key_len in self.split_lens if key_len <= len(pept)]
+            if usable:
+                level_peptides[usable[-1]][pept] = None
+            else:
+                short_peptides[pept] = None
+
+        hits = dict()
+        for key_len, level_pepts in level_peptides.items():
+            for pept, protein_number, position in self.levels[key_len].iter_mappings(level_pepts):
+                hits.setdefault(pept, list()).append((protein_number, position))
+        for pept in short_peptides:
+            self.counters['lookups'] += 1
+            pept_hits = list(self._iter_unindexed_positions(pept))
+            self.counters['candidates'] += len(pept_hits)
+            if pept_hits:
+                hits[pept] = pept_hits
+
+        for pept in peptides:
+            for protein_number, position in hits.get(pept, ()):
+                yield pept, protein_number, position
+
+    def save(self, index_file, fasta='', fasta_hash=''):
+        """
+        write all key lengths to one binary file, sections of each key length are prefixed with k<length>_
+            and share the protein sections
+        """
+        header = dict(self._header(fasta, fasta_hash),
+                      key_len_spec=self.key_len_spec,
+                      min_pep_len=self.min_pep_len,
+                      split_lens=self.split_lens,
+                      levels={str(key_len): level._kmer_header() for key_len, level in self.levels.items()})
+        sections = self._sections()
+        for key_len, level in self.levels.items():
+            for name, array in level._kmer_sections().items():
+                sections[f'k{key_len}_{name}'] = array
+        self._write(index_file, header, sections)
+
+    @classmethod
+    def load(cls, index_file):
+        """memory-map an index file, arrays are read from the page cache on access and shared between processes"""
+        header, sections = map_index_file(index_file)
+        protein_ids = cls._protein_ids(sections)
+        sequence = sections['sequence'].data
+        seq_starts = sections['seq_starts']
+        levels = {int(key_len): FastaIndex._from_sections(kmer_header, sections, header['il_equivalence'],
+                                                          protein_ids, sequence, seq_starts, prefix=f'k{key_len}_')
+                  for key_len, kmer_header in header['levels'].items()}
+        multi_idx = cls(header['key_len_spec'], header['il_equivalence'], protein_ids, sequence, seq_starts, levels,
+                        header.get('min_pep_len', 0))
+        multi_idx.header = header
+        multi_idx.index_file = index_file
+        return multi_idx
+
+
+class SuffixArrayIndex(ProteinSequences):
+    """
+    suffix array over all protein sequences in a fasta file
+
+        suffix_array holds the start positions of all suffixes in the concatenated sequences (line breaks excluded)
+        sorted by their first depth residues, suffixes with identical first depth residues are sorted by position.
+        Its size only depends on the proteome size, lookup time on the peptide length and log(proteome size).
+        Peptides longer than depth are searched by their first depth residues and verified afterwards.
+    """
+
+    index_type = 'suffix-array'
+    build_bytes_per_residue = 64
+    # attributes of the k-mer index that are not used
+    split_len = 0
+    alphabet = ''
+
+    def __init__(self, il_equivalence, protein_ids, sequence, seq_starts, suffix_array, depth):
+        super().__init__(il_equivalence, protein_ids, sequence, seq_starts)
+        self.suffix_array = suffix_array
+        self.depth = int(depth)
+
+    @classmethod
+    def build(cls, protein_list, il_equivalence=True, depth=64):
+        """
+        sort all suffixes by prefix doubling, ranks after each round represent the first 2^round residues
+
+            The rank of a suffix is the position of its group (suffixes with identical first 2^round residues) in
+            the suffix array. Each round only the suffixes in groups of more than one suffix are sorted by
+            (rank, rank 2^round residues further) with two stable argsorts of int32 keys, groups of one suffix
+            are final. Rounds are bounded by log2(depth), i.e. 6 rounds for the default depth of 64, and each
+            costs O(u log u) for u unresolved suffixes. Memory is the text, rank and suffix array (9 bytes per
+            residue) plus temporary arrays of up to 40 bytes per unresolved suffix, all suffixes in the first round.
+        """
+        protein_ids, sequence, seq_starts = concatenate_proteins(protein_list, il_equivalence)
+        text = np.frombuffer(sequence, dtype=np.uint8)
+        n = len(text)
+        pos_type = np.int32 if n < 2 ** 31 else np.int64
+
+        suffix_array = np.argsort(text, kind='stable').astype(pos_type)
+        sorted_text = text[suffix_array]
+        new_group = np.ones(n, dtype=bool)
+        new_group[1:] = sorted_text[1:] != sorted_text[:-1]
+        del sorted_text
+        # first position in suffix_array of each group, i.e. rank of the suffixes
+        group_start = np.maximum.accumulate(np.where(new_group, np.arange(n, dtype=pos_type), 0))
+        rank = np.empty(n, dtype=pos_type)
+        rank[suffix_array] = group_start
+        unresolved = cls._unresolved(new_group).astype(pos_type)
+        del new_group, group_start
+
+        sorted_len = 1
+        while (sorted_len < depth) and (len(unresolved) > 0):
+            suffixes = suffix_array[unresolved]
+            group = rank[suffixes]
+            # rank of the suffix sorted_len residues further, -1 behind the end of the text
+            second = np.full(len(suffixes), -1, dtype=pos_type)
+            has_second = suffixes < n - sorted_len
+            second[has_second] = rank[suffixes[has_second] + sorted_len]
+            del has_second
+            # radix sort, suffixes of a group are stored contiguously and keep their slots in suffix_array
+            order = np.argsort(second, kind='stable')
+            order = order[np.argsort(group[order], kind='stable')]
+            suffixes = suffixes[order]
+            group = group[order]
+            second = second[order]
+            del order
+            suffix_array[unresolved] = suffixes
+
+            new_group = np.ones(len(suffixes), dtype=bool)
+            new_group[1:] = (group[1:] != group[:-1]) | (second[1:] != second[:-1])
+            del group, second
+            group_start = np.maximum.accumulate(np.where(new_group, unresolved, 0))
+            rank[suffixes] = group_start
+            unresolved = unresolved[cls._unresolved(new_group)]
+            del suffixes, new_group, group_start
+            sorted_len *= 2
+
+        # suffixes starting with the separator are never part of a match
+        suffix_array = suffix_array[text[suffix_array] != ord('\n')]
+        return cls(il_equivalence, protein_ids, sequence, seq_starts, suffix_array, depth)
+
+    @staticmethod
+    def _unresolved(new_group):
+        """indices of all members of groups with more than one member, new_group marks the first member of a group"""
+        group_id = np.cumsum(new_group, dtype=np.int64) - 1
+        group_size = np.bincount(group_id)
+        return np.flatnonzero(group_size[group_id] > 1)
+
+    @classmethod
+    def from_fasta(cls, fasta, il_equivalence=True, depth=64):
+        return cls.build(load_fasta_sequences(fasta), il_equivalence, depth)
+
+    def suffix_range(self, peptide):
+        """range in suffix_array of all suffixes starting with the first depth residues of peptide"""
+        seq_str = self.sequence_string()
+        query = peptide[0:self.depth]
+        query_len = len(query)
+        suffix_array = self.suffix_array
+
+        # lower and upper bound by binary search on the prefixes of the suffixes
+        lo, hi = 0, len(suffix_array)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            suffix_start = int(suffix_array[mid])
+            if seq_str[suffix_start:suffix_start + query_len] < query:
+                lo = mid + 1
+            else:
+                hi = mid
+        start = lo
+        hi = len(suffix_array)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            suffix_start = int(suffix_array[mid])
+            if query < seq_str[suffix_start:suffix_start + query_len]:
+                hi = mid
+            else:
+                lo = mid + 1
+        end = lo
+        return start, end
+
+    def count(self, peptide) -> int:
+        """number of occurrences of a peptide in all proteins"""
+        if len(peptide) <= self.depth:
+            start, end = self.suffix_range(peptide)
+            return end - start
+        return sum(1 for _ in self._iter_positions(peptide))
+
+    def _iter_positions(self, peptide):
+        start, end = self.suffix_range(peptide)
+        positions = np.sort(self.suffix_array[start:end]).tolist()
+        self.counters['lookups'] += 1
+        self.counters['candidates'] += len(positions)
+        if len(peptide) <= self.depth:
+            yield from positions
+            return
+        seq_str = self.sequence_string()
+        for position in positions:
+            if seq_str.startswith(peptide, position):
+                yield position
+            else:
+                self.counters['verification_misses'] += 1
+
+    def iter_mappings(self, peptide_list):
+        """
+        yield (peptide, protein number, 1-based position) for every occurrence of each peptide,
+            peptides are returned with I replaced by L if il_equivalence is set
+        """
+        for pept in peptide_list:
+            # handle ILEquivalence on-the fly
+            if self.il_equivalence:
+                pept = pept.replace('I', 'L')
+            for global_start in self._iter_positions(pept):
+                protein_number, position = self.locate(global_start)
+                yield pept, protein_number, position
+
+    def save(self, index_file, fasta='', fasta_hash=''):
+        """write the index to a binary file that can be memory-mapped, see write_index_file for the format"""
+        header = dict(self._header(fasta, fasta_hash), depth=self.depth)
+        sections = dict(self._sections(), suffix_array=self.suffix_array)
+        self._write(index_file, header, sections)
+
+    @classmethod
+    def load(cls, index_file):
+        """memory-map an index file, arrays are read from the page cache on access and shared between processes"""
+        header, sections = map_index_file(index_file)
+        sa_idx = cls(header['il_equivalence'],
+                     cls._protein_ids(sections),
+                     sections['sequence'].data,
+                     sections['seq_starts'],
+                     sections['suffix_array'],
+                     header['depth'])
+        sa_idx.header = header
+        sa_idx.index_file = index_file
+        return sa_idx
+
+
+def _aligned(position) -> int:
+    return (position + index_alignment - 1) // index_alignment * index_alignment
+
+
+def write_index_file(index_file, header, sections):
+    """
+    binary index format, all numbers little-endian:
+        magic bytes, uint32 format version, uint64 length of the JSON header, JSON header,
+        array sections aligned to index_alignment bytes. The header holds the index type, fasta checksum,
+        index settings (e.g. index len, alphabet, I/L setting) and the position, dtype and length of each section
+        relative to the end of the header.
+    """
+    section_table = dict()
+    position = 0
+    for name, array in sections.items():
+        section_table[name] = {'offset': position, 'dtype': array.dtype.newbyteorder('<').str, 'count': len(array)}
+        position = _aligned(position + array.nbytes)
+    header = dict(header, sections=section_table)
+    header_bytes = json.dumps(header).encode('utf-8')
+    prefix = index_magic + struct.pack('<IQ', index_version, len(header_bytes))
+    data_start = _aligned(len(prefix) + len(header_bytes))
+
+    with open(index_file, 'wb') as handle:
+        handle.write(prefix)
+        handle.write(header_bytes)
+        for name, array in sections.items():
+            handle.write(b'\0' * (data_start + section_table[name]['offset'] - handle.tell()))
+            handle.write(np.ascontiguousarray(array, dtype=section_table[name]['dtype']).tobytes())
+
+
+def read_index_header(index_file) -> dict:
+    """read only the JSON header of an index file, raises ValueError for other files or format versions"""
+    with open(index_file, 'rb') as handle:
+        prefix = handle.read(len(index_magic) + struct.calcsize('<IQ'))
+        if not prefix.startswith(index_magic):
+            raise ValueError(f"{index_file} is not a CoMPaseD fasta index.")
+        version, header_len = struct.unpack('<IQ', prefix[len(index_magic):])
+        if not version == index_version:
+            raise ValueError(f"{index_file} has index format version {version}, expected {index_version}.")
+        header = json.loads(handle.read(header_len).decode('utf-8'))
+    header['data_start'] = _aligned(len(prefix) + header_len)
+    return header
+
+
+def map_index_file(index_file):
+    """return the header and read-only numpy views of all sections of a memory-mapped index file"""
+    header = read_index_header(index_file)
+    with open(index_file, 'rb') as handle:
+        # the map stays valid after closing the file
+        index_map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+    sections = dict()
+    for name, section in header['sections'].items():
+        sections[name] = np.frombuffer(index_map, dtype=np.dtype(section['dtype']), count=section['count'],
+                                       offset=header['data_start'] + section['offset'])
+    return header, sections
+
+
+def check_index(index_file, fasta, split_len=5, alphabet='extended', il_equivalence=True, fasta_hash=None,
+                index_type='kmer', min_pep_len=6, memory_budget=0):
+    """
+    compare the fingerprint of an existing index with the fasta file and index settings,
+        returns (True, '') if the index can be re-used and (False, reason) otherwise.
+        With a memory_budget > 0, index_file is expected to be a ShardedIndex with shards of index_type.
+        The fasta checksum is only calculated if size or modification time of the fasta file changed
+        and fasta_hash is not given.
+    """
+    if not path.isfile(index_file):
+        return False, "no index found"
+    try:
+        header = read_index_header(index_file)
+    except (ValueError, OSError, UnicodeDecodeError, json.JSONDecodeError) as e:
+        return False, f"index could not be read ({e})"
+
+    # indices written before different index types were available are k-mer indices
+    file_index_type = ShardedIndex.index_type if int(memory_budget) > 0 else index_type
+    if not header.get('index_type', 'kmer') == file_index_type:
+        return False, f"index type {header.get('index_type', 'kmer')} differs from {file_index_type}"
+    if not header.get('il_equivalence') == bool(il_equivalence):
+        return False, "different treatment of I and L"
+    if file_index_type == ShardedIndex.index_type:
+        # shard settings are checked below like the settings of an index of shard_type
+        if not header.get('shard_type') == index_type:
+            return False, f"index shard type {header.get('shard_type')} differs from {index_type}"
+        if not header.get('memory_budget') == int(memory_budget):
+            return False, f"index shards were built for a memory budget of {header.get('memory_budget')} MB"
+        for shard_file in ShardedIndex.shard_paths(index_file, header):
+            if not path.isfile(shard_file):
+                return False, f"index shard {shard_file} is missing"
+    if index_type == 'kmer':
+        if 'heavy_threshold' not in header:
+            return False, "index was created without second level for frequent k-mers"
+        if not header.get('split_len') == int(split_len):
+            return False, f"index len {header.get('split_len')} differs from {split_len}"
+        if not header.get('alphabet') == resolve_alphabet(alphabet, il_equivalence):
+            return False, "different indexed amino acids"
+    if index_type == 'multi-kmer':
+        key_len_spec = str(split_len).strip().lower()
+        if not header.get('key_len_spec', '').strip().lower() == key_len_spec:
+            return False, f"index keys {header.get('key_len_spec')} differ from {split_len}"
+        if (key_len_spec == 'auto') and (not header.get('min_pep_len') == int(min_pep_len)):
+            return False, "index keys were chosen for a different minimal peptide length"
+        for kmer_header in header.get('levels', dict()).values():
+            if not kmer_header.get('alphabet') == resolve_alphabet(alphabet, il_equivalence):
+                return False, "different indexed amino acids"
+
+    fasta_stat = stat(fasta)
+    if (fasta_hash is None) and (header.get('fasta_mtime') == fasta_stat.st_mtime) and \
+            (header.get('fasta_size') == fasta_stat.st_size):
+        return True, ''
+    if fasta_hash is None:
+        fasta_hash = fasta_checksum(fasta)
+    if not header.get('fasta_sha256') == fasta_hash:
+        return False, "fasta file content changed"
+    return True, ''
+
+
+def indexed_fasta_checksum(index_file, fasta):
+    """
+    fasta checksum saved in the header of index_file, avoids reading the complete fasta file to calculate it.
+        Returns None if there is no readable index or size or modification time of the fasta file changed.
+    """
+    try:
+        header = read_index_header(index_file)
+        fasta_stat = stat(fasta)
+    except (ValueError, OSError, UnicodeDecodeError, json.JSONDecodeError):
+        return None
+    if (header.get('fasta_mtime') == fasta_stat.st_mtime) and (header.get('fasta_size') == fasta_stat.st_size):
+        return header.get('fasta_sha256') or None
+    return None
+
+
+class ProteinIdSection:
+    """protein identifiers of a memory-mapped, line break separated section, decoded on access"""
+
+    def __init__(self, id_bytes, id_starts):
+        self.id_bytes = id_bytes
+        self.id_starts = id_starts
+
+    def __len__(self):
+        return max(len(self.id_starts) - 1, 0)
+
+    def __getitem__(self, protein_number):
+        start = int(self.id_starts[protein_number])
+        end = int(self.id_starts[protein_number + 1]) - 1
+        return bytes(self.id_bytes[start:end]).decode('utf-8')
+
+
+class ShardedIndex(ProteinSequences):
+    """
+    fasta index split into shards of consecutive proteins for proteomes that do not fit into memory at once
+
+        Each shard is a complete index of shard_type (k-mer, multi-kmer or suffix array) saved to its own file
+        next to the shard manifest and covers proteins shard_starts[i]:shard_starts[i + 1]. Shards are built one
+        after the other while streaming the fasta file, their size is chosen to keep index construction within
+        memory_budget MB. Peptides are mapped in batches that pass all shards in turn, only one shard is
+        memory-mapped at a time. Protein sequences are only kept in the shards, the manifest holds protein
+        identifiers and the settings of the shards.
+    """
+
+    index_type = 'sharded'
+
+    def __init__(self, shard_type, memory_budget, il_equivalence, protein_ids, shard_files, shard_starts,
+                 shard_settings=None):
+        super().__init__(il_equivalence, protein_ids, b'', np.zeros(1, dtype=np.int64))
+        self.shard_type = shard_type
+        self.memory_budget = int(memory_budget)
+        self.shard_files = shard_files
+        self.shard_starts = np.asarray(shard_starts, dtype=np.int64).tolist()
+        self.shard_settings = dict() if shard_settings is None else shard_settings
+        # attributes of the shard index type used for logging
+        self.split_lens = self.shard_settings.get('split_lens', list())
+        self.split_len = self.shard_settings.get('split_len', min(self.split_lens, default=0))
+        self.alphabet = self.shard_settings.get('alphabet', '')
+        self.depth = self.shard_settings.get('depth', 0)
+        self._shard_number = None
+        self._shard = None
+
+    @staticmethod
+    def shard_file_name(index_file, shard_number, shard_type) -> str:
+        return f"{index_file}.{shard_number:04d}{index_extensions[shard_type]}"
+
+    @staticmethod
+    def shard_paths(index_file, header) -> list:
+        """locations of the shard files listed in the header of a shard manifest"""
+        return [path.join(path.dirname(index_file), shard_file) for shard_file in header.get('shard_files', list())]
+
+    @classmethod
+    def from_fasta(cls, fasta, index_file, shard_type='kmer', memory_budget=4096, key_len_spec=5, alphabet='extended',
+                   il_equivalence=True, min_pep_len=6, heavy_threshold=heavy_posting_threshold, workers=1,
+                   fasta_hash=''):
+        """
+        index a fasta file shard by shard, shards are saved next to index_file while the fasta file is read,
+            an existing manifest at index_file is removed first together with all shard files it lists, shards of
+            the previous index would be left behind otherwise if it had more shards or another shard type
+        """
+        if path.isfile(index_file):
+            try:
+                old_shard_files = cls.shard_paths(index_file, read_index_header(index_file))
+            except (ValueError, OSError, UnicodeDecodeError, json.JSONDecodeError):
+                old_shard_files = list()
+            for old_shard_file in old_shard_files:
+                if path.isfile(old_shard_file):
+                    remove(old_shard_file)
+            remove(index_file)
+        if shard_type == 'multi-kmer':
+            # all shards use the key lengths chosen for the complete proteome
+            residue_count = sum(len(sequence) for _, sequence in iter_fasta_sequences(fasta))
+            key_lens = resolve_key_lengths(key_len_spec, residue_count, min_pep_len,
+                                           len(resolve_alphabet(alphabet, il_equivalence)))
+            shard_key_len_spec = ','.join(map(str, key_lens))
+            bytes_per_residue = FastaIndex.build_bytes_per_residue * len(key_lens)
+        else:
+            bytes_per_residue = index_classes[shard_type].build_bytes_per_residue
+        max_shard_residues = max(int(memory_budget) * (1 << 20) // bytes_per_residue, 1)
+
+        def build_shard(protein_list):
+            if shard_type == 'suffix-array':
+                return SuffixArrayIndex.build(protein_list, il_equivalence)
+            if shard_type == 'multi-kmer':
+                return MultiKeyIndex.build(protein_list, shard_key_len_spec, alphabet, il_equivalence, min_pep_len,
+                                           heavy_threshold, workers)
+            return FastaIndex.build(protein_list, int(key_len_spec), alphabet, il_equivalence, heavy_threshold,
+                                    workers)
+
+        shard_files = list()
+        shard_starts = [0]
+        id_chunks = list()
+        shard_settings = dict()
+
+        def save_shard(protein_list):
+            shard = build_shard(protein_list)
+            shard_file = cls.shard_file_name(index_file, len(shard_files), shard_type)
+            shard.save(shard_file, fasta=fasta, fasta_hash=fasta_hash)
+            shard_settings.update({key: value for key, value in shard.header.items() if key in shard_setting_keys})
+            shard_files.append(shard_file)
+            shard_starts.append(shard_starts[-1] + len(protein_list))
+            id_chunks.append('\n'.join(protein_id for protein_id, _ in protein_list).encode('utf-8') + b'\n')
+            print(f"\t \t indexed shard {len(shard_files)} with {len(protein_list)} proteins.", flush=True)
+
+        protein_list = list()
+        residue_count = 0
+        for protein_id, sequence in iter_fasta_sequences(fasta):
+            if protein_list and (residue_count + len(sequence) > max_shard_residues):
+                save_shard(protein_list)
+                protein_list = list()
+                residue_count = 0
+            protein_list.append((protein_id, sequence))
+            residue_count += len(sequence)
+        if protein_list:
+            save_shard(protein_list)
+        del protein_list
+
+        if shard_type == 'multi-kmer':
+            shard_settings.update(key_len_spec=str(key_len_spec), min_pep_len=int(min_pep_len))
+        id_bytes = np.frombuffer(b''.join(id_chunks), dtype=np.uint8)
+        id_starts = np.zeros(shard_starts[-1] + 1, dtype=np.int64)
+        id_starts[1:] = np.flatnonzero(id_bytes == ord('\n')) + 1
+        return cls(shard_type, memory_budget, il_equivalence, ProteinIdSection(id_bytes, id_starts), shard_files,
+                   shard_starts, shard_settings)
+
+    def shard(self, shard_number):
+        """memory-map a shard, the previously mapped shard is released"""
+        if not self._shard_number == shard_number:
+            self._shard = None
+            self._shard = index_classes[self.shard_type].load(self.shard_files[shard_number])
+            self._shard_number = shard_number
+        return self._shard
+
+    def iter_mappings(self, peptide_list, shard_mapper=None):
+        """
+        yield (peptide, protein number, 1-based position) for every occurrence of each peptide,
+            peptides are returned with I replaced by L if il_equivalence is set. shard_mapper(peptides, shard)
+            replaces the iter_mappings function of the shards, e.g. to search shards with an Aho-Corasick automaton.
+        """
+        peptides = list()
+        for pept in peptide_list:
+            # shorter peptides are removed with a warning by each k-mer shard otherwise
+            if (self.shard_type == 'kmer') and (len(pept) < self.split_len):
+                print(f"\t \t \t WARNING: Peptide '{pept}' is shorter than index len and will be removed. Please check digestion settings.", flush=True)
+                continue
+            peptides.append(pept.replace('I', 'L') if self.il_equivalence else pept)
+
+        for batch_start in range(0, len(peptides), shard_batch_size):
+            batch = peptides[batch_start:batch_start + shard_batch_size]
+            distinct_peptides = list(dict.fromkeys(batch))
+            # shards hold consecutive proteins, hits of each peptide stay sorted by protein and position
+            hits = dict()
+            for shard_number, first_protein in enumerate(self.shard_starts[:-1]):
+                shard = self.shard(shard_number)
+                if shard_mapper is None:
+                    mappings = shard.iter_mappings(distinct_peptides)
+                else:
+                    mappings = shard_mapper(distinct_peptides, shard)
+                for pept, protein_number, position in mappings:
+                    hits.setdefault(pept, list()).append((protein_number + first_protein, position))
+                # counters are reset in place, they can be shared with the levels of a MultiKeyIndex shard
+                for name, count in shard.counters.items():
+                    self.counters[name] += count
+                    shard.counters[name] = 0
+            for pept in batch:
+                for protein_number, position in hits.get(pept, ()):
+                    yield pept, protein_number, position
+
+    def save(self, index_file, fasta='', fasta_hash=''):
+        """
+        write the shard manifest, shards are referenced by file name relative to the manifest
+            and were saved while building
+        """
+        header = dict(self._header(fasta, fasta_hash),
+                      shard_type=self.shard_type,
+                      memory_budget=self.memory_budget,
+                      shard_files=[path.relpath(shard_file, path.dirname(index_file)) for shard_file in self.shard_files],
+                      **self.shard_settings)
+        sections = {'protein_ids': np.asarray(self.protein_ids.id_bytes, dtype=np.uint8),
+                    'protein_id_starts': np.asarray(self.protein_ids.id_starts, dtype=np.int64),
+                    'shard_starts': np.asarray(self.shard_starts, dtype=np.int64)}
+        self._write(index_file, header, sections)
+
+    @classmethod
+    def load(cls, index_file):
+        """memory-map a shard manifest, shards are memory-mapped one at a time while mapping"""
+        header, sections = map_index_file(index_file)
+        sharded_idx = cls(header['shard_type'],
+                          header['memory_budget'],
+                          header['il_equivalence'],
+                          ProteinIdSection(sections['protein_ids'], sections['protein_id_starts']),
+                          cls.shard_paths(index_file, header),
+                          sections['shard_starts'],
+                          {key: value for key, value in header.items() if key in shard_setting_keys})
+        sharded_idx.header = header
+        sharded_idx.index_file = index_file
+        return sharded_idx
+
+
+# index settings of the shard index type that are kept in the header of a shard manifest
+shard_setting_keys = ('split_len', 'alphabet', 'heavy_threshold', 'key_len_spec', 'min_pep_len', 'split_lens',
+                      'levels', 'depth')
+
+# fasta index classes by their header index_type
+index_classes = {FastaIndex.index_type: FastaIndex,
+                 MultiKeyIndex.index_type: MultiKeyIndex,
+                 SuffixArrayIndex.index_type: SuffixArrayIndex,
+                 ShardedIndex.index_type: ShardedIndex}
+
+# file extensions of the index types
+index_extensions = {FastaIndex.index_type: '.cidx',
+                    MultiKeyIndex.index_type: '.cmidx',
+                    SuffixArrayIndex.index_type: '.csa',
+                    ShardedIndex.index_type: '.cshd'}
+
+
+def index_file_name(fasta, index_type='kmer') -> str:
+    """standardised file name of an index next to the fasta file"""
+    return path.join(path.dirname(fasta), (path.basename(fasta) + index_extensions[index_type]))
@@ -0,0 +1,219 @@
+import colorama
+from array import array
+from multiprocessing import Pool
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+try:
+    from lib.CoMPaseD_fasta_index import index_classes, is_single_key_len
+except ModuleNotFoundError:
+    from CoMPaseD_fasta_index import index_classes, is_single_key_len
+
+
+# peptide to protein mapping engines of CoMPaseD_PeptideMapper, the perl ProteoMapper scripts are used by
+# CoMPaseD_crux_script instead. 'provenance' does not search the proteome but keeps proteins and positions
+# from the built-in digestion (see CoMPaseD_digest.digest_proteome_provenance)
+mapping_engine_choices = ['index', 'aho-corasick', 'suffix-array', 'provenance']
+
+# minimal number of peptides per worker process for parallel mapping
+min_parallel_chunk_size = 5000
+
+# fasta index of a mapping worker process, memory-mapped once per process
+_worker_fasta_idx = None
+
+
+def resolve_mapping_engine(mapping_engine) -> str:
+    """check availability of optional packages for a mapping engine and fall back to 'index' otherwise"""
+    if mapping_engine not in mapping_engine_choices:
+        raise ValueError(f"Mapping engine must be one of {mapping_engine_choices}.")
+    if (mapping_engine == 'aho-corasick') and (ahocorasick is None):
+        print(f"{colorama.Fore.CYAN}WARNING: Package 'pyahocorasick' is not installed. Using index based mapping instead.{colorama.Style.RESET_ALL}", flush=True)
+        return 'index'
+    return mapping_engine
+
+
+def engine_index_type(mapping_engine, key_len_spec=5) -> str:
+    """
+    type of fasta index (see CoMPaseD_fasta_index) a mapping engine works on, k-mer indices with several
+        key lengths or automatically chosen key lengths are 'multi-kmer' indices
+    """
+    if mapping_engine == 'suffix-array':
+        return 'suffix-array'
+    return 'kmer' if is_single_key_len(key_len_spec) else 'multi-kmer'
+
+
+def iter_aho_corasick_mappings(peptide_list, fasta_idx):
+    """
+    yield (peptide, protein number, 1-based position) for every occurrence of each peptide
+
+        All peptides are compiled into one Aho-Corasick automaton that scans the concatenated protein sequences
+        of fasta_idx (CoMPaseD_fasta_index.FastaIndex) once. Hits are returned in the same order as from
+        FastaIndex.iter_mappings, i.e. by peptide and then by protein and position.
+    """
+    # peptide sequences after I/L conversion and the positions in peptide_list they originate from
+    peptides = list()
+    word_dict = dict()
+    for pept in peptide_list:
+        if fasta_idx.il_equivalence:
+            pept = pept.replace('I', 'L')
+        word_dict.setdefault(pept, list()).append(len(peptides))
+        peptides.append(pept)
+    if len(word_dict) == 0:
+        return
+
+    automaton = ahocorasick.Automaton()
+    for pept, pept_numbers in word_dict.items():
+        automaton.add_word(pept, (len(pept), pept_numbers))
+    automaton.make_automaton()
+
+    # proteins are separated by line breaks, thus no peptide can match across two proteins
+    hits = list()
+    for end, (pept_len, pept_numbers) in automaton.iter(fasta_idx.sequence_string()):
+        protein_number, position = fasta_idx.locate(end - pept_len + 1)
+        for pept_number in pept_numbers:
+            hits.append((pept_number, protein_number, position))
+    del automaton
+    fasta_idx.counters['lookups'] += len(word_dict)
+    fasta_idx.counters['candidates'] += len(hits)
+
+    hits.sort()
+    for pept_number, protein_number, position in hits:
+        yield peptides[pept_number], protein_number, position
+
+
+def iter_engine_mappings(peptide_list, fasta_idx, mapping_engine='index', workers=1):
+    """
+    yield (peptide, protein number, 1-based position) with the selected mapping engine,
+        the 'index' and 'suffix-array' engines search the k-mer or suffix array index passed as fasta_idx.
+        With workers > 1, peptides of an index loaded from or saved to a file are mapped in parallel.
+    """
+    if (workers > 1) and fasta_idx.index_file:
+        peptide_list = list(peptide_list)
+        if len(peptide_list) >= 2 * min_parallel_chunk_size:
+            return iter_parallel_mappings(peptide_list, fasta_idx, mapping_engine, workers)
+    return _iter_single_mappings(peptide_list, fasta_idx, mapping_engine)
+
+
+def _iter_single_mappings(peptide_list, fasta_idx, mapping_engine):
+    if mapping_engine == 'aho-corasick':
+        # shards of a ShardedIndex are scanned one after the other
+        if fasta_idx.index_type == 'sharded':
+            return fasta_idx.iter_mappings(peptide_list, iter_aho_corasick_mappings)
+        return iter_aho_corasick_mappings(peptide_list, fasta_idx)
+    return fasta_idx.iter_mappings(peptide_list)
+
+
+def _init_mapping_worker(index_file, index_type):
+    global _worker_fasta_idx
+    _worker_fasta_idx = index_classes[index_type].load(index_file)
+
+
+def _map_peptide_chunk(args):
+    """mappings and mapping counters of one chunk"""
+    peptide_chunk, mapping_engine = args
+    # counters are reset in place, they can be shared with the levels of a MultiKeyIndex
+    counters = _worker_fasta_idx.counters
+    for name in counters:
+        counters[name] = 0
+    chunk_mappings = list(_iter_single_mappings(peptide_chunk, _worker_fasta_idx, mapping_engine))
+    return chunk_mappings, dict(counters)
+
+
+def iter_parallel_mappings(peptide_list, fasta_idx, mapping_engine='index', workers=2):
+    """
+    same output as iter_engine_mappings, but peptide chunks are mapped by a pool of worker processes
+
+        Workers memory-map the index file of fasta_idx, i.e. all processes share the index pages of the
+        operating system page cache instead of holding private copies. Chunks are returned in input order.
+    """
+    # an Aho-Corasick automaton scans the complete proteome per chunk, thus use only one chunk per worker
+    chunks_per_worker = 1 if mapping_engine == 'aho-corasick' else 4
+    chunk_size = max(min_parallel_chunk_size, -(-len(peptide_list) // (chunks_per_worker * workers)))
+    chunks = [(peptide_list[start:start + chunk_size], mapping_engine)
+              for start in range(0, len(peptide_list), chunk_size)]
+    with Pool(processes=min(workers, len(chunks)), initializer=_init_mapping_worker,
+              initargs=(fasta_idx.index_file, fasta_idx.index_type)) as pool:
+        for chunk_mappings, chunk_counters in pool.imap(_map_peptide_chunk, chunks):
+            for name, count in chunk_counters.items():
+                fasta_idx.counters[name] += count
+            yield from chunk_mappings
+
+
+class MappingMemo:
+    """
+    run-wide memo of peptide mappings shared by all digests
+
+        Peptide sequences occur in digests of several proteases (e.g. trypsin and lys-c), each distinct sequence
+        is only looked up once in fasta_idx and its hits are re-used for every digest containing it.
+        Hits are kept in flat int32 arrays of protein numbers and 1-based positions, hit_ranges holds the range of
+        each peptide (after I/L conversion) in these arrays. The memo grows with all distinct peptides of a run,
+        fits_memory_budget estimates whether it (and the digests it is built from) stays within a memory budget.
+    """
+
+    # estimated bytes of a digested peptide kept for the memo: its sequence in the digest and in hit_ranges,
+    # the dictionary entry and range tuple and about one hit of two int32 values
+    bytes_per_peptide = 320
+
+    def __init__(self, fasta_idx, mapping_engine='index', workers=1):
+        self.fasta_idx = fasta_idx
+        self.mapping_engine = mapping_engine
+        self.workers = workers
+        self.hit_ranges = dict()
+        self.protein_numbers = array('i')
+        self.positions = array('i')
+        self.requested_count = 0
+
+    @classmethod
+    def fits_memory_budget(cls, peptide_count, memory_budget) -> bool:
+        """True if a memo of peptide_count digested peptides is estimated to fit memory_budget MB (0: no limit)"""
+        return (memory_budget <= 0) or (peptide_count * cls.bytes_per_peptide <= memory_budget * (1 << 20))
+
+    def __len__(self):
+        return len(self.hit_ranges)
+
+    def hit_count(self, pept) -> int:
+        """number of occurrences of a memorised peptide (after I/L conversion) in the proteome"""
+        start, end = self.hit_ranges[pept]
+        return end - start
+
+    def _keys(self, peptide_list):
+        if self.fasta_idx.il_equivalence:
+            return [pept.replace('I', 'L') for pept in peptide_list]
+        return list(peptide_list)
+
+    def add(self, peptide_list):
+        """map all peptides that are not memorised yet with one engine call"""
+        hit_ranges = self.hit_ranges
+        new_peptides = [pept for pept in dict.fromkeys(self._keys(peptide_list)) if pept not in hit_ranges]
+        for pept in new_peptides:
+            hit_ranges[pept] = (0, 0)
+
+        # all engines return the hits of each peptide consecutively
+        protein_numbers = self.protein_numbers
+        positions = self.positions
+        current_pept, start = None, 0
+        for pept, protein_number, position in iter_engine_mappings(new_peptides, self.fasta_idx, self.mapping_engine,
+                                                                     self.workers):
+            if pept != current_pept:
+                if current_pept is not None:
+                    hit_ranges[current_pept] = (start, len(protein_numbers))
+                current_pept, start = pept, len(protein_numbers)
+            protein_numbers.append(protein_number)
+            positions.append(position)
+        if current_pept is not None:
+            hit_ranges[current_pept] = (start, len(protein_numbers))
+
+    def iter_mappings(self, peptide_list):
+        """same output as iter_engine_mappings, unknown peptides are mapped and memorised first"""
+        keys = self._keys(peptide_list)
+        self.add(keys)
+        self.requested_count += len(keys)
+        protein_numbers = self.protein_numbers
+        positions = self.positions
+        for pept in keys:
+            start, end = self.hit_ranges[pept]
+            for hit in range(start, end):
+                yield pept, protein_numbers[hit], positions[hit]
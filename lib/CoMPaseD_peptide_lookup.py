@@ -0,0 +1,160 @@
+import argparse
+import colorama
+import sys
+from contextlib import redirect_stdout
+from os import path
+
+try:
+    from lib.CoMPaseD_process_runner import default_worker_number
+except ModuleNotFoundError:
+    from CoMPaseD_process_runner import default_worker_number
+
+try:
+    from lib.CoMPaseD_mapping_engines import mapping_engine_choices, resolve_mapping_engine, engine_index_type
+except ModuleNotFoundError:
+    from CoMPaseD_mapping_engines import mapping_engine_choices, resolve_mapping_engine, engine_index_type
+
+try:
+    from lib.CoMPaseD_fasta_index import is_single_key_len
+except ModuleNotFoundError:
+    from CoMPaseD_fasta_index import is_single_key_len
+
+try:
+    from lib.CoMPaseD_PeptideMapper import load_fasta_index, iter_protein_mappings, print_mapping_counters
+except ModuleNotFoundError:
+    from CoMPaseD_PeptideMapper import load_fasta_index, iter_protein_mappings, print_mapping_counters
+
+
+# engines that search peptides in the proteome, provenance mapping requires a digestion
+lookup_engine_choices = [engine for engine in mapping_engine_choices if not engine == 'provenance']
+
+# number of peptides read and mapped at a time
+lookup_batch_size = 1000000
+
+
+class PeptideLookup:
+    """
+    peptide to protein mapping for ad-hoc peptide lists with a fasta index that is loaded once
+
+        The index is re-used from earlier runs (e.g. of CoMPaseD_PeptideMapper with identical settings) or generated
+        if missing or outdated. Peptides are mapped with the same I/L and key length semantics as map_peptides,
+        i.e. returned with I replaced by L unless il_equivalence is False.
+
+        lookup = PeptideLookup('proteome.fasta')
+        for peptide, protein, location in lookup.iter_batch_mappings(open('peptides.txt')):
+            ...
+    """
+
+    def __init__(self, fasta, key_len_spec=5, il_equivalence=True, mapping_engine='index', min_pep_len=6,
+                 memory_budget=0, threads=1):
+        if not path.isfile(fasta):
+            raise FileNotFoundError(fasta)
+        self.fasta = path.abspath(fasta)
+        self.mapping_engine = resolve_mapping_engine(mapping_engine)
+        if self.mapping_engine not in lookup_engine_choices:
+            raise ValueError(f"Mapping engine must be one of {lookup_engine_choices}.")
+        self.key_len_spec = int(key_len_spec) if is_single_key_len(str(key_len_spec)) else str(key_len_spec).strip().lower()
+        self.threads = max(int(threads), 1)
+        self.fasta_idx = load_fasta_index(self.fasta, self.key_len_spec, il_equivalence,
+                                          indexType=engine_index_type(self.mapping_engine, self.key_len_spec),
+                                          minPepLen=min_pep_len, threads=self.threads,
+                                          memoryBudget=max(int(memory_budget), 0))
+        if self.fasta_idx is None:
+            raise RuntimeError(f"Fasta index for {self.fasta} could not be generated.")
+
+    def iter_mappings(self, peptide_list):
+        """yield (peptide, protein identifier, 1-based position) for every occurrence of each peptide of a batch"""
+        return iter_protein_mappings(peptide_list, self.fasta_idx, self.mapping_engine, workers=self.threads)
+
+    def iter_batch_mappings(self, peptides, batch_size=lookup_batch_size):
+        """
+        same output as iter_mappings for an iterable of peptides or lines of a peptide file (see read_peptides),
+            peptides are mapped in batches of batch_size and rows are yielded in input order
+        """
+        if isinstance(peptides, str):
+            peptides = [peptides]
+        batch = list()
+        for pept in read_peptides(peptides):
+            batch.append(pept)
+            if len(batch) >= batch_size:
+                yield from self.iter_mappings(batch)
+                batch = list()
+        if batch:
+            yield from self.iter_mappings(batch)
+
+
+def read_peptides(lines):
+    """
+    peptide sequences of text lines, e.g. of a file with one peptide per line,
+        only the first tab-separated column is used, empty lines and a 'peptide' header are skipped
+    """
+    for line in lines:
+        pept = line.split('\t', 1)[0].strip().upper()
+        if pept and not pept == 'PEPTIDE':
+            yield pept
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog,
+                                     description="Map peptides to all proteins of a fasta file using a persistent "
+                                                 "fasta index, rows of peptide, protein and 1-based location are "
+                                                 "written as tab-separated table")
+    parser.add_argument('--fasta', required=True)
+    parser.add_argument('--peptides', required=False, default='-',
+                        help="file with one peptide per line (first tab-separated column), '-' reads from stdin")
+    parser.add_argument('--out', required=False, default='-',
+                        help="output table, '-' writes to stdout and progress messages to stderr")
+    parser.add_argument('--indexing_key_len', required=False, default=5,
+                        help="index key length, several lengths (e.g. 4,7) or 'auto' to choose them from proteome "
+                             "size and min_len")
+    parser.add_argument('--min_len', required=False, default=6, type=int,
+                        help="minimal peptide length used by --indexing_key_len auto")
+    parser.add_argument('--differentiate_I_L', action='store_false')
+    parser.add_argument('--mapping_engine', required=False, default='index', choices=lookup_engine_choices)
+    parser.add_argument('--index_memory_budget', required=False, default=0, type=int,
+                        help="split the fasta index into shards of consecutive proteins that are built within this "
+                             "many MB and searched one after the other (0: one index for all proteins)")
+    parser.add_argument('--threads', required=False, default=None, type=int,
+                        help="maximal number of parallel processes (default: number of cores - 1)")
+    parser.add_argument('--batch_size', required=False, default=lookup_batch_size, type=int,
+                        help="number of peptides mapped at a time")
+    args = parser.parse_args(argv)
+
+    # rows written to stdout must not be mixed with progress messages
+    rows_to_stdout = (args.out == '-')
+    row_stream = sys.stdout
+    with redirect_stdout(sys.stderr if rows_to_stdout else sys.stdout):
+        if not path.isfile(args.fasta):
+            print(f"{colorama.Fore.RED}ERROR: Fasta file not existing. Please check: {args.fasta}. \n Stopping. {colorama.Style.RESET_ALL}", flush=True)
+            return 1
+        threads = args.threads if args.threads is not None else default_worker_number()
+        try:
+            lookup = PeptideLookup(args.fasta, key_len_spec=args.indexing_key_len, il_equivalence=args.differentiate_I_L,
+                                   mapping_engine=args.mapping_engine, min_pep_len=args.min_len,
+                                   memory_budget=args.index_memory_budget, threads=threads)
+        except RuntimeError:
+            return 1
+
+        in_handle = sys.stdin if args.peptides == '-' else open(args.peptides)
+        out_handle = row_stream if rows_to_stdout else open(args.out, 'w')
+        row_count = 0
+        try:
+            out_handle.write('peptide\tprotein\tlocation\n')
+            for pept, protein, location in lookup.iter_batch_mappings(in_handle, max(args.batch_size, 1)):
+                out_handle.write(f'{pept}\t{protein}\t{location}\n')
+                row_count += 1
+        finally:
+            if in_handle is not sys.stdin:
+                in_handle.close()
+            if rows_to_stdout:
+                out_handle.flush()
+            else:
+                out_handle.close()
+
+        print(f"Mapped peptides to {row_count} protein locations.", flush=True)
+        print_mapping_counters(lookup.fasta_idx)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+import colorama
+import os
+import signal
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from multiprocessing import cpu_count
+from subprocess import Popen, PIPE, STDOUT, DEVNULL, run
+from threading import Event, Lock
+from time import perf_counter
+
+
+def default_worker_number():
+    """use all but one core, at least one"""
+    return max(cpu_count() - 1, 1)
+
+
+def run_commands(cmd_list, max_workers=None, start_messages=None, finish_messages=None, line_filter=None,
+                 cancel_event=None) -> list:
+    """
+    Run external shell commands (crux, clips, promast) with at most max_workers commands at a time
+
+        stdout and stderr lines of each command are printed as soon as they are written,
+        line_filter can be a function returning False for lines that should not be printed.
+        Setting cancel_event (threading.Event) or a KeyboardInterrupt terminates running commands and
+        skips all commands that have not been started yet. Each command runs in its own process group, i.e. the
+        tools started by the shell are terminated together with the shell.
+
+        Returns a list of (return_code, runtime in seconds) tuples in the order of cmd_list,
+        return_code is None for skipped commands.
+    """
+
+    if max_workers is None:
+        max_workers = default_worker_number()
+    max_workers = max(int(max_workers), 1)
+    if cancel_event is None:
+        cancel_event = Event()
+
+    total = len(cmd_list)
+    if start_messages is None:
+        start_messages = [f"Started command {n} of {total}" for n in range(1, total + 1)]
+    if finish_messages is None:
+        finish_messages = [f"Finished command {n} of {total}" for n in range(1, total + 1)]
+
+    print_lock = Lock()
+    running_procs = dict()
+    results = [(None, 0.0)] * total
+
+    def run_single(n):
+        if cancel_event.is_set():
+            return
+        time_start = perf_counter()
+        proc = Popen(cmd_list[n], shell=True, stdout=PIPE, stderr=STDOUT, text=True, errors='replace', bufsize=1,
+                     start_new_session=not (os.name == 'nt'))
+        running_procs[n] = proc
+        with print_lock:
+            print(start_messages[n], flush=True)
+        for line in proc.stdout:
+            line = line.rstrip()
+            if (line_filter is None) or line_filter(line):
+                with print_lock:
+                    print(line, flush=True)
+        return_code = proc.wait()
+        running_procs.pop(n, None)
+        runtime = perf_counter() - time_start
+        results[n] = (return_code, runtime)
+        with print_lock:
+            if return_code == 0:
+                print(f"{finish_messages[n]} ({runtime:0.1f} seconds)", flush=True)
+            elif not cancel_event.is_set():
+                print(f"{colorama.Fore.RED}ERROR: Command failed with exit code {return_code}: {cmd_list[n]}{colorama.Style.RESET_ALL}", flush=True)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending = list()
+    try:
+        pending = [executor.submit(run_single, n) for n in range(total)]
+        # poll to allow cancellation from other threads while commands are running
+        while pending:
+            done, pending = wait(pending, timeout=0.5, return_when=FIRST_EXCEPTION)
+            for future in done:
+                future.result()
+            if cancel_event.is_set():
+                for proc in list(running_procs.values()):
+                    terminate_command(proc)
+    except KeyboardInterrupt:
+        cancel_event.set()
+        print(f"{colorama.Fore.CYAN}WARNING: Cancelled, terminating running commands.{colorama.Style.RESET_ALL}", flush=True)
+        raise
+    finally:
+        if cancel_event.is_set():
+            for proc in list(running_procs.values()):
+                terminate_command(proc)
+        # commands that have not been started yet are skipped
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+    return results
+
+
+def terminate_command(proc):
+    """terminate a shell command of run_commands together with all processes it started"""
+    try:
+        if os.name == 'nt':
+            # the windows shell does not pass termination on to its child processes
+            run(['taskkill', '/F', '/T', '/PID', str(proc.pid)], stdout=DEVNULL, stderr=DEVNULL)
+        else:
+            os.killpg(proc.pid, signal.SIGTERM)
+    except OSError:
+        # process group already finished
+        pass
+
+
+def commands_failed(results) -> bool:
+    """True if any command of run_commands results failed or was skipped"""
+    return any(return_code != 0 for return_code, _ in results)
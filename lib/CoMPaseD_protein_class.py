@@ -1,6 +1,5 @@
 from numpy import mean, median, sum
 from Bio import Seq
-from collections import namedtuple
 
 
 class ProteinClass(Seq.Seq):
@@ -260,32 +259,33 @@ def makeProteinList(fasta_file):
     return protein_list
 
 
-def fillProteinList(protein_list_to_fill, fill_df):
+def fillProteinList(protein_list_to_fill, fill_df, protein_codes=None):
     """
-    Faster variant that uses a dict to fill protein_list
+    Faster variant that uses a dict to fill protein_list;
+    fill_df might hold integer codes instead of peptide and protein strings together with a
+    peptide_length column, protein_codes maps protein identifiers to these codes
     """
     # sort df by protein and extract lists with peptide information, moved to Analysis_MPD, analyse_results function
     # outside the loop, thus only done once fill_df.sort_values(by="protein", inplace=True)
     protein_col = fill_df["protein"]
     location_col = fill_df["location"]
     peptide_col = fill_df["peptide"]
-    # convert/combine lists to tuple and than to namedtuple
-    peptide_tuples = list(zip(protein_col, location_col, peptide_col))
-    tuple_list = namedtuple('entry', 'protein location pepseq')
-    tuple_list = [tuple_list(*el) for el in peptide_tuples]
-    # generate dict from tuple_list
+    # peptide lengths can not be calculated from peptide codes
+    if "peptide_length" in fill_df.columns:
+        length_col = fill_df["peptide_length"]
+    else:
+        length_col = [len(pepseq) for pepseq in peptide_col]
+    # generate dict from peptide information
     tmp_peps = {}
-    tmp_loc = {}
-    for protein, location, pepseq in tuple_list:
+    for protein, location, pepseq, pep_length in zip(protein_col, location_col, peptide_col, length_col):
         if protein not in tmp_peps:
             tmp_peps[protein] = list()
-            tmp_loc[protein] = list()
-        tmp_peps[protein].append(pepseq)
-        tmp_loc[protein].append(location)
+        tmp_peps[protein].append((pepseq, location, pep_length))
     # loop through protein list and fill peptides by dict-key
     for prot in protein_list_to_fill:
+        protein_key = prot.id if protein_codes is None else protein_codes.get(prot.id)
         # do not try to fill proteins without any peptide to avoid 'NoneType' error
-        if prot.id in tmp_peps.keys():
-            for peptide_seq, pep_location in zip(tmp_peps.get(prot.id), tmp_loc.get(prot.id)):
-                prot.add_pep_variant_2(peptide_seq, pep_location)
+        if protein_key in tmp_peps:
+            for peptide_seq, pep_location, pep_length in tmp_peps[protein_key]:
+                prot.add_pep(peptide_seq, pep_location, pep_length)
     return protein_list_to_fill
@@ -0,0 +1,151 @@
+import colorama
+from os import path, remove
+from pandas import read_csv
+
+try:
+    import pyarrow
+    import pyarrow.parquet as parquet
+    import pyarrow.feather as feather
+except ImportError:
+    pyarrow = None
+
+
+# formats of the tables handed over between digestion, export and analysis, binary columnar formats require the
+# pyarrow package and store repeated strings (e.g. enzyme and protein names) dictionary-encoded
+table_format_choices = ['tsv', 'parquet', 'feather']
+table_extensions = {'tsv': '.tsv', 'parquet': '.parquet', 'feather': '.feather'}
+
+# number of rows converted at a time from tab-separated to parquet tables
+conversion_chunk_size = 1000000
+
+
+def resolve_table_format(table_format) -> str:
+    """check availability of pyarrow for a binary table format and fall back to 'tsv' otherwise"""
+    if table_format not in table_format_choices:
+        raise ValueError(f"Table format must be one of {table_format_choices}.")
+    if (not table_format == 'tsv') and (pyarrow is None):
+        print(f"{colorama.Fore.CYAN}WARNING: Package 'pyarrow' is not installed. Writing tab-separated tables instead.{colorama.Style.RESET_ALL}", flush=True)
+        return 'tsv'
+    return table_format
+
+
+def table_format_of(table_file) -> str:
+    """table format by file extension, files without known extension are treated as tab-separated"""
+    extension = path.splitext(table_file)[1].lower()
+    for table_format, format_extension in table_extensions.items():
+        if extension == format_extension:
+            return table_format
+    return 'tsv'
+
+
+def table_file_name(table_file, table_format) -> str:
+    """table_file with the extension of table_format, e.g. results.tsv -> results.parquet"""
+    stem, extension = path.splitext(table_file)
+    if extension.lower() not in table_extensions.values():
+        stem = table_file
+    return stem + table_extensions[table_format]
+
+
+def find_table_file(table_file, table_format='tsv') -> str:
+    """
+    existing file of a table that might be saved in another format than its name suggests,
+        table_file in table_format is preferred, then table_file itself and then the other formats
+    """
+    candidates = [table_file_name(table_file, table_format), table_file]
+    candidates.extend(table_file_name(table_file, other_format) for other_format in table_format_choices)
+    for candidate in candidates:
+        if path.isfile(candidate):
+            return candidate
+    return table_file
+
+
+def read_table(table_file, columns=None, dtype=None):
+    """
+    read a table into a DataFrame, the format is chosen by file extension
+
+        Only columns are loaded if given (column projection), binary tables are read by multiple threads.
+        Dictionary-encoded string columns are returned as plain strings like in tab-separated tables.
+    """
+    table_format = table_format_of(table_file)
+    if table_format == 'tsv':
+        return read_csv(table_file, sep='\t', usecols=columns, dtype=dtype)
+    if pyarrow is None:
+        raise ImportError(f"Package 'pyarrow' is required to read {table_file}.")
+    if table_format == 'parquet':
+        table = parquet.read_table(table_file, columns=columns, use_threads=True)
+    else:
+        table = feather.read_table(table_file, columns=columns, use_threads=True, memory_map=True)
+    table = _decode_dictionaries(table)
+    df = table.to_pandas(use_threads=True)
+    if dtype is not None:
+        df = df.astype(dtype)
+    return df
+
+
+def write_table(df, table_file, dictionary_cols=()):
+    """
+    write df to table_file in the format given by its extension,
+        string columns in dictionary_cols are dictionary-encoded in binary tables
+    """
+    table_format = table_format_of(table_file)
+    if table_format == 'tsv':
+        df.to_csv(table_file, sep='\t', index=False)
+        return
+    if pyarrow is None:
+        raise ImportError(f"Package 'pyarrow' is required to write {table_file}.")
+    table = _encode_dictionaries(pyarrow.Table.from_pandas(df, preserve_index=False), dictionary_cols)
+    if table_format == 'parquet':
+        parquet.write_table(table, table_file, compression='zstd')
+    else:
+        feather.write_feather(table.unify_dictionaries(), table_file, compression='zstd')
+
+
+def convert_tsv_table(tsv_file, table_format, dictionary_cols=(), keep_tsv=False, dtype=None,
+                      chunk_size=conversion_chunk_size) -> str:
+    """
+    convert a tab-separated table (e.g. the pooled peptide tables) to table_format and return the new file name
+
+        Parquet tables are written in chunks of chunk_size rows, one row group per chunk. Feather tables hold a
+        single dictionary per column and are converted at once. The tab-separated table is removed unless
+        keep_tsv is set.
+    """
+    if table_format == 'tsv':
+        return tsv_file
+    out_file = table_file_name(tsv_file, table_format)
+    if table_format == 'parquet':
+        writer = None
+        try:
+            for df in read_csv(tsv_file, sep='\t', dtype=dtype, chunksize=chunk_size):
+                table = _encode_dictionaries(pyarrow.Table.from_pandas(df, preserve_index=False), dictionary_cols)
+                if writer is None:
+                    writer = parquet.ParquetWriter(out_file, table.schema, compression='zstd')
+                writer.write_table(table.cast(writer.schema))
+            if writer is None:
+                # header only, i.e. no rows in tsv_file
+                write_table(read_csv(tsv_file, sep='\t', dtype=dtype), out_file, dictionary_cols)
+        finally:
+            if writer is not None:
+                writer.close()
+    else:
+        write_table(read_csv(tsv_file, sep='\t', dtype=dtype), out_file, dictionary_cols)
+    if not keep_tsv:
+        remove(tsv_file)
+    return out_file
+
+
+def _encode_dictionaries(table, dictionary_cols):
+    for name in dictionary_cols:
+        col_idx = table.schema.get_field_index(name)
+        if col_idx < 0:
+            continue
+        col_type = table.schema.field(col_idx).type
+        if pyarrow.types.is_string(col_type) or pyarrow.types.is_large_string(col_type):
+            table = table.set_column(col_idx, name, table.column(col_idx).dictionary_encode())
+    return table
+
+
+def _decode_dictionaries(table):
+    for col_idx, field in enumerate(table.schema):
+        if pyarrow.types.is_dictionary(field.type):
+            table = table.set_column(col_idx, field.name, table.column(col_idx).cast(field.type.value_type))
+    return table
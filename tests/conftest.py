@@ -0,0 +1,19 @@
+import sys
+import pytest
+from os import path
+
+# modules of lib are imported as lib.CoMPaseD_... like by CoMPaseD_cli.py
+repo_dir = path.dirname(path.dirname(path.abspath(__file__)))
+if repo_dir not in sys.path:
+    sys.path.insert(0, repo_dir)
+
+data_dir = path.join(path.dirname(path.abspath(__file__)), 'data')
+
+
+@pytest.fixture
+def test_fasta(tmp_path):
+    """copy of the test proteome in a temporary folder, fasta indices are saved next to it"""
+    fasta = tmp_path / 'test_proteome.fasta'
+    with open(path.join(data_dir, 'test_proteome.fasta')) as handle:
+        fasta.write_text(handle.read())
+    return str(fasta)
@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+from pandas import DataFrame
+
+# the analysis script requires the GUI and DeepMSPeptide dependencies
+analysis = pytest.importorskip('lib.CoMPaseD_analysis_script')
+
+
+def toy_peptides() -> DataFrame:
+    """filtered digestion table of two proteases on proteins P1 to P6, P5 and P6 share a peptide"""
+    rows = list()
+    for protease, max_mc in (('trypsin', 1), ('lys-c', 0)):
+        for protein_number in range(1, 7):
+            for mc in range(max_mc + 1):
+                for n in range(4):
+                    rows.append((f'{protease[0].upper()}PEP{protein_number}X{mc}N{n}K', f'P{protein_number}',
+                                 protease, mc))
+        rows.append((f'{protease[0].upper()}SHAREDK', 'P5', protease, 0))
+        rows.append((f'{protease[0].upper()}SHAREDK', 'P6', protease, 0))
+    return DataFrame(rows, columns=['peptide', 'protein', 'Enzyme', 'MC'])
+
+
+def toy_weights(proteins=('P1', 'P2', 'P3', 'P4', 'P5', 'P6')) -> DataFrame:
+    """protein weight file with a group and two random samplings"""
+    rng = np.random.default_rng(7)
+    return DataFrame({'Identifier': list(proteins),
+                      'Group': ['A' if protein < 'P4' else 'B' for protein in proteins],
+                      'Random_sampling_1': rng.uniform(0.1, 1, len(proteins)),
+                      'Random_sampling_2': rng.uniform(0.1, 1, len(proteins))})
+
+
+def sample_encoded(pep_df, pwf_df, proteases=('trypsin', 'lys-c'), max_mcs=(1, 0), sampling_size=5, seed=1):
+    """random samplings as in CoMPaseD_analysis_script.main, returns the decoded sampling output table"""
+    pep_df, pwf_df, code_tables = analysis.encode_ids(pep_df.copy(), list(proteases), pwf_df.copy())
+    rand_sampling_cols, weight_matrix = analysis.get_weight_matrix(pwf_df, len(code_tables['protein']))
+    pwf_df = pwf_df.drop(rand_sampling_cols, axis=1)
+    pep_df = analysis.merge_protein_weights(pep_df, pwf_df)
+    protease_mc_df = analysis.protease_mc_expansion(list(proteases), list(max_mcs))
+    pep_df['subset'] = analysis.get_subset_codes(pep_df, protease_mc_df, list(proteases))
+    code_tables['subset'] = analysis.Index(protease_mc_df['Enzyme'] + '__' + protease_mc_df['MC'].astype(str))
+    protease_mc_df['sampling_size'] = sampling_size
+    protease_mc_df['subset'] = protease_mc_df['Enzyme'] + '__' + protease_mc_df['MC'].astype(str)
+    pep_df['DeepMSPep_prediction'] = 1
+    pep_df = pep_df.reset_index(drop=True)
+    pep_df['ID'] = pep_df.index
+
+    np.random.seed(seed)
+    for col_idx, smp_col in enumerate(rand_sampling_cols):
+        id_list = analysis.rand_smp(pep_df, protease_mc_df,
+                                    analysis.get_sampling_weights(pep_df, weight_matrix, col_idx))
+        smp_values = np.zeros(len(pep_df), dtype='int8')
+        smp_values[id_list] = 1
+        pep_df[smp_col.lower().replace('random_sampling_', 'sampling_')] = smp_values
+    return analysis.decode_ids(pep_df, code_tables)
+
+
+def test_missing_protein_in_weight_file_is_not_sampled():
+    pwf_df = toy_weights(proteins=('P1', 'P2', 'P3', 'P4', 'P5'))
+    out_df = sample_encoded(toy_peptides(), pwf_df)
+
+    missing = out_df['protein'] == 'P6'
+    assert missing.any()
+    assert out_df.loc[missing, 'Identifier'].isna().all()
+    assert (out_df.loc[~missing, 'Identifier'] == out_df.loc[~missing, 'protein']).all()
+    # no weight, i.e. never sampled
+    assert (out_df.loc[missing, ['sampling_1', 'sampling_2']] == 0).all().all()
+    assert (out_df[['sampling_1', 'sampling_2']].sum() == 3 * 5).all()
+
+
+def sample_strings(pep_df, pwf_df, proteases=('trypsin', 'lys-c'), max_mcs=(1, 0), sampling_size=5, seed=1):
+    """random samplings on string identifiers and merged weight cols, i.e. without the integer encoding"""
+    pep_df = analysis.merge(left=pep_df, right=pwf_df, left_on='protein', right_on='Identifier',
+                            how='left').reset_index()
+    protease_mc_df = analysis.protease_mc_expansion(list(proteases), list(max_mcs))
+    protease_mc_df['sampling_size'] = sampling_size
+    protease_mc_df['subset'] = protease_mc_df['Enzyme'] + '__' + protease_mc_df['MC'].astype(str)
+    pep_df['subset'] = pep_df['Enzyme'].astype(str) + '__' + pep_df['MC'].astype(str)
+    pep_df = pep_df.reset_index(drop=True)
+    pep_df['ID'] = pep_df.index
+
+    np.random.seed(seed)
+    for smp_col in ('Random_sampling_1', 'Random_sampling_2'):
+        shuffled_df = pep_df.sample(frac=1).reset_index(drop=True)
+        id_list = list()
+        for row in protease_mc_df.itertuples():
+            subset_df = shuffled_df.loc[shuffled_df['subset'] == row.subset].reset_index(drop=True)
+            id_list.extend(subset_df.sample(n=row.sampling_size, replace=False, weights=smp_col)['ID'])
+        pep_df[smp_col.lower().replace('random_sampling_', 'sampling_')] = pep_df['ID'].isin(id_list).astype('int8')
+    return pep_df
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_encoded_sampling_matches_string_sampling(seed):
+    pep_df = toy_peptides()
+    pwf_df = toy_weights()
+    encoded_df = sample_encoded(pep_df, pwf_df, seed=seed)
+    string_df = sample_strings(pep_df, pwf_df, seed=seed)
+
+    assert encoded_df['subset'].tolist() == string_df['subset'].tolist()
+    for smp_col in ('sampling_1', 'sampling_2'):
+        encoded_smp = encoded_df.loc[encoded_df[smp_col] == 1]
+        string_smp = string_df.loc[string_df[smp_col] == 1]
+        # identical sampled peptides, thus identical proteins and counts per protease / MC
+        assert (encoded_smp[['peptide', 'protein', 'Enzyme', 'MC']].to_numpy().tolist()
+                == string_smp[['peptide', 'protein', 'Enzyme', 'MC']].to_numpy().tolist())
+        assert (encoded_smp.groupby('subset')['protein'].agg(lambda proteins: sorted(set(proteins))).to_dict()
+                == string_smp.groupby('subset')['protein'].agg(lambda proteins: sorted(set(proteins))).to_dict())
+        assert encoded_smp.groupby('subset').size().to_dict() == string_smp.groupby('subset').size().to_dict()
+        assert (encoded_smp.groupby('subset').size() == 5).all()
@@ -0,0 +1,74 @@
+import pytest
+
+from lib.CoMPaseD_digest import compile_cleavage_rule, get_cleavage_rule, handle_custom_proteases, digest_sequence, \
+    split_by_missed_cleavages, digest_proteome_mc_levels, digest_proteome_provenance, load_fasta_sequences, \
+    peptide_mass
+
+
+def digest(sequence, enzyme='trypsin', max_missed_cleavages=0, clip_n_term_met=False, min_len=1):
+    """all peptides of sequence without mass filter"""
+    return list(digest_sequence(sequence, compile_cleavage_rule(get_cleavage_rule(enzyme)), max_missed_cleavages,
+                                min_len=min_len, max_len=55, min_mass=0, max_mass=100000,
+                                clip_n_term_met=clip_n_term_met))
+
+
+def test_tryptic_peptides():
+    # no cleavage before proline
+    assert digest('PEPTIDEKAAAKPLLLRGGGR') == [('PEPTIDEK', 0, 0), ('AAAKPLLLR', 8, 0), ('GGGR', 17, 0)]
+
+
+def test_tryptic_peptides_with_missed_cleavages():
+    assert digest('PEPTIDEKAAAKPLLLRGGGR', max_missed_cleavages=1) == [
+        ('PEPTIDEK', 0, 0), ('PEPTIDEKAAAKPLLLR', 0, 1),
+        ('AAAKPLLLR', 8, 0), ('AAAKPLLLRGGGR', 8, 1),
+        ('GGGR', 17, 0)]
+
+
+def test_n_terminal_methionine_clipping():
+    assert digest('MAAAKGGGR', clip_n_term_met=True) == [('MAAAK', 0, 0), ('AAAK', 1, 0), ('GGGR', 5, 0)]
+    assert digest('MAAAKGGGR', clip_n_term_met=False) == [('MAAAK', 0, 0), ('GGGR', 5, 0)]
+
+
+def test_length_and_mass_filter():
+    assert [peptide for peptide, _, _ in digest('PEPTIDEKAAAKPLLLRGGGR', min_len=6)] == ['PEPTIDEK', 'AAAKPLLLR']
+    # amino acids without defined mass are not digested
+    assert digest('PEPTBDEKGGGR') == [('GGGR', 8, 0)]
+    assert peptide_mass('GGGR') == pytest.approx(3 * 57.0519 + 156.1875 + 18.01528)
+
+
+def test_cleavage_before_residue():
+    # lysarginase cleaves N-terminal of K and R
+    assert [peptide for peptide, _, _ in digest('AAAKGGGRPPP', enzyme='lysarginase')] == ['AAA', 'KGGG', 'RPPP']
+
+
+def test_split_by_missed_cleavages():
+    mc_levels = split_by_missed_cleavages(['PEPTIDEK', 'PEPTIDEKAAAKPLLLR', 'AAAKPLLLR', 'AAAKPLLLRGGGR'],
+                                          'trypsin', 1)
+    assert mc_levels == {0: ['PEPTIDEK', 'AAAKPLLLR'], 1: ['PEPTIDEKAAAKPLLLR', 'AAAKPLLLRGGGR']}
+
+
+def test_custom_proteases():
+    assert handle_custom_proteases('custom [fwylkr]|{P}') == (0, '[FWYLKR]|{P}')
+    assert handle_custom_proteases('custom[KR}|{P}') == (-2, '')
+    assert handle_custom_proteases('custom[KR]|{P]') == (-3, '')
+    with pytest.raises(ValueError):
+        handle_custom_proteases('custom KR|P')
+    # custom enzymes with the cleavage rule of a crux enzyme give the same peptides
+    assert digest('PEPTIDEKAAAKPLLLRGGGR', enzyme='custom[RK]|{P}') == digest('PEPTIDEKAAAKPLLLRGGGR')
+
+
+def test_mc_levels_of_proteome(test_fasta):
+    protein_list = load_fasta_sequences(test_fasta)
+    mc_levels = digest_proteome_mc_levels(protein_list, 'trypsin', 2)
+    # each peptide is labelled with its exact number of missed cleavages
+    all_peptides = sorted(peptide for peptide_list in mc_levels.values() for peptide in peptide_list)
+    assert split_by_missed_cleavages(all_peptides, 'trypsin', 2) == mc_levels
+    assert len(set(all_peptides)) == len(all_peptides)
+
+    provenance = digest_proteome_provenance(protein_list, 'trypsin', 2, il_equivalence=False)
+    assert {mc: list(hits) for mc, hits in provenance.items()} == mc_levels
+    sequences = dict(protein_list)
+    for hits in provenance.values():
+        for peptide, origins in hits.items():
+            for protein_id, position in origins:
+                assert sequences[protein_id][position - 1:position - 1 + len(peptide)] == peptide
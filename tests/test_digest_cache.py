@@ -0,0 +1,87 @@
+from os import path
+import pytest
+
+from lib.CoMPaseD_digest_cache import fasta_checksum, mapped_digest_cache_entries, digest_cache_file, is_cached, \
+    store_mapped_digest, iter_cached_mappings, cache_mapped_rows, mapped_digest_header
+
+default_settings = {'fasta_hash': 'a' * 64, 'protease': 'trypsin', 'max_mc': 2, 'min_mass': 400, 'max_mass': 6000,
+                    'min_len': 6, 'max_len': 55, 'clip_n_term_met': 'T', 'il_equivalence': True,
+                    'indexing_key_len': 5, 'digestion_engine': 'native', 'peptide_mapping': 'exact'}
+
+
+def cache_entries(cache_dir, **changed_settings):
+    return mapped_digest_cache_entries(cache_dir, **{**default_settings, **changed_settings})
+
+
+def test_fasta_checksum_depends_on_content_only(tmp_path, test_fasta):
+    copied_fasta = tmp_path / 'copy.fasta'
+    with open(test_fasta) as handle:
+        content = handle.read()
+    copied_fasta.write_text(content)
+    assert fasta_checksum(str(copied_fasta)) == fasta_checksum(test_fasta)
+    copied_fasta.write_text(content.replace('MSTPKLEIVAGR', 'MSTPKLEIVAGK'))
+    assert fasta_checksum(str(copied_fasta)) != fasta_checksum(test_fasta)
+
+
+def test_cache_entries_per_mc_level(tmp_path):
+    entries = cache_entries(str(tmp_path))
+    assert sorted(entries) == [0, 1, 2]
+    assert len({cache_file for cache_file, _ in entries.values()}) == 3
+    for mc, (cache_file, cache_params) in entries.items():
+        assert cache_params['mc'] == mc
+        assert cache_file == digest_cache_file(str(tmp_path), cache_params)
+        assert cache_file.startswith(str(tmp_path))
+    # fewer missed cleavages share the entries of the lower levels
+    assert cache_entries(str(tmp_path), max_mc=1) == {mc: entries[mc] for mc in (0, 1)}
+
+
+@pytest.mark.parametrize('changed_settings', [{'fasta_hash': 'b' * 64}, {'protease': 'lysarginase'},
+                                              {'protease': 'custom[RK]|[X]'}, {'min_mass': 500},
+                                              {'max_mass': 5000}, {'min_len': 7}, {'max_len': 40},
+                                              {'clip_n_term_met': 'F'}, {'il_equivalence': False},
+                                              {'indexing_key_len': 4}, {'indexing_key_len': 'auto'},
+                                              {'digestion_engine': 'crux'}, {'peptide_mapping': 'provenance'}])
+def test_cache_misses_if_settings_change(tmp_path, changed_settings):
+    entries = cache_entries(str(tmp_path))
+    for cache_file, cache_params in entries.values():
+        store_mapped_digest(cache_file, [mapped_digest_header], cache_params)
+    changed_entries = cache_entries(str(tmp_path), **changed_settings)
+    for mc, (cache_file, _) in changed_entries.items():
+        assert cache_file != entries[mc][0]
+        assert not is_cached(cache_file)
+
+
+def test_cache_hits_for_equivalent_settings(tmp_path):
+    entries = cache_entries(str(tmp_path))
+    # named and custom enzymes with the same cleavage rule and equal numbers of different types
+    assert cache_entries(str(tmp_path), protease='custom[RK]|{P}') == entries
+    assert cache_entries(str(tmp_path), min_mass='400', max_len=55.0, clip_n_term_met='true',
+                         indexing_key_len='5') == entries
+
+
+def test_store_mapped_digest_round_trip(tmp_path):
+    cache_file, cache_params = cache_entries(str(tmp_path))[1]
+    mapped_rows = [('PEPTIDEK', 'P1', 12), ('PEPTIDEK', 'P2', 3), ('AGLLIVK', 'P1', 40)]
+    assert not is_cached(cache_file)
+    store_mapped_digest(cache_file, [mapped_digest_header] + [f'{pept}\t{protein}\t{location}\tK\tT\tA\n'
+                                                              for pept, protein, location in mapped_rows],
+                        cache_params)
+    assert is_cached(cache_file)
+    assert not path.isfile(f"{cache_file}.tmp")
+    assert list(iter_cached_mappings(cache_file, chunk_size=2)) == mapped_rows
+
+
+def test_cache_mapped_rows_only_stores_complete_digests(tmp_path):
+    cache_file, cache_params = cache_entries(str(tmp_path))[0]
+    mapped_rows = [('PEPTIDEK', 'P1', 12), ('PEPTIDEK', 'P2', 3), ('AGLLIVK', 'P1', 40)]
+
+    # an interrupted digest leaves no cache entry behind
+    row_iter = cache_mapped_rows(iter(mapped_rows), cache_file, cache_params)
+    next(row_iter)
+    row_iter.close()
+    assert not is_cached(cache_file)
+    assert not path.isfile(f"{cache_file}.tmp")
+
+    assert list(cache_mapped_rows(iter(mapped_rows), cache_file, cache_params)) == mapped_rows
+    assert is_cached(cache_file)
+    assert list(iter_cached_mappings(cache_file)) == mapped_rows
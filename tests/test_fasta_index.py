@@ -0,0 +1,110 @@
+import struct
+from os import path
+
+import numpy as np
+import pytest
+
+from lib.CoMPaseD_digest import load_fasta_sequences
+from lib.CoMPaseD_digest_cache import fasta_checksum
+from lib.CoMPaseD_fasta_index import FastaIndex, SuffixArrayIndex, ShardedIndex, write_index_file, map_index_file, \
+    read_index_header, check_index, index_file_name, index_magic, index_version, index_alignment
+
+
+def test_index_file_round_trip(tmp_path):
+    index_file = str(tmp_path / 'test.cidx')
+    sections = {'bytes': np.frombuffer(b'PEPTIDE\nK', dtype=np.uint8),
+                'int32': np.arange(-5, 6, dtype=np.int32),
+                'int64': np.array([0, 1, 2 ** 40], dtype=np.int64),
+                'empty': np.zeros(0, dtype=np.int64)}
+    write_index_file(index_file, {'index_type': 'kmer', 'split_len': 5}, sections)
+
+    header, mapped = map_index_file(index_file)
+    assert header['index_type'] == 'kmer'
+    assert header['split_len'] == 5
+    assert list(mapped) == list(sections)
+    for name, array in sections.items():
+        assert mapped[name].dtype == array.dtype
+        np.testing.assert_array_equal(mapped[name], array)
+        assert (header['data_start'] + header['sections'][name]['offset']) % index_alignment == 0
+    # sections are read-only views of the file
+    with pytest.raises(ValueError):
+        mapped['int32'][0] = 1
+
+
+def test_index_file_rejects_other_files_and_versions(tmp_path):
+    index_file = tmp_path / 'test.cidx'
+    write_index_file(str(index_file), {'index_type': 'kmer'}, {'data': np.arange(3, dtype=np.int64)})
+    content = index_file.read_bytes()
+
+    wrong_magic = tmp_path / 'wrong_magic.cidx'
+    wrong_magic.write_bytes(b'X' + content[1:])
+    with pytest.raises(ValueError, match='not a CoMPaseD fasta index'):
+        read_index_header(str(wrong_magic))
+    with pytest.raises(ValueError):
+        map_index_file(str(wrong_magic))
+
+    wrong_version = tmp_path / 'wrong_version.cidx'
+    wrong_version.write_bytes(index_magic + struct.pack('<I', index_version + 1) + content[len(index_magic) + 4:])
+    with pytest.raises(ValueError, match='format version'):
+        read_index_header(str(wrong_version))
+
+
+def test_check_index_rejects_wrong_magic_and_version(test_fasta, tmp_path):
+    index_file = index_file_name(test_fasta, 'kmer')
+    FastaIndex.from_fasta(test_fasta).save(index_file, fasta=test_fasta, fasta_hash=fasta_checksum(test_fasta))
+    assert check_index(index_file, test_fasta) == (True, '')
+
+    content = open(index_file, 'rb').read()
+    with open(index_file, 'wb') as handle:
+        handle.write(index_magic + struct.pack('<I', index_version + 1) + content[len(index_magic) + 4:])
+    valid, reason = check_index(index_file, test_fasta)
+    assert not valid
+    assert 'format version' in reason
+
+    with open(index_file, 'wb') as handle:
+        handle.write(b'>not an index\n' + content)
+    assert not check_index(index_file, test_fasta)[0]
+
+
+def test_check_index_detects_changed_settings_and_fasta(test_fasta):
+    index_file = index_file_name(test_fasta, 'kmer')
+    FastaIndex.from_fasta(test_fasta, split_len=5).save(index_file, fasta=test_fasta,
+                                                        fasta_hash=fasta_checksum(test_fasta))
+    assert check_index(index_file, test_fasta, split_len=5)[0]
+    assert not check_index(index_file, test_fasta, split_len=4)[0]
+    assert not check_index(index_file, test_fasta, split_len=5, il_equivalence=False)[0]
+    assert not check_index(index_file, test_fasta, index_type='suffix-array')[0]
+
+    with open(test_fasta, 'a') as handle:
+        handle.write('>added\nPEPTIDEK\n')
+    valid, reason = check_index(index_file, test_fasta, split_len=5)
+    assert not valid
+    assert reason == 'fasta file content changed'
+
+
+@pytest.mark.parametrize('index_class', [FastaIndex, SuffixArrayIndex])
+def test_saved_index_maps_like_built_index(test_fasta, index_class):
+    protein_list = load_fasta_sequences(test_fasta)
+    peptides = [sequence[start:start + 12] for _, sequence in protein_list for start in range(0, 120, 17)]
+    built_idx = index_class.build(protein_list)
+    index_file = index_file_name(test_fasta, built_idx.index_type)
+    built_idx.save(index_file, fasta=test_fasta)
+
+    loaded_idx = index_class.load(index_file)
+    assert list(loaded_idx.protein_ids) == [protein_id for protein_id, _ in protein_list]
+    assert list(loaded_idx.iter_mappings(peptides)) == list(built_idx.iter_mappings(peptides))
+
+
+def test_sharded_index_rebuild_removes_old_shards(test_fasta):
+    index_file = index_file_name(test_fasta, 'sharded')
+    sharded_idx = ShardedIndex.from_fasta(test_fasta, index_file, 'kmer', memory_budget=1)
+    sharded_idx.save(index_file, fasta=test_fasta)
+    old_shards = ShardedIndex.shard_paths(index_file, read_index_header(index_file))
+
+    sharded_idx = ShardedIndex.from_fasta(test_fasta, index_file, 'suffix-array', memory_budget=1)
+    sharded_idx.save(index_file, fasta=test_fasta)
+    new_shards = ShardedIndex.shard_paths(index_file, read_index_header(index_file))
+    assert all(shard_file.endswith('.csa') for shard_file in new_shards)
+    assert old_shards
+    assert not any(path.isfile(shard_file) for shard_file in old_shards)
+
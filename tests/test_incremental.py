@@ -0,0 +1,82 @@
+import json
+import subprocess
+import sys
+from os import path
+
+import pandas as pd
+
+from lib.CoMPaseD_digest_cache import digestion_settings
+from lib.CoMPaseD_PeptideMapper import read_previous_digests
+
+peptide_mapper = path.join(path.dirname(path.dirname(path.abspath(__file__))), 'lib', 'CoMPaseD_PeptideMapper.py')
+
+
+def run_settings(min_len=6, fasta_hash='a' * 64):
+    return digestion_settings(fasta_hash, 400, 6000, min_len, 55, 'T', True, 5, 'native')
+
+
+def write_previous_digest(out_folder, settings):
+    unfiltered_file = path.join(out_folder, 'unique_peptides_table_unfiltered.tsv')
+    settings_file = path.join(out_folder, 'digestion_settings.json')
+    pd.DataFrame({'peptide': ['PEPTIDEK', 'AGLLIVK'], 'protein': ['P1', 'P2'], 'location': [12, 40], 'MC': [0, 1],
+                  'Enzyme': ['trypsin', 'trypsin']}).to_csv(unfiltered_file, index=False, sep='\t')
+    with open(settings_file, 'w') as f:
+        json.dump(settings, f)
+    return unfiltered_file, settings_file
+
+
+def test_read_previous_digests_with_identical_settings(tmp_path):
+    unfiltered_file, settings_file = write_previous_digest(str(tmp_path), run_settings())
+    previous_df = read_previous_digests(unfiltered_file, settings_file, run_settings())
+    assert previous_df['peptide'].tolist() == ['PEPTIDEK', 'AGLLIVK']
+    assert previous_df['MC'].tolist() == [0, 1]
+
+
+def test_read_previous_digests_misses_if_settings_change(tmp_path):
+    unfiltered_file, settings_file = write_previous_digest(str(tmp_path), run_settings())
+    assert read_previous_digests(unfiltered_file, settings_file, run_settings(min_len=7)) is None
+    assert read_previous_digests(unfiltered_file, settings_file, run_settings(fasta_hash='b' * 64)) is None
+
+
+def test_read_previous_digests_misses_without_table_or_settings(tmp_path):
+    unfiltered_file, settings_file = write_previous_digest(str(tmp_path), run_settings())
+    assert read_previous_digests(path.join(str(tmp_path), 'missing.tsv'), settings_file, run_settings()) is None
+    assert read_previous_digests(unfiltered_file, path.join(str(tmp_path), 'missing.json'), run_settings()) is None
+
+
+def run_peptide_mapper(fasta, out_folder, enzyme_list, max_mc_list, *options):
+    result = subprocess.run([sys.executable, peptide_mapper, '--fasta', fasta, '--out_folder', out_folder,
+                             '--enzyme_list', enzyme_list, '--max_mc_list', max_mc_list, '--digestion_engine', 'native',
+                             '--threads', '1', *options], capture_output=True, text=True, cwd=path.dirname(fasta))
+    assert result.returncode == 0, result.stdout + result.stderr
+    return result.stdout
+
+
+def read_pooled_tables(out_folder):
+    return [pd.read_csv(path.join(out_folder, f'unique_peptides_table_{table}.tsv'), sep='\t')
+            for table in ('unfiltered', 'filtered')]
+
+
+def test_incremental_digestion_matches_complete_digestion(tmp_path, test_fasta):
+    complete_folder = str(tmp_path / 'complete')
+    incremental_folder = str(tmp_path / 'incremental')
+    run_peptide_mapper(test_fasta, complete_folder, 'trypsin,lysarginase', '2,1')
+    run_peptide_mapper(test_fasta, incremental_folder, 'trypsin', '2', '--incremental')
+    log = run_peptide_mapper(test_fasta, incremental_folder, 'trypsin,lysarginase', '2,1', '--incremental')
+    assert 'Re-using 1 of 2 digests' in log
+
+    for complete_df, incremental_df in zip(read_pooled_tables(complete_folder), read_pooled_tables(incremental_folder)):
+        pd.testing.assert_frame_equal(incremental_df, complete_df)
+
+
+def test_incremental_digestion_misses_if_settings_change(tmp_path, test_fasta):
+    complete_folder = str(tmp_path / 'complete')
+    incremental_folder = str(tmp_path / 'incremental')
+    run_peptide_mapper(test_fasta, complete_folder, 'trypsin', '2', '--min_len', '8')
+    run_peptide_mapper(test_fasta, incremental_folder, 'trypsin', '2', '--incremental')
+    log = run_peptide_mapper(test_fasta, incremental_folder, 'trypsin', '2', '--min_len', '8', '--incremental')
+    assert 'different fasta file or digestion settings' in log
+    assert 'Re-using previous digest' not in log
+
+    for complete_df, incremental_df in zip(read_pooled_tables(complete_folder), read_pooled_tables(incremental_folder)):
+        pd.testing.assert_frame_equal(incremental_df, complete_df)
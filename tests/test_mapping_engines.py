@@ -0,0 +1,77 @@
+import pytest
+
+from lib.CoMPaseD_digest import load_fasta_sequences, digest_proteome_mc_levels
+from lib.CoMPaseD_fasta_index import FastaIndex, MultiKeyIndex, SuffixArrayIndex, ShardedIndex, index_file_name
+from lib.CoMPaseD_mapping_engines import iter_engine_mappings, MappingMemo, ahocorasick
+
+
+@pytest.fixture
+def protein_list(test_fasta):
+    return load_fasta_sequences(test_fasta)
+
+
+@pytest.fixture
+def peptides(protein_list):
+    """tryptic peptides of the test proteome, peptides with I and L, a peptide longer than 64 residues and
+    peptides that are not part of the proteome"""
+    mc_levels = digest_proteome_mc_levels(protein_list, 'trypsin', 2)
+    peptide_list = [peptide for peptide_list in mc_levels.values() for peptide in peptide_list]
+    first_sequence = protein_list[0][1]
+    peptide_list.extend([first_sequence[0:70], first_sequence[3:12].replace('L', 'I'), 'WWWWWWWW', 'PEPTIDEK'])
+    return peptide_list
+
+
+def brute_force_mappings(peptide_list, protein_list):
+    """(peptide, protein number, 1-based position) of all occurrences with I/L equivalence by string search"""
+    sequences = [sequence.replace('I', 'L') for _, sequence in protein_list]
+    mappings = set()
+    for pept in peptide_list:
+        pept = pept.replace('I', 'L')
+        for protein_number, sequence in enumerate(sequences):
+            position = sequence.find(pept)
+            while position >= 0:
+                mappings.add((pept, protein_number, position + 1))
+                position = sequence.find(pept, position + 1)
+    return mappings
+
+
+def test_index_mappings_match_string_search(protein_list, peptides):
+    mappings = list(iter_engine_mappings(peptides, FastaIndex.build(protein_list), 'index'))
+    assert set(mappings) == brute_force_mappings(peptides, protein_list)
+    # the synthetic protein repeats a peptide of the first protein, once with I instead of L
+    assert any(protein_number == len(protein_list) - 1 for _, protein_number, _ in mappings)
+
+
+@pytest.mark.parametrize('depth', [64, 4])
+def test_suffix_array_mappings_equal_index_mappings(protein_list, peptides, depth):
+    index_mappings = list(iter_engine_mappings(peptides, FastaIndex.build(protein_list), 'index'))
+    suffix_idx = SuffixArrayIndex.build(protein_list, depth=depth)
+    assert list(iter_engine_mappings(peptides, suffix_idx, 'suffix-array')) == index_mappings
+
+
+@pytest.mark.skipif(ahocorasick is None, reason="package 'pyahocorasick' is not installed")
+def test_aho_corasick_mappings_equal_index_mappings(protein_list, peptides):
+    fasta_idx = FastaIndex.build(protein_list)
+    index_mappings = list(iter_engine_mappings(peptides, fasta_idx, 'index'))
+    assert list(iter_engine_mappings(peptides, fasta_idx, 'aho-corasick')) == index_mappings
+
+
+def test_multi_kmer_and_sharded_mappings_equal_index_mappings(test_fasta, protein_list, peptides):
+    index_mappings = list(iter_engine_mappings(peptides, FastaIndex.build(protein_list), 'index'))
+    multi_idx = MultiKeyIndex.build(protein_list, 'auto')
+    assert list(iter_engine_mappings(peptides, multi_idx, 'index')) == index_mappings
+
+    index_file = index_file_name(test_fasta, 'sharded')
+    ShardedIndex.from_fasta(test_fasta, index_file, 'suffix-array', memory_budget=1).save(index_file, fasta=test_fasta)
+    assert list(iter_engine_mappings(peptides, ShardedIndex.load(index_file), 'suffix-array')) == index_mappings
+
+
+def test_mapping_memo_equals_index_mappings(protein_list, peptides):
+    fasta_idx = FastaIndex.build(protein_list)
+    mapping_memo = MappingMemo(fasta_idx)
+    mapping_memo.add(peptides)
+    half = len(peptides) // 2
+    for peptide_list in (peptides[:half], peptides[half:], peptides):
+        assert list(mapping_memo.iter_mappings(peptide_list)) == \
+            list(iter_engine_mappings(peptide_list, fasta_idx, 'index'))
+    assert mapping_memo.requested_count == 2 * len(peptides)
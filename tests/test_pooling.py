@@ -0,0 +1,59 @@
+import pandas as pd
+import pytest
+
+from lib.CoMPaseD_digest import load_fasta_sequences, digest_proteome_mc_levels
+from lib.CoMPaseD_fasta_index import FastaIndex
+from lib.CoMPaseD_PeptideMapper import stream_mapped_digests, iter_protein_mappings
+from lib.CoMPaseD_external_pool import external_pool_mapped_digests
+
+pooled_cols = ['peptide', 'protein', 'location', 'MC', 'Enzyme']
+
+
+@pytest.fixture
+def mapped_digests(test_fasta):
+    """(protease, mc, mapped rows) of the test proteome in pooling order"""
+    protein_list = load_fasta_sequences(test_fasta)
+    fasta_idx = FastaIndex.build(protein_list)
+    mapped_digests = list()
+    for protease, max_mc in [('trypsin', 2), ('lysarginase', 1)]:
+        mc_levels = digest_proteome_mc_levels(protein_list, protease, max_mc)
+        for mc in range(max_mc + 1):
+            mapped_digests.append((protease, mc, list(iter_protein_mappings(mc_levels[mc], fasta_idx))))
+    return mapped_digests
+
+
+def read_pooled(table_file):
+    return pd.read_csv(table_file, sep='\t', dtype=str, keep_default_na=False)
+
+
+def test_streaming_pooling_matches_memory_pooling(tmp_path, mapped_digests):
+    stream_mapped_digests(iter(mapped_digests), tmp_path / 'unfiltered.tsv', tmp_path / 'filtered.tsv', chunk_size=50)
+
+    expected = pd.DataFrame([(pept, protein, str(location), str(mc), protease)
+                             for protease, mc, rows in mapped_digests for pept, protein, location in rows],
+                            columns=pooled_cols)
+    pd.testing.assert_frame_equal(read_pooled(tmp_path / 'unfiltered.tsv'), expected)
+
+    # first match of each peptide within a protein per protease, sorted by decreasing MC in pooling order
+    expected = expected.drop_duplicates(subset=['peptide', 'Enzyme', 'protein'], keep='first')
+    expected = expected.sort_values('MC', key=lambda mc: mc.astype(int), ascending=False, kind='stable')
+    pd.testing.assert_frame_equal(read_pooled(tmp_path / 'filtered.tsv'), expected.reset_index(drop=True))
+    assert not list(tmp_path.glob('*.tmp'))
+
+
+def test_external_pooling_matches_streaming_pooling(tmp_path, mapped_digests):
+    stream_mapped_digests(iter(mapped_digests), tmp_path / 'stream_unfiltered.tsv', tmp_path / 'stream_filtered.tsv',
+                          chunk_size=50)
+    # small runs to merge several sorted run files
+    external_pool_mapped_digests(iter(mapped_digests), tmp_path / 'external_unfiltered.tsv',
+                                 tmp_path / 'external_filtered.tsv', str(tmp_path), chunk_size=50, run_size=100)
+
+    assert (tmp_path / 'external_unfiltered.tsv').read_text() == (tmp_path / 'stream_unfiltered.tsv').read_text()
+    stream_filtered = read_pooled(tmp_path / 'stream_filtered.tsv')
+    external_filtered = read_pooled(tmp_path / 'external_filtered.tsv')
+    pd.testing.assert_frame_equal(external_filtered[pooled_cols], stream_filtered)
+
+    # number of proteins per peptide, MC and protease as calculated by the analysis script
+    protein_count = stream_filtered.groupby(['peptide', 'MC', 'Enzyme'])['protein'].transform('nunique')
+    assert external_filtered['protein_count'].astype(int).tolist() == protein_count.tolist()
+    assert not list(tmp_path.glob('pooling_*'))
@@ -0,0 +1,66 @@
+import os
+import sys
+from threading import Event
+from time import sleep, perf_counter
+
+import pytest
+
+from lib.CoMPaseD_process_runner import run_commands, commands_failed
+
+python_cmd = f'"{sys.executable}" -c'
+
+
+def test_run_commands_in_order(capsys):
+    cmd_list = [f'{python_cmd} "print(\'first\')"', f'{python_cmd} "print(\'skip this\'); print(\'second\')"']
+    results = run_commands(cmd_list, max_workers=2, line_filter=lambda line: not line.startswith('skip'))
+    assert [return_code for return_code, _ in results] == [0, 0]
+    assert not commands_failed(results)
+    output = capsys.readouterr().out
+    assert 'first' in output and 'second' in output
+    assert 'skip this' not in output
+
+
+def test_failed_command_is_reported():
+    results = run_commands([f'{python_cmd} "pass"', f'{python_cmd} "import sys; sys.exit(3)"'], max_workers=1)
+    assert [return_code for return_code, _ in results] == [0, 3]
+    assert commands_failed(results)
+
+
+def is_running(pid) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    # terminated processes that were not reaped yet
+    try:
+        with open(f'/proc/{pid}/stat') as handle:
+            return not handle.read().rsplit(')', 1)[1].split()[0] == 'Z'
+    except OSError:
+        return True
+
+
+@pytest.mark.skipif(os.name == 'nt', reason="process groups are POSIX only")
+def test_cancel_terminates_started_processes():
+    cancel_event = Event()
+    child_pids = list()
+
+    def cancel_after_start(line):
+        # the shell prints the process id of the command it started in the background
+        child_pids.append(int(line))
+        cancel_event.set()
+        return False
+
+    time_start = perf_counter()
+    results = run_commands(['sleep 60 & echo $!; wait', 'sleep 60'], max_workers=1, line_filter=cancel_after_start,
+                           cancel_event=cancel_event)
+    assert perf_counter() - time_start < 30
+    assert results[0][0] != 0
+    # the second command is skipped
+    assert results[1][0] is None
+    assert commands_failed(results)
+
+    for _ in range(50):
+        if not is_running(child_pids[0]):
+            break
+        sleep(0.1)
+    assert not is_running(child_pids[0])
@@ -0,0 +1,77 @@
+from os import path
+
+import pandas as pd
+import pytest
+
+from lib.CoMPaseD_table_io import read_table, write_table, convert_tsv_table, table_file_name, find_table_file, \
+    table_format_of
+
+dictionary_cols = ['protein', 'Enzyme']
+
+
+@pytest.fixture
+def pooled_df():
+    return pd.DataFrame({'peptide': ['PEPTIDEK', 'PEPTIDEK', 'AGLLIVK', 'MSTPKLEIVAGR', 'LEIVAGR'],
+                         'protein': ['P1', 'P2', 'P1', 'TEST01', 'TEST01'],
+                         'location': [12, 3, 40, 121, 126],
+                         'MC': [0, 0, 1, 1, 0],
+                         'Enzyme': ['trypsin', 'trypsin', 'trypsin', 'lysarginase', 'lysarginase']})
+
+
+def test_table_file_names(tmp_path):
+    assert table_file_name('results.tsv', 'parquet') == 'results.parquet'
+    assert table_file_name('results.parquet', 'feather') == 'results.feather'
+    assert table_file_name('results', 'tsv') == 'results.tsv'
+    assert table_format_of('results.FEATHER') == 'feather'
+    assert table_format_of('results.txt') == 'tsv'
+
+    # tables written in another format than requested are found as well
+    tsv_file = str(tmp_path / 'results.tsv')
+    assert find_table_file(tsv_file, 'parquet') == tsv_file
+    (tmp_path / 'results.feather').write_text('')
+    assert find_table_file(tsv_file, 'parquet') == str(tmp_path / 'results.feather')
+    (tmp_path / 'results.parquet').write_text('')
+    assert find_table_file(tsv_file, 'parquet') == str(tmp_path / 'results.parquet')
+
+
+def test_tsv_round_trip(tmp_path, pooled_df):
+    tsv_file = str(tmp_path / 'pooled.tsv')
+    write_table(pooled_df, tsv_file, dictionary_cols)
+    pd.testing.assert_frame_equal(read_table(tsv_file), pooled_df, check_dtype=False)
+    pd.testing.assert_frame_equal(read_table(tsv_file, columns=['peptide', 'MC']), pooled_df[['peptide', 'MC']],
+                                  check_dtype=False)
+
+
+@pytest.mark.parametrize('table_format', ['parquet', 'feather'])
+def test_binary_round_trip(tmp_path, pooled_df, table_format):
+    pytest.importorskip('pyarrow')
+    table_file = str(tmp_path / f'pooled.{table_format}')
+    write_table(pooled_df, table_file, dictionary_cols)
+    # dictionary-encoded columns are read as plain strings
+    pd.testing.assert_frame_equal(read_table(table_file), pooled_df, check_dtype=False)
+    assert not isinstance(read_table(table_file)['protein'].dtype, pd.CategoricalDtype)
+    pd.testing.assert_frame_equal(read_table(table_file, columns=['peptide', 'MC']), pooled_df[['peptide', 'MC']],
+                                  check_dtype=False)
+
+
+@pytest.mark.parametrize('table_format', ['parquet', 'feather'])
+def test_convert_tsv_table(tmp_path, pooled_df, table_format):
+    pytest.importorskip('pyarrow')
+    tsv_file = str(tmp_path / 'pooled.tsv')
+    write_table(pooled_df, tsv_file)
+    # several parquet row groups with different dictionaries
+    out_file = convert_tsv_table(tsv_file, table_format, dictionary_cols, keep_tsv=True, chunk_size=2)
+    assert out_file == str(tmp_path / f'pooled.{table_format}')
+    pd.testing.assert_frame_equal(read_table(out_file), read_table(tsv_file))
+
+    convert_tsv_table(tsv_file, table_format, dictionary_cols, chunk_size=2)
+    assert not path.isfile(tsv_file)
+
+
+def test_convert_empty_tsv_table(tmp_path, pooled_df):
+    pytest.importorskip('pyarrow')
+    tsv_file = str(tmp_path / 'pooled.tsv')
+    write_table(pooled_df.iloc[0:0], tsv_file)
+    out_file = convert_tsv_table(tsv_file, 'parquet', dictionary_cols)
+    assert read_table(out_file).columns.tolist() == pooled_df.columns.tolist()
+    assert len(read_table(out_file)) == 0